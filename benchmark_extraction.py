@@ -0,0 +1,76 @@
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+import fast_extraction
+from constants import ANIMES_ARCHIVE, TOP_CHARTS_ARCHIVE
+from page_archive import PageArchive
+from parse_pages import parse_anime
+
+NUM_PAGES = 500  # How many pages of each archive to benchmark at most
+
+
+def time_per_page(function, pages: list[bytes]) -> tuple[float, list]:
+    """Apply a function to each page, returning the average time per page (in ms) and the results."""
+    start = time.perf_counter()
+    results = [function(page) for page in pages]
+    return (time.perf_counter() - start) * 1000 / max(1, len(pages)), results
+
+
+def slow_anime_urls(page: bytes) -> list[str]:
+    """Extract the URLs in a top chart page like `extract_anime_urls.py` used to, with BeautifulSoup."""
+    soup = BeautifulSoup(page, "lxml")
+    return [anime.find_all("td")[1].a.get("href") for anime in soup.find_all("tr", class_="ranking-list")]
+
+
+def fast_anime_urls(page: bytes) -> list[str]:
+    return fast_extraction.extract_anime_urls(fast_extraction.parse_page(page))
+
+
+def anime_fields(page: bytes, fast: bool) -> dict:
+    """Parse an anime's page, returning its fields (or the error, for pages that can't be parsed)."""
+    try:
+        return vars(parse_anime(page, 0, fast=fast))
+    except Exception as err:
+        return {"error": type(err).__name__}
+
+
+def compare(name: str, slow_function, fast_function, pages: list[bytes]) -> bool:
+    """Benchmark the BeautifulSoup and lxml extractions on some pages, checking that they give the same results."""
+    slow_time, slow_results = time_per_page(slow_function, pages)
+    fast_time, fast_results = time_per_page(fast_function, pages)
+
+    mismatches = [i for i, (slow, fast) in enumerate(zip(slow_results, fast_results)) if slow != fast]
+
+    print(f"{name} ({len(pages)} pages):")
+    print(f"  BeautifulSoup: {slow_time:.2f} ms/page")
+    print(f"  lxml:          {fast_time:.2f} ms/page ({slow_time / max(fast_time, 1e-9):.1f}x faster)")
+    print(f"  {len(mismatches)} pages with different output" + (f": {mismatches[:10]}" if mismatches else ""))
+
+    return not mismatches
+
+
+if __name__ == "__main__":
+    """
+    This script compares the time needed to parse and extract the information from the downloaded pages with
+    BeautifulSoup and with lxml (see `fast_extraction.py`), and checks that both give the same output.
+    """
+    all_equal = True
+
+    archive = PageArchive(TOP_CHARTS_ARCHIVE)
+    pages = [archive.get(key) for key in archive.keys()[:NUM_PAGES]]
+    all_equal &= compare("Top chart pages", slow_anime_urls, fast_anime_urls, pages)
+
+    archive = PageArchive(ANIMES_ARCHIVE)
+    keys = archive.keys()[:NUM_PAGES]
+    pages = [archive.get(key) for key in keys]
+    all_equal &= compare(
+        "Anime pages",
+        lambda page: anime_fields(page, fast=False),
+        lambda page: anime_fields(page, fast=True),
+        pages
+    )
+
+    if not all_equal:
+        sys.exit(1)
@@ -0,0 +1,59 @@
+import time
+from pathlib import Path
+
+from constants import SEARCH_INFO_DIRECTORY
+from create_second_index import build_second_index
+from first_index_utils import load_first_index
+from second_index_utils import tf, idf, build_second_index_matrix, compute_document_norms
+from utils import load_search_info_words, load_vocabulary
+
+
+def build_second_index_per_word(
+        num_all_documents: int, documents_words: list[set[str]], vocabulary: dict[str, int],
+        first_index: list[list[int]]
+) -> list[list[tuple[int, float]]]:
+    """
+    Build the second index like `create_second_index.py` used to, computing tf and idf again for each word.
+    """
+    index = [[] for i in range(len(vocabulary))]
+
+    for i, words in enumerate(documents_words):
+        for word in words:
+            if word in vocabulary:
+                _tf = tf(words)
+                num_documents_containing_term = len(first_index[vocabulary[word]])
+                _idf = idf(num_all_documents, num_documents_containing_term)
+
+                index[vocabulary[word]].append((i, _tf * _idf))
+
+    return index
+
+
+if __name__ == "__main__":
+    """
+    This script compares the time needed to build the second index (and the documents' norms) before and after
+    computing the idf once per term, checking that both give the same index.
+
+    The synopses are read beforehand, so that only the computations are timed.
+    """
+    num_all_documents = len(list(Path(SEARCH_INFO_DIRECTORY).glob("*.txt")))
+    vocabulary = load_vocabulary()
+    first_index = load_first_index()
+    documents_words = [set(load_search_info_words(i)) for i in range(num_all_documents)]
+
+    start = time.perf_counter()
+    index_before = build_second_index_per_word(num_all_documents, documents_words, vocabulary, first_index)
+    time_before = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index_after = build_second_index(num_all_documents, documents_words, vocabulary, first_index)
+    time_after = time.perf_counter() - start
+
+    start = time.perf_counter()
+    compute_document_norms(build_second_index_matrix(index_after, num_all_documents))
+    time_norms = time.perf_counter() - start
+
+    print(f"Per-word tf and idf: {time_before:.2f} s")
+    print(f"Idf once per term:   {time_after:.2f} s ({time_before / time_after:.1f}x faster)")
+    print(f"Documents' norms:    {time_norms:.2f} s")
+    print("Same index" if index_before == index_after else "The indexes differ!")
@@ -0,0 +1,303 @@
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+from constants import PARSED_ANIMES_DIRECTORY, SEARCH_INFO_DIRECTORY, METADATA_FILE, LEMMA_CACHE_FILE
+from synthetic_corpus import generate_corpus, regenerate_search_info
+
+SCALES = {"20k": 20_000, "200k": 200_000, "2m": 2_000_000}  # Number of documents of each corpus scale
+SCALE = os.environ.get("BENCHMARK_SCALE", "20k")  # A scale's name, or a number of documents
+SEED = 0  # The seed of the synthetic corpus and of the queries
+
+NUM_QUERIES = 200  # How many queries of each mode to time
+
+RESULTS_FILE = "benchmark_results.json"  # The file in which to save the results of the latest run
+BASELINE_FILE = "benchmark_baseline.json"  # The results to compare with, saved from the first run if missing
+REGRESSION_TOLERANCE = 0.2  # Relative slowdown (or memory increase) above which a metric counts as a regression
+# Absolute differences below these are considered noise, whatever their relative size
+MIN_SECONDS_DIFFERENCE = 0.05
+MIN_MILLISECONDS_DIFFERENCE = 0.1
+MIN_MEGABYTES_DIFFERENCE = 10
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_stage(command: list[str], directory: str) -> dict:
+    """
+    Run a command in a directory, returning its duration, exit code, output and peak resident memory.
+
+    The peak memory is the largest of the process and of its worker processes.
+    """
+    environment = dict(os.environ, PYTHONPATH=REPOSITORY_DIRECTORY)
+
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=directory, env=environment, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.stdout.read().decode("utf-8", errors="replace")
+    _, status, usage = os.wait4(process.pid, 0)  # Unlike `wait`, also returns the process' resource usage
+    seconds = time.perf_counter() - start
+
+    process.returncode = os.waitstatus_to_exitcode(status)
+    process.stdout.close()
+
+    # The maximum resident set size is in kilobytes on Linux, in bytes on macOS
+    peak_rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+    return {
+        "seconds": seconds,
+        "exit_code": process.returncode,
+        "peak_rss_mb": peak_rss / (1024 * 1024),
+        "output": output,
+    }
+
+
+def run_script(script: str, directory: str) -> dict:
+    return run_stage([sys.executable, os.path.join(REPOSITORY_DIRECTORY, script)], directory)
+
+
+def remove(directory: str, *paths: str):
+    """Remove files or directories from the corpus directory, so that a stage doesn't skip work already done."""
+    for path in paths:
+        path = os.path.join(directory, path)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def error_summary(output: str) -> str:
+    """Return the exception a failed stage ended with, followed by its message if on the next lines."""
+    lines = [line.strip() for line in output.strip().splitlines()]
+    lines = [line for line in lines if line and line.strip("*=-")]  # Skip the banners some errors are framed with
+
+    for i in range(len(lines) - 1, -1, -1):
+        if re.match(r"^[\w.]+(Error|Exception)\b", lines[i]):
+            return " ".join(lines[i:i + 2]) if lines[i].endswith(":") else lines[i]
+
+    return lines[-1] if lines else "failed"
+
+
+def latency_summary(latencies: list[float]) -> dict[str, float]:
+    milliseconds = np.array(latencies) * 1000
+    p50, p90, p99 = np.percentile(milliseconds, [50, 90, 99])
+    return {
+        "queries": len(latencies),
+        "p50_ms": float(p50),
+        "p90_ms": float(p90),
+        "p99_ms": float(p99),
+        "mean_ms": float(milliseconds.mean()),
+        "queries_per_second": len(latencies) / float(np.sum(latencies)),
+    }
+
+
+def benchmark_queries(num_queries: int = NUM_QUERIES, seed: int = SEED) -> dict[str, dict[str, float]]:
+    """
+    Time the three query functions on queries made of words of random synopses, in the current directory.
+
+    The result cache is cleared before each query, so that the queries themselves are timed.
+    """
+    from custom_metrics_utils import run_custom_query
+    from first_index_utils import run_query_on_first_index
+    from query_cache import get_query_cache
+    from second_index_utils import run_query_on_second_index
+    from utils import load_search_info_words
+
+    rng = random.Random(seed)
+    num_documents = len(list(Path(SEARCH_INFO_DIRECTORY).glob("*.txt")))
+
+    def random_query(num_words: int) -> list[str]:
+        words = sorted(set(load_search_info_words(rng.randrange(num_documents))))
+        return rng.sample(words, min(num_words, len(words)))
+
+    modes: dict[str, tuple[Callable, list]] = {
+        "first_index": (run_query_on_first_index, [[random_query(rng.randint(1, 2))] for _ in range(num_queries)]),
+        "second_index": (run_query_on_second_index, [[random_query(rng.randint(2, 4))] for _ in range(num_queries)]),
+        "custom_metric": (
+            run_custom_query,
+            [[random_query(rng.randint(1, 3)), rng.choice(["popular", "unpopular"])] for _ in range(num_queries)]
+        ),
+    }
+
+    results = {}
+    cache = get_query_cache()
+
+    for mode, (run_query, queries) in modes.items():
+        start = time.perf_counter()
+        run_query(*queries[0])  # Loads the indexes used by the queries
+        load_seconds = time.perf_counter() - start
+
+        latencies = []
+        for arguments in queries:
+            cache.clear()
+            start = time.perf_counter()
+            run_query(*arguments)
+            latencies.append(time.perf_counter() - start)
+
+        results[mode] = dict(latency_summary(latencies), first_query_seconds=load_seconds)
+
+    return results
+
+
+def run_benchmark(directory: str, num_documents: int, seed: int = SEED) -> dict:
+    """
+    Run every stage of the pipeline and every query mode on a synthetic corpus, generating it first if needed.
+    """
+    results = {
+        "scale": SCALE,
+        "num_documents": num_documents,
+        "seed": seed,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "stages": {},
+        "queries": {},
+    }
+
+    corpus_file = os.path.join(directory, "corpus.json")
+    corpus = {"num_documents": num_documents, "seed": seed}
+    if os.path.exists(corpus_file):
+        with open(corpus_file, "r") as fin:
+            existing_corpus = json.load(fin)
+    else:
+        existing_corpus = None
+
+    if existing_corpus != corpus:
+        shutil.rmtree(directory, ignore_errors=True)
+
+        start = time.perf_counter()
+        generate_corpus(directory, num_documents, seed, verbose=False)
+        results["stages"]["generate_corpus"] = {"seconds": time.perf_counter() - start}
+
+        with open(corpus_file, "w") as fout:
+            json.dump(corpus, fout)
+
+    # Each stage: the script run, the files to remove first so that it does all its work, and what to restore after
+    stages: list[tuple[str, list[str], Optional[Callable[[], None]]]] = [
+        ("parse_pages.py", [PARSED_ANIMES_DIRECTORY, METADATA_FILE], None),
+        (
+            "extract_search_info.py",
+            [SEARCH_INFO_DIRECTORY, LEMMA_CACHE_FILE],
+            # The synthetic search info is restored, so that the next stages don't depend on the NLTK version
+            lambda: regenerate_search_info(directory, num_documents, seed)
+        ),
+        ("create_vocabulary.py", [], None),
+        ("create_first_index.py", [], None),
+        ("create_second_index.py", [], None),
+        ("build_indexes.py", [], None),
+        ("document_store.py", [], None),
+    ]
+
+    for script, paths_to_remove, restore in stages:
+        remove(directory, *paths_to_remove)
+
+        result = run_script(script, directory)
+        if restore is not None:
+            restore()
+
+        name = script[:-len(".py")]
+        output = result.pop("output")
+        if result["exit_code"] != 0:
+            result["error"] = error_summary(output)
+        result["items_per_second"] = num_documents / result["seconds"]
+        results["stages"][name] = result
+
+        status = "ok" if result["exit_code"] == 0 else f"FAILED ({result['error']})"
+        print(f"{name}: {result['seconds']:.2f} s, {result['items_per_second']:.0f} documents/s, "
+              f"{result['peak_rss_mb']:.0f} MB, {status}")
+
+    command = [
+        sys.executable, "-c",
+        f"import json, benchmark_suite; print(json.dumps(benchmark_suite.benchmark_queries({NUM_QUERIES}, {seed})))"
+    ]
+    result = run_stage(command, directory)
+    output = result.pop("output")
+    if result["exit_code"] == 0:
+        results["queries"] = json.loads(output.strip().splitlines()[-1])
+    else:
+        result["error"] = error_summary(output)
+    results["stages"]["queries"] = result
+
+    for mode, summary in results["queries"].items():
+        print(f"{mode}: p50 {summary['p50_ms']:.2f} ms, p99 {summary['p99_ms']:.2f} ms, "
+              f"{summary['queries_per_second']:.0f} queries/s")
+
+    return results
+
+
+def compare_with_baseline(results: dict, baseline: dict) -> list[str]:
+    """
+    Compare the results of a run with the baseline, returning the metrics that regressed.
+    """
+    if baseline.get("num_documents") != results["num_documents"]:
+        print("The baseline was run at a different scale, skipping the comparison")
+        return []
+
+    metrics = []
+    for name, stage in results["stages"].items():
+        baseline_stage = baseline["stages"].get(name, {})
+        metrics.append((f"{name} time", stage.get("seconds"), baseline_stage.get("seconds"), MIN_SECONDS_DIFFERENCE))
+        metrics.append((
+            f"{name} memory", stage.get("peak_rss_mb"), baseline_stage.get("peak_rss_mb"), MIN_MEGABYTES_DIFFERENCE
+        ))
+    for mode, summary in results["queries"].items():
+        baseline_summary = baseline["queries"].get(mode, {})
+        for percentile in ["p50_ms", "p99_ms"]:
+            metrics.append((
+                f"{mode} {percentile}", summary[percentile], baseline_summary.get(percentile),
+                MIN_MILLISECONDS_DIFFERENCE
+            ))
+
+    regressions = []
+    for metric, value, baseline_value, min_difference in metrics:
+        if value is None or baseline_value is None:
+            continue
+
+        ratio = value / baseline_value if baseline_value else float("inf")
+        regressed = ratio > 1 + REGRESSION_TOLERANCE and value - baseline_value > min_difference
+        print(f"  {metric}: {baseline_value:.3f} -> {value:.3f} ({ratio:.2f}x){' REGRESSION' if regressed else ''}")
+
+        if regressed:
+            regressions.append(metric)
+
+    return regressions
+
+
+if __name__ == "__main__":
+    """
+    This script benchmarks every stage of the pipeline and every query mode on a synthetic corpus, whose size is set
+    with the BENCHMARK_SCALE environment variable (20k, 200k, 2m or any number of documents).
+
+    The results are saved to a JSON file and compared with a baseline (the first run's results, unless one was
+    saved before), exiting with an error if any metric regressed.
+    """
+    num_documents = SCALES[SCALE] if SCALE in SCALES else int(SCALE)
+    directory = os.path.abspath(f"benchmark_corpus_{num_documents}")
+
+    results = run_benchmark(directory, num_documents)
+
+    with open(RESULTS_FILE, "w") as fout:
+        json.dump(results, fout, indent=2)
+    print(f"Results saved to {RESULTS_FILE}")
+
+    if not os.path.exists(BASELINE_FILE):
+        shutil.copyfile(RESULTS_FILE, BASELINE_FILE)
+        print(f"No baseline found, results saved as the baseline to {BASELINE_FILE}")
+        sys.exit(0)
+
+    with open(BASELINE_FILE, "r") as fin:
+        baseline = json.load(fin)
+
+    print(f"Comparison with {BASELINE_FILE}:")
+    regressions = compare_with_baseline(results, baseline)
+    if regressions:
+        print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+        sys.exit(1)
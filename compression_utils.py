@@ -0,0 +1,233 @@
+import mmap
+import struct
+import sys
+from array import array
+from itertools import accumulate
+from typing import Callable, Iterable
+
+# Layout of a compressed index file:
+# - the magic bytes and the number of terms;
+# - a table with (number of terms + 1) offsets, the n-th one being where the n-th term's posting list starts;
+# - the posting lists, each one stored as the gaps between consecutive document IDs, encoded as variable-byte integers.
+# A positional index has the same layout, but each document ID is followed by the number of positions of the term in
+# the document and the gaps between them.
+MAGIC = b"ADMI"
+POSITIONAL_MAGIC = b"ADMP"
+HEADER_FORMAT = "<4sI"
+OFFSET_FORMAT = "<Q"
+
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+OFFSET_SIZE = struct.calcsize(OFFSET_FORMAT)
+
+
+def encode_varint(value: int, out: bytearray):
+    """
+    Append a non-negative integer to `out` using variable-byte encoding.
+
+    Each byte holds 7 bits of the value, least significant first, with the high bit set on all but the last byte.
+    """
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_postings(document_ids: Iterable[int]) -> bytes:
+    """Encode a sorted list of document IDs as variable-byte gaps."""
+    out = bytearray()
+    previous = 0
+
+    for document_id in document_ids:
+        encode_varint(document_id - previous, out)
+        previous = document_id
+
+    return bytes(out)
+
+
+def decode_postings(buffer, start: int = 0, end: int = None) -> list[int]:
+    """Decode the document IDs encoded by `encode_postings` in `buffer[start:end]`."""
+    if end is None:
+        end = len(buffer)
+
+    document_ids = []
+    document_id, value, shift = 0, 0, 0
+
+    for byte in buffer[start:end]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            document_id += value
+            document_ids.append(document_id)
+            value, shift = 0, 0
+
+    return document_ids
+
+
+def encode_positional_postings(postings: Iterable[tuple[int, list[int]]]) -> bytes:
+    """
+    Encode a list of (document ID, positions) pairs, sorted by document ID and with sorted positions, as variable-byte
+    integers: the gap from the previous document ID, the number of positions and the gaps between them.
+    """
+    out = bytearray()
+    previous = 0
+
+    for document_id, positions in postings:
+        encode_varint(document_id - previous, out)
+        previous = document_id
+
+        encode_varint(len(positions), out)
+        previous_position = 0
+        for position in positions:
+            encode_varint(position - previous_position, out)
+            previous_position = position
+
+    return bytes(out)
+
+
+def decode_positional_postings(buffer, start: int = 0, end: int = None) -> list[tuple[int, list[int]]]:
+    """Decode the (document ID, positions) pairs encoded by `encode_positional_postings` in `buffer[start:end]`."""
+    if end is None:
+        end = len(buffer)
+
+    values = []
+    value, shift = 0, 0
+
+    for byte in buffer[start:end]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value, shift = 0, 0
+
+    postings = []
+    document_id, i = 0, 0
+
+    while i < len(values):
+        document_id += values[i]
+        num_positions = values[i + 1]
+        postings.append((document_id, list(accumulate(values[i + 2:i + 2 + num_positions]))))
+        i += 2 + num_positions
+
+    return postings
+
+
+def decode_varint(buffer, position: int) -> tuple[int, int]:
+    """Decode the variable-byte integer starting at `position` in `buffer`, returning it and the position after it."""
+    value, shift = 0, 0
+
+    while True:
+        byte = buffer[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def write_compressed_index(
+        num_terms: int, index: Iterable, path: str,
+        encode: Callable[[Iterable], bytes] = encode_postings, magic: bytes = MAGIC
+):
+    """
+    Save an index to a compressed file, reading the posting lists one at a time so they don't have to fit in memory.
+
+    `index` yields, for each of the `num_terms` term IDs in order, the sorted IDs of the documents containing it (or,
+    for a positional index saved with `encode_positional_postings` and `POSITIONAL_MAGIC`, the sorted (document ID,
+    positions) pairs).
+    """
+    table_size = (num_terms + 1) * OFFSET_SIZE
+
+    with open(path, "wb") as fout:
+        fout.write(struct.pack(HEADER_FORMAT, magic, num_terms))
+        fout.write(bytes(table_size))  # Placeholder for the offsets, written once the posting lists are
+
+        offsets = array("Q", [0])
+        for document_ids in index:
+            postings = encode(document_ids)
+            fout.write(postings)
+            offsets.append(offsets[-1] + len(postings))
+
+        if len(offsets) != num_terms + 1:
+            raise Exception(f"Expected {num_terms} posting lists, got {len(offsets) - 1}")
+
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        fout.seek(HEADER_SIZE)
+        fout.write(offsets.tobytes())
+
+
+def save_compressed_index(index: list[list[int]], path: str):
+    """
+    Save an index, mapping each term ID to the sorted IDs of the documents containing it, to a compressed file.
+    """
+    write_compressed_index(len(index), index, path)
+
+
+class CompressedIndex:
+    """
+    Index saved by `save_compressed_index`, memory-mapped and decoded lazily.
+
+    Indexing it by term ID returns the list of IDs of the documents containing the term, like the list returned by
+    `load_first_index`, but only the requested posting list is read and decoded.
+    """
+
+    magic = MAGIC
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.num_terms = struct.unpack_from(HEADER_FORMAT, self._buffer)
+        if magic != self.magic:
+            self.close()
+            raise Exception(f"{path} is not a compressed index")
+
+        self._data_start = HEADER_SIZE + (self.num_terms + 1) * OFFSET_SIZE
+
+    def __len__(self) -> int:
+        return self.num_terms
+
+    def __getitem__(self, term_id: int) -> list[int]:
+        if not 0 <= term_id < self.num_terms:
+            raise IndexError(f"Term ID {term_id} out of range")
+
+        start, end = struct.unpack_from("<2Q", self._buffer, HEADER_SIZE + term_id * OFFSET_SIZE)
+        return self._decode(self._data_start + start, self._data_start + end)
+
+    def _decode(self, start: int, end: int) -> list[int]:
+        return decode_postings(self._buffer, start, end)
+
+    def encoded_size(self, term_id: int) -> int:
+        """Return the size in bytes of a term's compressed posting list, a cheap estimate of its length."""
+        if not 0 <= term_id < self.num_terms:
+            raise IndexError(f"Term ID {term_id} out of range")
+
+        start, end = struct.unpack_from("<2Q", self._buffer, HEADER_SIZE + term_id * OFFSET_SIZE)
+        return end - start
+
+    def close(self):
+        self._buffer.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PositionalIndex(CompressedIndex):
+    """
+    Positional index saved with `write_compressed_index` and `encode_positional_postings`, memory-mapped and decoded
+    lazily.
+
+    Indexing it by term ID returns the (document ID, positions) pairs of the documents containing the term, sorted by
+    document ID, the positions being the indexes of the term in the document's lemmas.
+    """
+
+    magic = POSITIONAL_MAGIC
+
+    def _decode(self, start: int, end: int) -> list[tuple[int, list[int]]]:
+        return decode_positional_postings(self._buffer, start, end)
@@ -7,21 +7,86 @@ NUM_ANIMES_PER_PAGE = 50  # How many animes appear in each Top Anime page
 NUM_CHARTS_PAGES_TO_DOWNLOAD = 400  # How many pages from the Top Anime list to download
 TOP_CHARTS_PAGE_NAME = "top_animes_page_{}.html"  # Filename with which to store pages
 TOP_CHARTS_PAGES_DIRECTORY = "top_chart"  # Name of the directory in which to store the fetched Top Anime webpages
+TOP_CHARTS_ARCHIVE = "top_chart_pages"  # Base name of the archive (.gz data and .idx index) of the Top Anime webpages
 
 TOP_ANIME_URLS_FILE = "top_anime_urls.txt"  # The file in which to store the URLs of all animes
 
 ANIMES_DIRECTORY = "animes"  # The directory in which to store the fetched individual animes' pages
 ANIME_PAGE_NAME = "anime_{}.html"  # The base name of the individual animes' pages.
+ANIMES_ARCHIVE = "anime_pages"  # Base name of the archive (.gz data and .idx index) of the individual animes' pages
+ANIMES_FRONTIER_FILE = "animes_frontier.txt"  # The file recording which animes' pages have been downloaded
+
+CRAWLER_CONCURRENCY = 4  # How many requests the crawler can have in flight at once
+CRAWLER_RATE_LIMIT = 2.0  # Maximum number of requests per second sent by the crawler
+CRAWLER_MAX_ATTEMPTS = 10  # How many times the crawler tries to download a page before giving up (until relaunched)
+CRAWLER_BASE_BACKOFF = 10.0  # Seconds to wait (on average, at most) after the first failed attempt, doubled each time
+CRAWLER_MAX_BACKOFF = 600.0  # Maximum number of seconds to wait between attempts
 
 PARSED_ANIMES_DIRECTORY = "parsed_animes"  # The directory containing the anime_i.tsv files
 PARSED_ANIME_PAGE_NAME = "anime_{}.tsv"  # The base name of the individual animes' tsv files.
+PARSE_ERRORS_FILE = "parse_errors.txt"  # The file in which to report the pages that could not be parsed
+PARSE_CHUNK_SIZE = 50  # How many pages to send to a worker process at once
+FAST_EXTRACTION = True  # Whether to parse pages with lxml and precompiled XPath expressions instead of BeautifulSoup
 
 SEARCH_INFO_DIRECTORY = "search_info"  # Directory containing the anime's name, synopsis and url
 SEARCH_INFO_FILE_NAME = "anime_{}.txt"  # The base name of the individual animes' search info
 
+DOCUMENT_STORE_FILE = "documents.bin"  # The file storing the title, synopsis and URL of all animes, by document ID
+DOCUMENT_CACHE_SIZE = 1024  # How many documents the document store keeps in memory
+
+LEMMA_CACHE_FILE = "lemma_cache.json"  # The file in which to persist the lemmatizer's cache across runs
+LEMMA_CACHE_SIZE = 200_000  # Maximum number of (word, part of speech) pairs whose lemma is cached
+LEMMATIZE_CHUNK_SIZE = 100  # How many synopses to send to a worker process at once
+POSITIONAL_ANALYSIS = False  # Whether to keep all the lemmas of synopses in order (for phrase queries) instead of a set
+
 VOCABULARY_FILE = "vocabulary.txt"  # The name of the vocabulary file
 
 FIRST_INDEX_FILE = "first_index.txt"  # The name of the first index described in the homework
+FIRST_INDEX_BINARY_FILE = "first_index.bin"  # The name of the compressed, memory-mappable version of the first index
+INDEX_MEMORY_BUDGET = 256 * 1024 * 1024  # Approximate memory (in bytes) the index builder can use before spilling to disk
+INDEX_RUNS_DIRECTORY = "index_runs"  # Directory in which the index builder spills its partial indexes
+
+POSITIONAL_INDEX_FILE = "positional_index.bin"  # The name of the index of the positions of each term in documents
+NEAR_DISTANCE = 5  # Default maximum number of positions between the terms of a proximity query
+
 SECOND_INDEX_FILE = "second_index.txt"  # The name of the second index described in the homework (tf-idf)
+SECOND_INDEX_MATRIX_FILE = "second_index.npz"  # The name of the document x term tf-idf matrix of the second index
+SECOND_INDEX_NORMS_FILE = "second_index_norms.npz"  # The documents' norms and the terms' maximum normalized tf-idf
+
+SEGMENTS_DIRECTORY = "segments"  # Directory containing the segments of the incrementally updated index
+SEGMENTS_MANIFEST_FILE = "manifest.json"  # The file listing the segments and their deleted documents
+SEGMENTS_MERGE_FACTOR = 8  # How many segments there can be before the smallest ones are merged together
+SEGMENTS_MAX_DELETED_RATIO = 0.3  # Fraction of deleted documents above which a segment is rewritten without them
+SEGMENTS_RETIRED_DELAY = 300.0  # Seconds to keep merged segments' files, for readers that loaded an older manifest
+SEGMENTS_LOCK_FILE = "writer.lock"  # The file locked by the segmented index's writers, even in different processes
+
+METADATA_FILE = "metadata.npz"  # The file storing the numeric fields of all animes (popularity, score...) as columns
+
+GENERATIONS_DIRECTORY = "generations"  # Directory containing the published generations of the indexes
+GENERATION_MANIFEST_FILE = "manifest.json"  # The file listing a generation's files and their checksums
+CURRENT_GENERATION_FILE = "CURRENT"  # The file containing the name of the generation queries should be served from
+GENERATIONS_TO_KEEP = 3  # How many of the latest generations to keep when publishing a new one
+GENERATION_CHECK_INTERVAL = 1.0  # How often (in seconds) the search engine checks whether a new generation was published
+
+QUERY_CACHE_SIZE = 4096  # How many query results the search engine keeps in memory
+
+SERVER_HOST = "127.0.0.1"  # The address the query server listens on
+SERVER_PORT = 8080  # The port the query server listens on
+SERVER_MAX_BODY_SIZE = 1024 * 1024  # Maximum size (in bytes) of a request body accepted by the query server
+SERVER_LATENCY_WINDOW = 10_000  # How many of the latest requests to each endpoint the latency percentiles are over
+
+STREAM_QUEUE_SIZE = 256  # How many items can wait between two stages of the streaming ingest before the first blocks
+STREAM_BATCH_SIZE = 1000  # How many documents the streaming ingest checkpoints at once
+STREAM_CHECKPOINT_DIRECTORY = "stream_checkpoint"  # Directory in which the streaming ingest checkpoints its documents
+
+PIPELINE_STATE_FILE = "pipeline_state.json"  # The file recording the content hashes of each pipeline stage's items
+PIPELINE_CHECKPOINT_INTERVAL = 1000  # How many items a pipeline stage processes between saves of the pipeline state
+
+METRICS_FILE_VARIABLE = "ADM_METRICS_FILE"  # Environment variable naming the JSON lines file to emit metrics to
+PROFILE_VARIABLE = "ADM_PROFILE"  # Environment variable listing the profilers to run ("cprofile", "tracemalloc")
+PROFILES_DIRECTORY = "profiles"  # Directory in which to save cProfile statistics
+PROGRESS_INTERVAL = 5.0  # How often (in seconds) to log and emit the progress of a pipeline stage
+
+NUM_WORKERS = None  # How many worker processes to use for parallel processing (None to use one per CPU)
 
 VERBOSE = True  # Whether to log progress
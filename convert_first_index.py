@@ -0,0 +1,31 @@
+import os
+import time
+
+from compression_utils import save_compressed_index, CompressedIndex
+from constants import FIRST_INDEX_FILE, FIRST_INDEX_BINARY_FILE
+from first_index_utils import load_first_index
+
+
+if __name__ == "__main__":
+    """
+    This script converts the first index from its text format to the compressed, memory-mappable one, and reports
+    the space and loading time saved.
+    """
+    start = time.perf_counter()
+    index = load_first_index()
+    text_load_time = time.perf_counter() - start
+
+    save_compressed_index(index, FIRST_INDEX_BINARY_FILE)
+
+    start = time.perf_counter()
+    with CompressedIndex(FIRST_INDEX_BINARY_FILE) as compressed_index:
+        binary_load_time = time.perf_counter() - start
+
+        # Safety check: the compressed index must contain the same posting lists
+        assert all(compressed_index[i] == document_ids for i, document_ids in enumerate(index))
+
+    text_size = os.path.getsize(FIRST_INDEX_FILE)
+    binary_size = os.path.getsize(FIRST_INDEX_BINARY_FILE)
+
+    print(f"Size: {text_size} bytes -> {binary_size} bytes ({binary_size/text_size:.1%})")
+    print(f"Load time: {text_load_time*1000:.2f} ms -> {binary_load_time*1000:.2f} ms")
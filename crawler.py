@@ -0,0 +1,211 @@
+import email.utils
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from constants import CRAWLER_CONCURRENCY, CRAWLER_RATE_LIMIT, CRAWLER_MAX_ATTEMPTS, CRAWLER_BASE_BACKOFF, \
+    CRAWLER_MAX_BACKOFF
+from instrumentation import Stage
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+
+    Tokens are added at `rate` per second, up to `capacity`. Each request takes a token, waiting for one if none is
+    available, so that requests are sent at most at `rate` per second on average, with bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, blocking until one is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header, either in seconds or as an HTTP date, into the seconds to wait."""
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(
+        attempt: int, retry_after: Optional[float] = None,
+        base: float = CRAWLER_BASE_BACKOFF, maximum: float = CRAWLER_MAX_BACKOFF
+) -> float:
+    """
+    Return how long to wait before the `attempt`-th retry (starting at 1).
+
+    Uses exponential backoff with full jitter, but never waits less than what the server asked with Retry-After.
+    """
+    delay = random.uniform(0, min(maximum, base * 2 ** (attempt - 1)))
+    return max(delay, retry_after) if retry_after is not None else delay
+
+
+class Frontier:
+    """
+    Persisted record of which pages have been successfully downloaded.
+
+    The index of each downloaded page is appended to a file once the page is saved, so that a restarted crawl resumes
+    exactly from the pages still missing, whatever the order in which pages completed.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+        self.done = set()
+        if self.path.exists():
+            with open(self.path, "r") as fin:
+                self.done = set(int(line) for line in fin if line.strip())
+
+    def mark_done(self, index: int):
+        with self._lock:
+            with open(self.path, "a") as fout:
+                fout.write(f"{index}\n")
+            self.done.add(index)
+
+    def pending(self, num_pages: int) -> list[int]:
+        return [index for index in range(num_pages) if index not in self.done]
+
+
+class Crawler:
+    """
+    Concurrent crawler downloading a list of URLs.
+
+    Up to `concurrency` requests are in flight at once, sharing a pooled HTTP session (so connections are kept alive)
+    and a token bucket limiting the request rate. Failed requests are retried with exponential backoff.
+    Each downloaded page is passed to `save` along with its index, and then marked as done in the frontier (both only
+    used by `run`, pages can also be downloaded one at a time with `fetch`).
+    """
+
+    def __init__(
+            self,
+            urls: list[str],
+            save: Optional[Callable[[int, bytes], None]],
+            frontier: Optional[Frontier],
+            concurrency: int = CRAWLER_CONCURRENCY,
+            rate_limit: float = CRAWLER_RATE_LIMIT,
+            max_attempts: int = CRAWLER_MAX_ATTEMPTS,
+            session: Optional[requests.Session] = None
+    ):
+        self.urls = urls
+        self.save = save
+        self.frontier = frontier
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.rate_limiter = TokenBucket(rate_limit)
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+
+        self.retries = 0
+        self.failed: list[int] = []
+        self.stage: Optional[Stage] = None  # Instruments the pages downloaded, failures and retries while running
+        self._lock = threading.Lock()
+
+    def fetch(self, index: int) -> Optional[bytes]:
+        """Download a page, retrying on errors. Return None if all attempts failed."""
+        url = self.urls[index]
+
+        for attempt in range(1, self.max_attempts + 1):
+            self.rate_limiter.acquire()
+
+            retry_after = None
+            try:
+                response = self.session.get(url, timeout=30)
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    response.raise_for_status()  # Raise if the request was not successful (not worth retrying)
+                    return response.content
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                error = f"status {response.status_code}"
+            except requests.HTTPError:
+                raise
+            except requests.RequestException as err:  # Connection errors, timeouts...
+                error = str(err)
+
+            if attempt == self.max_attempts:
+                break
+
+            delay = backoff_delay(attempt, retry_after)
+            with self._lock:
+                self.retries += 1
+            if self.stage is not None:
+                self.stage.retry()
+            print(f"Error downloading file #{index} ({error}), let's wait {delay:.1f} seconds...")
+            time.sleep(delay)
+
+        return None
+
+    def _crawl_page(self, index: int):
+        start = time.perf_counter()
+        try:
+            content = self.fetch(index)
+        except requests.HTTPError as err:
+            print(f"Giving up on file #{index}: {err}")
+            content = None
+
+        if content is None:
+            with self._lock:
+                self.failed.append(index)
+            if self.stage is not None:
+                self.stage.error()
+            return
+
+        self.save(index, content)
+        self.frontier.mark_done(index)
+        if self.stage is not None:
+            self.stage.item(time.perf_counter() - start)
+
+    def run(self):
+        """Download all pages not yet in the frontier."""
+        pending = self.frontier.pending(len(self.urls))
+
+        with Stage("download_anime", total=len(pending)) as self.stage:
+            with ThreadPoolExecutor(self.concurrency) as executor:
+                for _ in executor.map(self._crawl_page, pending):
+                    pass
+        self.stage = None
+
+        if self.failed:
+            print(f"{len(self.failed)} pages could not be downloaded, relaunch to retry them: {sorted(self.failed)}")
+
@@ -1,9 +1,9 @@
-import os
-
 from pathlib import Path
 
-from constants import SEARCH_INFO_DIRECTORY, VOCABULARY_FILE, FIRST_INDEX_FILE
-from utils import search_info_filename
+from constants import SEARCH_INFO_DIRECTORY
+from first_index_utils import save_first_index
+from instrumentation import Stage
+from utils import load_search_info_words, load_vocabulary
 
 
 if __name__ == "__main__":
@@ -13,26 +13,20 @@ if __name__ == "__main__":
 
     files_to_parse = sorted(Path(SEARCH_INFO_DIRECTORY).glob("*.txt"))
 
-    with open(VOCABULARY_FILE, "r") as fin:
-        vocabulary = {word.strip(): i for i, word in enumerate(fin.readlines())}
+    vocabulary = load_vocabulary()
 
     index = [[] for i in range(len(vocabulary))]
 
-    for i, path in enumerate(files_to_parse):
-
-        # Read the TXT file for this anime to extract the vocabulary's words
-        with open(os.path.join(SEARCH_INFO_DIRECTORY, search_info_filename(i)), "r") as fin:
-            words = set(word.strip() for word in fin.readlines()[2:])  # Skip title and URL
+    with Stage("create_first_index", total=len(files_to_parse)) as stage:
+        for i, path in enumerate(files_to_parse):
+            with stage.timed_item():
 
-            for word in words:
-                if word in vocabulary:  # Should always be the case, just a safety check
-                    index[vocabulary[word]].append(i)  # Add the document's ID to the index
+                # Read the TXT file for this anime to extract the vocabulary's words
+                words = set(load_search_info_words(i))
 
-        if i % 1000 == 0:
-            print(f"{i}/{len(files_to_parse)}...")
+                for word in words:
+                    if word in vocabulary:  # Should always be the case, just a safety check
+                        index[vocabulary[word]].append(i)  # Add the document's ID to the index
 
     # Save the result to a file
-    with open(FIRST_INDEX_FILE, "w") as out_txt:
-        for i in range(len(index)):
-            # The n-th line contains the IDs of the documents that include the term with ID n
-            out_txt.write(" ".join(str(doc_id) for doc_id in index[i]) + "\n")
+    save_first_index(index)
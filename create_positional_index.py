@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from constants import SEARCH_INFO_DIRECTORY, POSITIONAL_ANALYSIS, POSITIONAL_INDEX_FILE
+from positional_index_utils import build_positional_index, save_positional_index
+from utils import load_search_info_words, load_vocabulary
+
+
+if __name__ == "__main__":
+    """
+    This script builds the positional index, storing where each term appears in each synopsis, from the vocabulary and
+    the tokenized synopses. It is used to answer phrase and proximity queries.
+
+    The synopses must have been tokenized with `POSITIONAL_ANALYSIS` set, so that their search info files keep all the
+    lemmas in order.
+    """
+    if not POSITIONAL_ANALYSIS:
+        raise Exception("Set POSITIONAL_ANALYSIS and run extract_search_info.py again to build the positional index")
+
+    files_to_parse = sorted(Path(SEARCH_INFO_DIRECTORY).glob("*.txt"))
+
+    vocabulary = load_vocabulary()
+
+    # Read the TXT file for each anime to extract its lemmas, in order
+    documents_words = (load_search_info_words(i) for i in range(len(files_to_parse)))
+
+    index = build_positional_index(len(files_to_parse), documents_words, vocabulary)
+
+    # Save the result to a file
+    save_positional_index(index)
+
+    print(f"Positional index of {len(files_to_parse)} documents saved to {POSITIONAL_INDEX_FILE}")
@@ -1,21 +1,40 @@
-import math
-import os
-
+from collections import Counter
 from pathlib import Path
+from typing import Iterable
 
-from constants import SEARCH_INFO_DIRECTORY, VOCABULARY_FILE, SECOND_INDEX_FILE
+from constants import SEARCH_INFO_DIRECTORY
 from first_index_utils import load_first_index
-from utils import search_info_filename
+from instrumentation import Stage
+from second_index_utils import tf, idf, save_second_index
+from utils import load_search_info_words, load_vocabulary
+
+
+def build_second_index(
+        num_all_documents: int, documents_words: Iterable[list[str]], vocabulary: dict[str, int],
+        first_index: list[list[int]]
+) -> list[list[tuple[int, float]]]:
+    """
+    Build the second index from the vocabulary, the first index and the words of each document.
+
+    The inverse document frequency of each term is computed once, from the length of its posting list in the first
+    index, so each (document, term) pair only costs a division and a multiplication. Words repeated in a document (with
+    positional analysis) have a term frequency proportional to their number of occurrences.
+    """
+    idfs = [idf(num_all_documents, len(document_ids)) if document_ids else 0.0 for document_ids in first_index]
 
-def tf(words) -> float:
-    """Boolean term frequency, weighted over the document's word count."""
+    index = [[] for i in range(len(vocabulary))]
 
-    return 1/len(words)
+    with Stage("create_second_index", total=num_all_documents) as stage:
+        for i, words in enumerate(documents_words):
+            with stage.timed_item():
+                for word, count in Counter(words).items():
+                    term_id = vocabulary.get(word)
+                    if term_id is not None:  # Should always be the case, just a safety check
+                        # Add the document's ID and its score to the index
+                        index[term_id].append((i, tf(words, count) * idfs[term_id]))
 
-def idf(num_all_documents, num_documents_containing_term) -> float:
-    """Inverse document frequency for a word. Uses the precomputed data from the first index."""
+    return index
 
-    return math.log(num_all_documents/num_documents_containing_term)
 
 if __name__ == "__main__":
     """
@@ -25,34 +44,14 @@ if __name__ == "__main__":
     files_to_parse = sorted(Path(SEARCH_INFO_DIRECTORY).glob("*.txt"))
     num_all_documents = len(files_to_parse)
 
-    with open(VOCABULARY_FILE, "r") as fin:
-        vocabulary = {word.strip(): i for i, word in enumerate(fin.readlines())}
+    vocabulary = load_vocabulary()
 
     first_index = load_first_index()  # Used to compute inverse document frequencies
 
-    index = [[] for i in range(len(vocabulary))]
-
-    for i, path in enumerate(files_to_parse):
-
-        # Read the TXT file for this anime to extract the vocabulary's words
-        with open(os.path.join(SEARCH_INFO_DIRECTORY, search_info_filename(i)), "r") as fin:
-            words = set(word.strip() for word in fin.readlines()[2:])  # Skip title and URL
-
-            for word in words:
-                if word in vocabulary:  # Should always be the case, just a safety check
-                    # Add the document's ID and its score to the index
-                    index[vocabulary[word]].append(i)
-
-                    _tf = tf(words)
-                    num_documents_containing_term = len(first_index[vocabulary[word]])
-                    _idf = idf(num_all_documents, num_documents_containing_term)
-                    index[vocabulary[word]].append(_tf * _idf)
+    # Read the TXT file for each anime to extract the vocabulary's words
+    documents_words = (load_search_info_words(i) for i in range(num_all_documents))
 
-        if i % 1000 == 0:
-            print(f"{i}/{len(files_to_parse)}...")
+    index = build_second_index(num_all_documents, documents_words, vocabulary, first_index)
 
-    # Save the result to a file
-    with open(SECOND_INDEX_FILE, "w") as out_txt:
-        for i in range(len(index)):
-            # The n-th line contains the IDs of the documents that include the term with ID n followed by their tf-idf score
-            out_txt.write(" ".join(str(value) for value in index[i]) + "\n")
+    # Save the result to a file, along with the documents' norms
+    save_second_index(index, num_all_documents)
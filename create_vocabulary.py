@@ -1,9 +1,8 @@
-import os
-
 from pathlib import Path
 
-from constants import SEARCH_INFO_DIRECTORY, VOCABULARY_FILE
-from utils import search_info_filename
+from constants import SEARCH_INFO_DIRECTORY
+from instrumentation import Stage
+from utils import load_search_info_words, save_vocabulary
 
 
 if __name__ == "__main__":
@@ -15,19 +14,16 @@ if __name__ == "__main__":
 
     vocabulary = set()
 
-    for i, path in enumerate(files_to_parse):
-
-        # Read the TXT file for this anime to extract the vocabulary's words
-        with open(os.path.join(SEARCH_INFO_DIRECTORY, search_info_filename(i)), "r") as fin:
-            words = set(word.strip() for word in fin.readlines()[2:])  # Skip title and URL
+    with Stage("create_vocabulary", total=len(files_to_parse)) as stage:
+        for i, path in enumerate(files_to_parse):
+            with stage.timed_item():
 
-            vocabulary |= words  # Update the vocabulary with the current file's words
+                # Read the TXT file for this anime to extract the vocabulary's words
+                words = set(load_search_info_words(i))
 
-            if i % 1000 == 0:
-                print(f"{i}/{len(files_to_parse)}...")
+                vocabulary |= words  # Update the vocabulary with the current file's words
 
     # Save the result to a file
-    with open(VOCABULARY_FILE, "w") as out_txt:
-        out_txt.write("\n".join(vocabulary))
+    save_vocabulary(vocabulary)
 
     print(f"The vocabulary contains {len(vocabulary)} words.")
@@ -1,94 +1,173 @@
 import csv
-import heapq
+import math
 import os
-from pathlib import Path
-from scipy.spatial.distance import cosine
+from datetime import datetime
+from typing import Callable, Iterable, Iterator, Optional
 
-from constants import VOCABULARY_FILE, SECOND_INDEX_FILE, SEARCH_INFO_DIRECTORY, PARSED_ANIMES_DIRECTORY
-from second_index_utils import load_second_index, cosine_similarity
-from utils import retrieve_title_synopsis_and_url, search_info_filename, parsed_anime_filename
+import numpy as np
 
+from constants import PARSED_ANIMES_DIRECTORY, METADATA_FILE
+from utils import parsed_anime_filename
 
-def compute_document_vector(document_id, query, vocabulary, index, requested_popularity, popularity, popularity_range):
-    """Return the vector for a document, to be used in the cosine similarity check."""
-    vector = [0.0]*len(query)
 
-    for i, query_term in enumerate(query):
-        for current_doc_id, tfidf in index[vocabulary.index(query_term)]:
-            if document_id == current_doc_id:
-                vector[i] = tfidf
+def _parse_number(value: str) -> float:
+    return float(value) if value else math.nan
 
-    # Custom metric: match requested popularity
-    weighted_popularity = (popularity - popularity_range[0])/(popularity_range[1] - popularity_range[0])
-    if requested_popularity == "popular":
-        vector += [weighted_popularity] # 1 to the most popular, 0 to the least popular, the others in between
-    elif requested_popularity == "unpopular":
-        vector += [1.0-weighted_popularity] # Opposite to the above
 
-    return vector
+def _parse_date(value: str) -> float:
+    """Convert a date, as written to the TSV files, to a number of days (its proleptic Gregorian ordinal)."""
+    return float(datetime.fromisoformat(value).toordinal()) if value else math.nan
 
 
-def run_custom_query(query: list[str], requested_popularity: str, limit: int = 10) -> list[tuple[str, str, str, float]]:
+# Numeric fields of the parsed animes that can be used as metrics, with their column in the TSV files and the
+# function converting a value to a number (NaN if missing)
+METADATA_COLUMNS: dict[str, tuple[int, Callable[[str], float]]] = {
+    "episodes": (2, _parse_number),
+    "release_date": (3, _parse_date),
+    "end_date": (4, _parse_date),
+    "members": (5, _parse_number),
+    "score": (6, _parse_number),
+    "users": (7, _parse_number),
+    "rank": (8, _parse_number),
+    "popularity": (9, _parse_number),
+}
+
+# Value used in place of missing ones, for the metrics where it should not be the mean of the other animes'
+MISSING_METADATA_VALUES = {
+    "rank": 10000,  # Roughly the average (over ~19k documents), kept for consistency with earlier results
+}
+
+# The weights corresponding to the "popularity" that can be requested to `run_custom_query`
+POPULARITY_WEIGHTS = {
+    "popular": {"rank": 1.0},  # 1 to the most popular, 0 to the least popular, the others in between
+    "unpopular": {"rank": -1.0},  # Opposite to the above
+}
+
+
+def extract_metadata(num_documents: int) -> dict[str, np.ndarray]:
     """
-    Given a query, return title, synopsis, url and query score of the first `limit` animes with the best score.
+    Read the numeric fields of all parsed animes, returning an array of values (NaN if missing) for each metric.
+
+    Animes that haven't been parsed (e.g. whose page couldn't be downloaded) have all their values missing.
+    """
+    def read_rows() -> Iterator[Optional[list[str]]]:
+        for i in range(num_documents):
+            path = os.path.join(PARSED_ANIMES_DIRECTORY, parsed_anime_filename(i))
+            if not os.path.exists(path):
+                yield None
+                continue
+
+            with open(path, "r") as tsv_file:
+                tsv_reader = csv.reader(tsv_file, delimiter='\t')
+                next(tsv_reader)  # Skip headers
+                yield next(tsv_reader)
+
+    return metadata_from_rows(num_documents, read_rows())
+
+
+def metadata_from_rows(num_documents: int, rows: Iterable[Optional[list[str]]]) -> dict[str, np.ndarray]:
+    """
+    Return the array of values of each metric from the TSV rows of all animes, in order of ID (None for the animes
+    that haven't been parsed).
+    """
+    columns = {name: np.full(num_documents, np.nan) for name in METADATA_COLUMNS}
+
+    for i, data in enumerate(rows):
+        if data is None:
+            continue
+
+        for name, (column, parse) in METADATA_COLUMNS.items():
+            try:
+                columns[name][i] = parse(data[column])
+            except ValueError:
+                pass  # Leave malformed values as missing
+
+    return columns
+
+
+def save_metadata(columns: dict[str, np.ndarray], path: str = METADATA_FILE):
     """
-    with open(VOCABULARY_FILE, "r") as fin:
-        vocabulary = [word.strip() for word in fin.readlines()]
+    Save the metrics' arrays to a file.
+    """
+    np.savez(path, **columns)
 
-    if len(query) < 1:
-        raise Exception("Please supply at least one query term")
 
-    if requested_popularity not in ("popular", "unpopular"):
-        raise Exception("Please supply a valid value for popularity")
+def load_metadata(num_documents: int, path: str = METADATA_FILE) -> dict[str, np.ndarray]:
+    """
+    Load the metrics' arrays from the file where they were saved, extracting them from the parsed animes if missing.
 
-    if any(word.lower() not in vocabulary for word in query):  # If a word is missing from the vocabulary, the query can't be matched
-        return []
+    `num_documents` is the number of documents of the indexes the metrics are combined with, so that the extracted
+    arrays have one value per document.
+    """
+    if not os.path.exists(path):
+        return extract_metadata(num_documents)
 
-    index = load_second_index()
+    with np.load(path) as npz:
+        return {name: npz[name] for name in npz.files}
 
-    # Retrieve all animes' popularity, defined as its ranking
-    popularities = []
 
-    for i, path in enumerate(sorted(Path(PARSED_ANIMES_DIRECTORY).glob("*.tsv"))):
-        # Read the TSV file for this anime to extract search info
-        with open(os.path.join(PARSED_ANIMES_DIRECTORY, parsed_anime_filename(i)), "r") as tsv_file:
-            tsv_reader = csv.reader(tsv_file, delimiter='\t')
-            next(tsv_reader) # Skip headers
-            data = next(tsv_reader)
-            popularity = int(data[8]) if data[8] else 10000 # ranking, if missing use average (over ~19k documents)
-            popularities.append(popularity)
+def normalize_metric(name: str, values: np.ndarray) -> np.ndarray:
+    """
+    Scale a metric's values to the [0, 1] range, replacing the missing ones first.
+    """
+    missing = np.isnan(values)
+    if missing.all():
+        return np.zeros_like(values)
 
-    popularity_range = (min(popularities), max(popularities))
+    fill_value = MISSING_METADATA_VALUES.get(name, np.nanmean(values))
+    values = np.where(missing, fill_value, values)
 
-    # We have to compute the cosine similarity between the query and all documents.
-    # Let's first compute the query vector
+    low, high = values.min(), values.max()
+    if high == low:
+        return np.zeros_like(values)
+    return (values - low) / (high - low)
 
-    query_vector = [1.0]*(len(query)+1) # Add 1 fot the new metric
 
-    # Now let's compute scores for each document and add them to a heap
-    heap = []
+def metric_features(
+        metadata: dict[str, np.ndarray], weights: dict[str, float]
+) -> tuple[Optional[np.ndarray], np.ndarray]:
+    """
+    Return the custom metrics' components of the documents' and the query's vectors, to be used in the cosine
+    similarity check.
 
-    files_to_parse = sorted(Path(SEARCH_INFO_DIRECTORY).glob("*.txt"))
-    for i, path in enumerate(files_to_parse):
+    Each metric adds a component to the vectors: the document's is the metric's normalized value (or one minus it,
+    for a negative weight, favouring low values), the query's is the weight's absolute value.
+    Return a document x metric matrix, or None if no metric has a non-zero weight, and the query's components.
+    """
+    features, query_features = [], []
 
-        # Compute the vector for the document.
-        document_vector = compute_document_vector(i, query, vocabulary, index, requested_popularity, popularities[i], popularity_range)
+    for name, weight in weights.items():
+        if name not in metadata:
+            raise Exception(f"Unknown metric: {name}")
+        if weight == 0:
+            continue
 
-        # Compute the cosine similarity
-        score = cosine_similarity(query_vector, document_vector)
+        normalized = normalize_metric(name, metadata[name])
+        features.append(normalized if weight > 0 else 1.0 - normalized)
+        query_features.append(abs(weight))
 
-        if not all(vector_dimension == 0 for vector_dimension in document_vector):
-            heap.append((-score, i)) # Use -score to have pop return elements from highest to lowest
+    if not features:
+        return None, np.zeros(0)
+    return np.column_stack(features), np.array(query_features)
 
-    # Build list to be returned
-    heapq.heapify(heap)
-    result = []
 
-    for i in range(min([limit, len(heap)])):
-        score, document_id = heapq.heappop(heap)
-        # Revert the sign change on score
-        result.append(list(retrieve_title_synopsis_and_url(document_id)) + [-score])
-    return result
+def run_custom_query(query: list[str], requested_popularity: str, limit: int = 10) -> list[tuple[str, str, str, float]]:
+    """
+    Given a query, return title, synopsis, url and query score of the first `limit` animes with the best score.
+    """
+    from search_engine import get_search_engine  # Imported here to avoid a circular import
+
+    return get_search_engine().run_custom_query(query, requested_popularity, limit)
+
+
+def run_weighted_query(query: list[str], weights: dict[str, float], limit: int = 10) -> list[tuple[str, str, str, float]]:
+    """
+    Given a query and the weight of each metric, return title, synopsis, url and query score of the first `limit`
+    animes with the best score.
+    """
+    from search_engine import get_search_engine  # Imported here to avoid a circular import
+
+    return get_search_engine().run_weighted_query(query, weights, limit)
 
 
 if __name__ == "__main__":
@@ -98,4 +177,6 @@ if __name__ == "__main__":
     for title, synopsis, url, score in run_custom_query(["alchemy"], "popular", limit=10):
         print(title, score)
     for title, synopsis, url, score in run_custom_query(["alchemy"], "unpopular", limit=10):
-        print(title, score)
\ No newline at end of file
+        print(title, score)
+    for title, synopsis, url, score in run_weighted_query(["alchemy"], {"score": 1.0, "members": 0.5}, limit=10):
+        print(title, score)
@@ -0,0 +1,167 @@
+import mmap
+import struct
+import sys
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable
+
+from compression_utils import encode_varint, decode_varint
+from constants import DOCUMENT_STORE_FILE, DOCUMENT_CACHE_SIZE, PARSED_ANIMES_DIRECTORY
+from utils import load_urls, retrieve_title_synopsis_and_url
+
+# Layout of a document store file:
+# - the magic bytes and the number of documents;
+# - a table with (number of documents + 1) offsets, the n-th one being where the n-th document's record starts;
+# - the records, each one made of the document's title, synopsis and URL, each one encoded in UTF-8 and prefixed by
+#   its length as a variable-byte integer.
+MAGIC = b"ADMD"
+HEADER_FORMAT = "<4sI"
+OFFSET_FORMAT = "<Q"
+
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+OFFSET_SIZE = struct.calcsize(OFFSET_FORMAT)
+
+Document = tuple[str, str, str]  # Title, unprocessed synopsis and URL
+
+
+def encode_document(document: Document) -> bytes:
+    """Encode a document's fields as length-prefixed UTF-8 strings."""
+    out = bytearray()
+
+    for field in document:
+        encoded = (field or "").encode("utf-8")
+        encode_varint(len(encoded), out)
+        out += encoded
+
+    return bytes(out)
+
+
+def decode_document(buffer, position: int) -> Document:
+    """Decode the document encoded by `encode_document` starting at `position` in `buffer`."""
+    fields = []
+
+    for _ in range(3):
+        length, position = decode_varint(buffer, position)
+        fields.append(str(buffer[position:position + length], "utf-8"))
+        position += length
+
+    return tuple(fields)
+
+
+def write_document_store(num_documents: int, documents: Iterable[Document], path: str = DOCUMENT_STORE_FILE):
+    """
+    Save documents to a document store file, reading them one at a time so they don't have to fit in memory.
+
+    `documents` yields the (title, synopsis, URL) triple of each of the `num_documents` documents, in order of ID.
+    """
+    table_size = (num_documents + 1) * OFFSET_SIZE
+
+    with open(path, "wb") as fout:
+        fout.write(struct.pack(HEADER_FORMAT, MAGIC, num_documents))
+        fout.write(bytes(table_size))  # Placeholder for the offsets, written once the records are
+
+        offsets = array("Q", [0])
+        for document in documents:
+            record = encode_document(document)
+            fout.write(record)
+            offsets.append(offsets[-1] + len(record))
+
+        if len(offsets) != num_documents + 1:
+            raise Exception(f"Expected {num_documents} documents, got {len(offsets) - 1}")
+
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        fout.seek(HEADER_SIZE)
+        fout.write(offsets.tobytes())
+
+
+class DocumentStore:
+    """
+    Document store saved by `write_document_store`, memory-mapped so that any document is read with a single seek.
+
+    The most recently fetched documents are kept in an LRU cache, as the same documents tend to appear in the results
+    of many queries.
+    """
+
+    def __init__(self, path: str = DOCUMENT_STORE_FILE, cache_size: int = DOCUMENT_CACHE_SIZE):
+        self._file = open(path, "rb")
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.num_documents = struct.unpack_from(HEADER_FORMAT, self._buffer)
+        if magic != MAGIC:
+            self.close()
+            raise Exception(f"{path} is not a document store")
+
+        self._data_start = HEADER_SIZE + (self.num_documents + 1) * OFFSET_SIZE
+
+        self.cache_size = cache_size
+        self._cache: OrderedDict[int, Document] = OrderedDict()
+
+    def __len__(self) -> int:
+        return self.num_documents
+
+    def _read(self, document_id: int) -> Document:
+        if not 0 <= document_id < self.num_documents:
+            raise IndexError(f"Document ID {document_id} out of range")
+
+        (start,) = struct.unpack_from(OFFSET_FORMAT, self._buffer, HEADER_SIZE + document_id * OFFSET_SIZE)
+        return decode_document(self._buffer, self._data_start + start)
+
+    def _cache_document(self, document_id: int, document: Document):
+        self._cache[document_id] = document
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def __getitem__(self, document_id: int) -> Document:
+        """Return the title, unprocessed synopsis and URL of a document."""
+        document = self._cache.get(document_id)
+        if document is not None:
+            self._cache.move_to_end(document_id)
+            return document
+
+        document = self._read(document_id)
+        self._cache_document(document_id, document)
+        return document
+
+    def get_many(self, document_ids: list[int]) -> list[Document]:
+        """
+        Return the documents with the given IDs, in the same order.
+
+        The documents missing from the cache are read in order of ID, i.e. sequentially in the file.
+        """
+        documents = {}
+        for document_id in document_ids:
+            document = self._cache.get(document_id)
+            if document is not None:
+                self._cache.move_to_end(document_id)
+                documents[document_id] = document
+
+        for document_id in sorted(set(document_ids) - documents.keys()):
+            documents[document_id] = self._read(document_id)
+            self._cache_document(document_id, documents[document_id])
+
+        return [documents[document_id] for document_id in document_ids]
+
+    def close(self):
+        self._buffer.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == "__main__":
+    """
+    This script builds the document store from the parsed animes, so that the search engine can retrieve the title,
+    synopsis and URL of its results without reading a TSV file for each of them.
+    """
+    urls = load_urls()
+    num_documents = len(list(Path(PARSED_ANIMES_DIRECTORY).glob("*.tsv")))
+
+    write_document_store(num_documents, (retrieve_title_synopsis_and_url(i, urls) for i in range(num_documents)))
+
+    print(f"{num_documents} documents saved to {DOCUMENT_STORE_FILE}")
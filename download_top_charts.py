@@ -1,36 +1,33 @@
-import os
 import requests
 import time
 
-from bs4 import BeautifulSoup
-
 from constants import (
     BASE_URL,
     LIMIT_PARAM,
     NUM_CHARTS_PAGES_TO_DOWNLOAD,
-    TOP_CHARTS_PAGES_DIRECTORY,
-    VERBOSE
+    TOP_CHARTS_ARCHIVE
 )
-from utils import top_anime_filename, prepare_to_download
+from instrumentation import Stage
+from page_archive import PageArchive, top_anime_key
 
 if __name__ == "__main__":
     """
-    This script downloads and saves the first 400 pages from the top anime charts. 
+    This script downloads and saves the first 400 pages from the top anime charts, as they were received, in a
+    compressed archive.
     """
 
-    start_page = prepare_to_download(TOP_CHARTS_PAGES_DIRECTORY)
-    for page in range(start_page, NUM_CHARTS_PAGES_TO_DOWNLOAD):
-
-        # Download the page
-        response = requests.get(BASE_URL, params={LIMIT_PARAM: 50*page})
+    archive = PageArchive(TOP_CHARTS_ARCHIVE)
+    with Stage("download_top_charts", total=NUM_CHARTS_PAGES_TO_DOWNLOAD) as stage:
+        for page in range(NUM_CHARTS_PAGES_TO_DOWNLOAD):
+            if top_anime_key(page) in archive:  # Already downloaded in a previous run
+                continue
 
-        # Prettify and save it
-        with open(os.path.join(TOP_CHARTS_PAGES_DIRECTORY, top_anime_filename(page), "w")) as fout:
-            soup = BeautifulSoup(response.content, features="lxml")
-            fout.write(soup.prettify())
+            with stage.timed_item():
+                # Download the page
+                response = requests.get(BASE_URL, params={LIMIT_PARAM: 50*page})
+                response.raise_for_status()
 
-        # Log progress, if running verbosely
-        if VERBOSE and page%20 == 0:
-            print(f"{page}/{NUM_CHARTS_PAGES_TO_DOWNLOAD} pages downloaded...")
+                # Save it
+                archive.put(top_anime_key(page), response.content, response.url)
 
-        time.sleep(0.5)  # Let's try and avoid an IP ban
+            time.sleep(0.5)  # Let's try and avoid an IP ban
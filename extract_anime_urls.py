@@ -1,10 +1,7 @@
-import os
-
-from bs4 import BeautifulSoup
-
-from constants import NUM_CHARTS_PAGES_TO_DOWNLOAD, TOP_CHARTS_PAGES_DIRECTORY, TOP_ANIME_URLS_FILE, VERBOSE, \
-    NUM_ANIMES_PER_PAGE
-from utils import top_anime_filename
+import fast_extraction
+from constants import NUM_CHARTS_PAGES_TO_DOWNLOAD, TOP_CHARTS_ARCHIVE, TOP_ANIME_URLS_FILE, NUM_ANIMES_PER_PAGE
+from instrumentation import Stage
+from page_archive import PageArchive, top_anime_key
 
 
 if __name__ == "__main__":
@@ -13,25 +10,23 @@ if __name__ == "__main__":
     the 400*50 animes' URLs in a TXT file.
     """
 
-    urls = []
-    for page in range(NUM_CHARTS_PAGES_TO_DOWNLOAD):
-        with open(os.path.join(TOP_CHARTS_PAGES_DIRECTORY, top_anime_filename(page)), "r") as fin:
+    archive = PageArchive(TOP_CHARTS_ARCHIVE)
 
-            soup = BeautifulSoup(fin, "lxml")
+    urls = []
+    with Stage("extract_anime_urls", total=NUM_CHARTS_PAGES_TO_DOWNLOAD) as stage:
+        for page in range(NUM_CHARTS_PAGES_TO_DOWNLOAD):
+            with stage.timed_item():
+                tree = fast_extraction.parse_page(archive.get(top_anime_key(page)))
 
-            # Links are in the A tag in the second TD of each TR with class "ranking-list"
-            animes_in_page = list(soup.find_all("tr", class_="ranking-list"))
+                # Links are in the A tag in the second TD of each TR with class "ranking-list"
+                animes_in_page = fast_extraction.extract_anime_urls(tree)
 
-            for anime in animes_in_page:
-                url = anime.find_all("td")[1].a.get("href")
+            for url in animes_in_page:
                 urls.append(url + "\n")
 
             # This gets triggered, so there are less than (400*50 = 20'000) animes!
             if len(animes_in_page) != NUM_ANIMES_PER_PAGE:
-                print(f"{top_anime_filename(page)} only has {len(animes_in_page)} animes.")
-
-        if VERBOSE and page%20 == 0:
-            print(f"{page}/{NUM_CHARTS_PAGES_TO_DOWNLOAD} pages parsed")
+                print(f"Page {page} only has {len(animes_in_page)} animes.")
 
     with open(TOP_ANIME_URLS_FILE, "w") as fout:
         fout.writelines(urls)
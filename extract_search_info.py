@@ -1,21 +1,26 @@
 import csv
+import json
 import string
 import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Optional
 
 import nltk
 
 from nltk.corpus import stopwords, wordnet
-from nltk import pos_tag, word_tokenize
+from nltk import word_tokenize
 from nltk.stem import WordNetLemmatizer
+from nltk.tag.perceptron import PerceptronTagger
 from pathlib import Path
 
-from constants import PARSED_ANIMES_DIRECTORY, SEARCH_INFO_DIRECTORY, TOP_ANIME_URLS_FILE
+from constants import PARSED_ANIMES_DIRECTORY, SEARCH_INFO_DIRECTORY, TOP_ANIME_URLS_FILE, NUM_WORKERS, \
+    LEMMA_CACHE_FILE, LEMMA_CACHE_SIZE, LEMMATIZE_CHUNK_SIZE, POSITIONAL_ANALYSIS
+from instrumentation import Stage
 from utils import prepare_to_download, parsed_anime_filename, search_info_filename
 
 
-lemmatizer = WordNetLemmatizer()
-
-
 def get_wordnet_pos(treebank_tag):
     """
     Convert pos_tag's tags to ones accepted by WordNetLemmatizer.
@@ -33,34 +38,200 @@ def get_wordnet_pos(treebank_tag):
 
     return wordnet.NOUN  # default
 
+class Analyzer:
+    """
+    Text analyzer turning synopses into lists of lemmas.
+
+    The stopwords, the punctuation and the NLTK models are loaded once, and the lemmas of (word, part of speech) pairs
+    are memoized in an LRU cache that can be saved to a file and reloaded in later runs.
+    """
+
+    def __init__(self, cache_size: int = LEMMA_CACHE_SIZE, cache_file: Optional[str] = None):
+        self.words_to_remove = set(stopwords.words('english')) | set(char for char in string.punctuation)
+        self.tagger = PerceptronTagger()
+        self.lemmatizer = WordNetLemmatizer()
+
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # Maps (word, wordnet pos) pairs to their lemma, least recently used first
+        self._new_entries = []  # Entries added since the last call to `pop_new_entries`
+        self.hits, self.misses = 0, 0
+
+        if cache_file and os.path.exists(cache_file):
+            self.load_cache(cache_file)
+
+    def lemma(self, word: str, pos: str) -> str:
+        """Return the lemma of a word, given its wordnet part of speech."""
+        key = (word, pos)
+
+        lemma = self._cache.get(key)
+        if lemma is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return lemma
+
+        self.misses += 1
+        lemma = self.lemmatizer.lemmatize(word, pos)
+        self.add_entries([(word, pos, lemma)])
+        self._new_entries.append((word, pos, lemma))
+        return lemma
+
+    def add_entries(self, entries: Iterable[tuple[str, str, str]]):
+        """Add (word, pos, lemma) entries to the cache, evicting the least recently used ones if full."""
+        for word, pos, lemma in entries:
+            self._cache[(word, pos)] = lemma
+            self._cache.move_to_end((word, pos))
+
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def pop_new_entries(self) -> list[tuple[str, str, str]]:
+        """Return the entries added to the cache since the last call, to merge them into another analyzer's cache."""
+        new_entries, self._new_entries = self._new_entries, []
+        return new_entries
+
+    def cache_info(self) -> dict[str, int]:
+        """Return the cache's hits, misses and current size."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache)}
+
+    def load_cache(self, cache_file: str):
+        """Load the entries of a cache saved with `save_cache`."""
+        with open(cache_file, "r") as fin:
+            self.add_entries(json.load(fin))
+
+    def save_cache(self, cache_file: str):
+        """Save the cache's entries, from the least to the most recently used, to a JSON file."""
+        with open(cache_file, "w") as fout:
+            json.dump([[word, pos, lemma] for (word, pos), lemma in self._cache.items()], fout)
+
+    def lemmatize(self, synopsis: str, positional: bool = POSITIONAL_ANALYSIS) -> list[str]:
+        """
+        Lemmatize a text returning a list of its lemmas and removing stopwords and punctuation.
+
+        If `positional`, all the lemmas are returned in the order they appear, repetitions included, so that the
+        position of each lemma is its index in the list. Otherwise, each lemma is returned once, in no given order.
+        """
+
+        # Run Part-of-Speech tagging to improve tokenization
+        words_and_poses = [
+            word_and_pos
+            for word_and_pos
+            in self.tagger.tag(word_tokenize(synopsis.lower()))
+            if word_and_pos[0] not in self.words_to_remove
+        ]
+
+        lemmas = [self.lemma(word, get_wordnet_pos(pos)) for word, pos in words_and_poses]
+        return lemmas if positional else list(set(lemmas))
+
+
+_analyzer: Optional[Analyzer] = None
+
+
+def get_analyzer() -> Analyzer:
+    """Return the analyzer shared by the calls to `lemmatize` in this process, creating it on first use."""
+    global _analyzer
+
+    if _analyzer is None:
+        _analyzer = Analyzer(cache_file=LEMMA_CACHE_FILE)
+    return _analyzer
+
+
 def lemmatize(synopsis: str) -> list[str]:
     """Lemmatize a text returning a list of its lemmas and removing stopwords and punctuation."""
-    stop_words = set(stopwords.words('english'))
-    punctuation = set(char for char in string.punctuation)
+    return get_analyzer().lemmatize(synopsis)
 
-    words_to_remove = stop_words | punctuation
 
-    # Run Part-of-Speech tagging to improve tokenization
-    words_and_poses = [
-        word_and_pos
-        for word_and_pos
-        in pos_tag(word_tokenize(synopsis.lower()))
-        if word_and_pos[0] not in words_to_remove
+def lemmatize_chunk(synopses: list[str]) -> tuple[list[list[str]], list[tuple[str, str, str]], list[float]]:
+    """
+    Lemmatize a chunk of synopses in a worker process.
+
+    Return the lemmas of each synopsis, along with the lemma cache entries added meanwhile, so that the parent process
+    can persist them, and how long each synopsis took to lemmatize.
+    """
+    analyzer = get_analyzer()
+
+    lemmas, durations = [], []
+    for synopsis in synopses:
+        start = time.perf_counter()
+        lemmas.append(analyzer.lemmatize(synopsis))
+        durations.append(time.perf_counter() - start)
+
+    return lemmas, analyzer.pop_new_entries(), durations
+
+
+def read_search_info(i: int, urls: list[str]) -> tuple[str, str, str]:
+    """Return the title, unprocessed synopsis and url of the i-th anime, reading them from its TSV file."""
+    with open(os.path.join(PARSED_ANIMES_DIRECTORY, parsed_anime_filename(i)), "r") as tsv_file:
+        tsv_reader = csv.reader(tsv_file, delimiter='\t')
+        next(tsv_reader) # Skip headers
+        data = next(tsv_reader)
+
+        return data[0], data[10], urls[i]
+
+
+def save_search_info(i: int, title: str, url: str, lemmas: list[str]):
+    """Save the search info of the i-th anime."""
+    with open(os.path.join(SEARCH_INFO_DIRECTORY, search_info_filename(i)), "w") as out_txt:
+        out_txt.write(title.strip() + "\n")
+        out_txt.write(url.strip() + "\n")
+        out_txt.write("\n".join(lemmas))
+
+
+def extract_search_info_serially(start_file: int, num_files: int, urls: list[str]):
+    """Extract the search info of the animes from `start_file` on, one after the other."""
+    analyzer = get_analyzer()
+
+    with Stage("extract_search_info", total=num_files - start_file) as stage:
+        for i in range(start_file, num_files):
+            with stage.timed_item():
+                title, synopsis, url = read_search_info(i, urls)
+
+                # lemmatize to get more accurate results w.r.t. stemming
+                save_search_info(i, title, url, analyzer.lemmatize(synopsis))
+
+
+def extract_search_info_in_parallel(start_file: int, num_files: int, urls: list[str], num_workers: int):
+    """
+    Extract the search info of the animes from `start_file` on, lemmatizing chunks of synopses in worker processes.
+
+    Results are saved in order as they come, so that the script can still be resumed from the number of saved files.
+    """
+    analyzer = get_analyzer()  # Only used to collect and persist the workers' cache entries
+
+    chunks = [
+        [read_search_info(i, urls) for i in range(chunk_start, min(chunk_start + LEMMATIZE_CHUNK_SIZE, num_files))]
+        for chunk_start in range(start_file, num_files, LEMMATIZE_CHUNK_SIZE)
     ]
+    synopses_chunks = ([synopsis for _, synopsis, _ in chunk] for chunk in chunks)
+
+    i = start_file
+    stage = Stage("extract_search_info", total=num_files - start_file)
+    with stage, ProcessPoolExecutor(num_workers) as executor:
+        for chunk, (lemmas, new_cache_entries, durations) in zip(chunks, executor.map(lemmatize_chunk, synopses_chunks)):
+            analyzer.add_entries(new_cache_entries)
 
-    return list(set(lemmatizer.lemmatize(word, get_wordnet_pos(pos)) for word, pos in words_and_poses))
+            for (title, _, url), synopsis_lemmas, seconds in zip(chunk, lemmas, durations):
+                save_search_info(i, title, url, synopsis_lemmas)
+                stage.item(seconds)
+                i += 1
+
+
+def download_nltk_data():
+    """Download the NLTK data required to lemmatize synopses, if missing."""
+    nltk.download('stopwords', quiet=True)
+    nltk.download('punkt', quiet=True)
+    nltk.download('wordnet', quiet=True)
+    nltk.download('averaged_perceptron_tagger', quiet=True)
 
 
 if __name__ == "__main__":
     """
     This scripts iterates the parsed anime's TSV file to extract only those information required for the search engines.
     
-    The synopsis is stored after NLTK processing. 
+    The synopsis is stored after NLTK processing. If more than one worker is configured, synopses are lemmatized in
+    parallel. If `POSITIONAL_ANALYSIS` is set, all of the synopsis' lemmas are stored in order, one per line, so that
+    the positional index can be built from them (see `create_positional_index.py`).
     """
-    nltk.download('stopwords')
-    nltk.download('punkt')
-    nltk.download('wordnet')
-    nltk.download('averaged_perceptron_tagger')
+    download_nltk_data()
 
     files_to_parse = sorted(Path(PARSED_ANIMES_DIRECTORY).glob("*.tsv"))
     start_file = prepare_to_download(SEARCH_INFO_DIRECTORY)
@@ -68,23 +239,14 @@ if __name__ == "__main__":
     with open(TOP_ANIME_URLS_FILE, "r") as url_file:
         urls = [url.strip() for url in url_file.readlines()]
 
-    for i, path in enumerate(files_to_parse[start_file:], start=start_file):
-
-        # Read the TSV file for this anime to extract search info
-        with open(os.path.join(PARSED_ANIMES_DIRECTORY, parsed_anime_filename(i)), "r") as tsv_file:
-            tsv_reader = csv.reader(tsv_file, delimiter='\t')
-            next(tsv_reader) # Skip headers
-            data = next(tsv_reader)
-
-            title = data[0]
-            # lemmatize to get more accurate results w.r.t. stemming
-            synopsis = lemmatize(data[10]) if data else []
-            url = urls[i]
-
-        with open(os.path.join(SEARCH_INFO_DIRECTORY, search_info_filename(i)), "w") as out_txt:
-            out_txt.write(title.strip() + "\n")
-            out_txt.write(url.strip() + "\n")
-            out_txt.write("\n".join(synopsis))
-
-        if i%100 == 0:
-            print(f"{i}/{len(files_to_parse)}...")
+    num_workers = NUM_WORKERS or os.cpu_count()
+    try:
+        if num_workers > 1:
+            extract_search_info_in_parallel(start_file, len(files_to_parse), urls, num_workers)
+        else:
+            extract_search_info_serially(start_file, len(files_to_parse), urls)
+    finally:
+        # Persist the lemmas computed so far, even if interrupted
+        analyzer = get_analyzer()
+        analyzer.save_cache(LEMMA_CACHE_FILE)
+        print(f"{analyzer.cache_info()['size']} lemmas saved to {LEMMA_CACHE_FILE}")
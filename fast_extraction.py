@@ -0,0 +1,214 @@
+"""
+Fast extraction of the anime's information, using lxml and precompiled XPath expressions.
+
+Each extractor mirrors the BeautifulSoup-based one with the same name in `parse_pages.py` (or the URLs extraction in
+`extract_anime_urls.py`), returning the same values, but running on an lxml tree. lxml parses pages in C, and
+precompiled XPath expressions avoid walking the whole tree in Python with a predicate for each field.
+"""
+from datetime import datetime
+from typing import Optional, Tuple
+
+import lxml.html
+from lxml import etree
+
+
+def _has_class(class_name: str) -> str:
+    """XPath predicate matching elements having `class_name` among their classes."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')"
+
+
+TITLE = etree.XPath(f"(//div[{_has_class('h1-title')}])[1]/descendant::div[1]/descendant::h1[1]/descendant::strong[1]")
+
+# Candidate spans for each label (the exact match on the span's string is then done in Python)
+LABEL_SPANS = {
+    label: etree.XPath(f"//span[contains(., '{label}')]")
+    for label in ("Type:", "Episodes:", "Aired:")
+}
+
+MEMBERS = etree.XPath("(//span[@class='numbers members'])[1]")
+SCORE = etree.XPath("(//span[@itemprop='ratingValue'])[1]")
+# The BeautifulSoup extractor passes a set instead of a dict as the attributes to look for, which BeautifulSoup
+# interprets as a set of classes: mirror it, to give the same results
+USERS = etree.XPath(f"(//span[{_has_class('itemprop')} or {_has_class('ratingCount')}])[1]")
+POPULARITY = etree.XPath("(//span[@class='numbers popularity'])[1]")
+
+DESCRIPTION = etree.XPath("(//p[@itemprop='description'])[1]")
+
+RELATED_ANIME_LINKS = etree.XPath(
+    f"(//table[{_has_class('anime_detail_related_anime')}])[1]//a[starts-with(@href, '/anime')]"
+)
+
+CHARACTERS_DIVS = etree.XPath(f"//div[{_has_class('detail-characters-list')}]")
+CHARACTER_NAMES = etree.XPath(f".//h3[{_has_class('h3_characters_voice_actors')}]")
+PEOPLE_LINKS = etree.XPath(".//a[contains(@href, '/people/')]")
+FIRST_LINK = etree.XPath("descendant::a[1]")
+LINKS = etree.XPath(".//a")
+FIRST_IMAGE = etree.XPath("descendant::img[1]")
+ROLE = etree.XPath("descendant::div[1]/descendant::small[1]")
+
+RANKING_ROWS = etree.XPath(f"//tr[{_has_class('ranking-list')}]")
+RANKING_ROW_LINK = etree.XPath("(descendant::td)[2]/descendant::a[1]/@href")
+
+
+def parse_page(page: bytes) -> etree._Element:
+    """Parse a page into an lxml tree."""
+    return lxml.html.document_fromstring(page)
+
+
+def _first(elements: list) -> Optional[etree._Element]:
+    return elements[0] if elements else None
+
+
+def get_tag_text(tag: Optional[etree._Element]) -> Optional[str]:
+    """Retrieve and strip the text directly inside a tag (not in its children), defaulting to None if missing."""
+    if tag is None:
+        return None
+
+    texts = [tag.text or ""]
+    for child in tag:
+        if isinstance(child, etree._Comment):  # BeautifulSoup considers comments as text
+            texts.append(child.text or "")
+        texts.append(child.tail or "")
+
+    return "".join(texts).strip()
+
+
+def _string(tag: etree._Element) -> Optional[str]:
+    """
+    Return the only string inside a tag, like BeautifulSoup's `Tag.string`.
+
+    That is the tag's text if it has no children, the only child's string if it has exactly one child and no text,
+    None otherwise.
+    """
+    children = list(tag)
+    if not children:
+        return tag.text
+    if len(children) == 1 and not tag.text and not children[0].tail:
+        return _string(children[0])
+    return None
+
+
+def _find_label(tree: etree._Element, label: str) -> Optional[etree._Element]:
+    """Find the first span whose string contains a label."""
+    for span in LABEL_SPANS[label](tree):
+        string = _string(span)
+        if string and label in string:
+            return span
+    return None
+
+
+def extract_title(tree: etree._Element) -> str:
+    """Extract an anime's title."""
+    strong = _first(TITLE(tree))
+    if strong is None:
+        raise AttributeError("Title not found")
+    return strong.text_content().strip()
+
+
+def extract_type_episodes_and_dates(tree: etree._Element) -> Tuple[str, int, Optional[datetime], Optional[datetime]]:
+    """Extract an anime's type, number of episodes and start/end dates."""
+    from parse_pages import _parse_airing_dates  # Imported here to avoid a circular import
+
+    type_tag = _find_label(tree, "Type:")
+    _type = get_tag_text(type_tag.getparent()) if type_tag is not None else None
+
+    episodes_tag = _find_label(tree, "Episodes:")
+    episodes = None
+    if episodes_tag is not None:
+        try:
+            episodes = int(get_tag_text(episodes_tag.getparent()))
+        except:
+            pass
+
+    dates_tag = _find_label(tree, "Aired:")
+    start_date, end_date = None, None
+    if dates_tag is not None:
+        try:
+            start_date, end_date = _parse_airing_dates(get_tag_text(dates_tag.getparent()))
+        except:
+            pass
+
+    return _type, episodes, start_date, end_date
+
+
+def extract_score_info(tree: etree._Element, rank: int) -> Tuple[int, float, int, int, int]:
+    """Extract an anime's members, score, users, rank and popularity."""
+    members, score, users, popularity = 0, 0.0, 0, 0
+
+    try:
+        members_text = get_tag_text(_first(MEMBERS(tree)))
+        if members_text:
+            members = int(members_text.replace(",", ""))
+    except:
+        members = None
+
+    try:
+        score = int(get_tag_text(_first(SCORE(tree))))
+    except:
+        score = None
+
+    try:
+        users = int(get_tag_text(_first(USERS(tree))))
+    except:
+        users = None
+
+    try:
+        popularity_text = get_tag_text(_first(POPULARITY(tree)))
+        if popularity_text:
+            popularity = int(popularity_text.replace(",", ""))
+    except:
+        popularity = None
+
+    return members, score, users, rank, popularity
+
+
+def extract_description(tree: etree._Element) -> Optional[str]:
+    """Extract an anime's synopsis."""
+    return get_tag_text(_first(DESCRIPTION(tree)))
+
+
+def extract_related_anime(tree: etree._Element) -> list[str]:
+    """Extract an anime's list of related animes."""
+    return list(dict.fromkeys(get_tag_text(anime_link) for anime_link in RELATED_ANIME_LINKS(tree)))
+
+
+def extract_characters_and_voices(tree: etree._Element) -> tuple[list[str], list[str]]:
+    """Extract an anime's characters and their voice actors."""
+    characters_div = _first(CHARACTERS_DIVS(tree))  # First one is characters/VAs, second is staff
+    if characters_div is None:
+        return [], []
+
+    characters = [get_tag_text(_first(FIRST_LINK(tag))) for tag in CHARACTER_NAMES(characters_div)]
+
+    voices = [get_tag_text(tag) for tag in PEOPLE_LINKS(characters_div) if _string(tag)]
+
+    return characters, voices
+
+
+def extract_anime_staff(tree: etree._Element) -> list[list[str]]:
+    """Extract an anime's staff."""
+    divs = CHARACTERS_DIVS(tree)
+    if len(divs) < 2:
+        return []
+
+    staff = []
+    for a_tag in LINKS(divs[1]):
+        if FIRST_IMAGE(a_tag):  # Skip images
+            continue
+
+        role_tag = _first(ROLE(a_tag.getparent()))
+        if role_tag is not None:
+            staff.append([get_tag_text(a_tag), get_tag_text(role_tag)])
+
+    return staff
+
+
+def extract_anime_urls(tree: etree._Element) -> list[str]:
+    """Extract the URLs of the animes in a top chart page."""
+    urls = []
+    for row in RANKING_ROWS(tree):
+        href = RANKING_ROW_LINK(row)
+        if not href:
+            raise AttributeError("Ranking row without link")
+        urls.append(href[0])
+    return urls
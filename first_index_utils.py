@@ -1,49 +1,200 @@
-from constants import VOCABULARY_FILE, FIRST_INDEX_FILE
-from utils import retrieve_title_synopsis_and_url
+import heapq
+import itertools
+import os
+from bisect import bisect_left
+from typing import Iterable, Union
 
+from compression_utils import CompressedIndex, save_compressed_index
+from constants import FIRST_INDEX_FILE, FIRST_INDEX_BINARY_FILE
 
-def load_first_index():
+
+def load_first_index(path: str = FIRST_INDEX_FILE):
     """
     Load the first index from the file where it was saved.
     """
     index = []
 
-    with open(FIRST_INDEX_FILE, "r") as fin:
+    with open(path, "r") as fin:
         for documents_ids_line in fin.readlines():
-            documents_ids = [int(_id) for _id in documents_ids_line.split(" ")]
+            documents_ids = [int(_id) for _id in documents_ids_line.split()]
             index.append(documents_ids)
 
     return index
 
 
+def save_first_index(index: list[list[int]]):
+    """
+    Save the first index to a file, along with its compressed version.
+    """
+    with open(FIRST_INDEX_FILE, "w") as out_txt:
+        for i in range(len(index)):
+            # The n-th line contains the IDs of the documents that include the term with ID n
+            out_txt.write(" ".join(str(doc_id) for doc_id in index[i]) + "\n")
+
+    # The compressed version can be memory-mapped at query time
+    save_compressed_index(index, FIRST_INDEX_BINARY_FILE)
+
+
+def open_first_index(path: str = FIRST_INDEX_FILE, binary_path: str = FIRST_INDEX_BINARY_FILE):
+    """
+    Open the first index, preferring its compressed version if available.
+
+    The compressed index is memory-mapped and only decodes the posting lists that are accessed, while the text one
+    has to be fully loaded and parsed.
+    """
+    if os.path.exists(binary_path):
+        return CompressedIndex(binary_path)
+
+    return load_first_index(path)
+
+
+def posting_list_size(index: Union[CompressedIndex, list[list[int]]], term_id: int) -> int:
+    """
+    Return an estimate of a term's document frequency, without decoding its posting list if compressed.
+    """
+    if isinstance(index, CompressedIndex):
+        return index.encoded_size(term_id)
+    return len(index[term_id])
+
+
+def gallop(postings: list[int], target: int, start: int = 0) -> int:
+    """
+    Return the position of the first document ID not lower than `target` in `postings[start:]`.
+
+    The position is searched with exponential steps from `start`, then with a binary search, so that skipping ahead
+    by n positions only costs O(log n) comparisons.
+    """
+    low, high, step = start, start, 1
+    while high < len(postings) and postings[high] < target:
+        low = high + 1
+        high += step
+        step *= 2
+
+    return bisect_left(postings, target, low, min(high, len(postings)))
+
+
+def intersect_postings(shorter: list[int], longer: list[int]) -> list[int]:
+    """
+    Intersect two sorted lists of document IDs, galloping through the longer one for each document of the shorter one.
+    """
+    result = []
+    position = 0
+
+    for document_id in shorter:
+        position = gallop(longer, document_id, position)
+        if position == len(longer):
+            break
+        if longer[position] == document_id:
+            result.append(document_id)
+            position += 1
+
+    return result
+
+
+def subtract_postings(postings: list[int], excluded: list[int]) -> list[int]:
+    """
+    Remove the excluded document IDs from a sorted list of document IDs, galloping through the excluded ones.
+    """
+    result = []
+    position = 0
+
+    for document_id in postings:
+        position = gallop(excluded, document_id, position)
+        if position == len(excluded) or excluded[position] != document_id:
+            result.append(document_id)
+
+    return result
+
+
+def merge_postings(postings_lists: Iterable[list[int]]) -> list[int]:
+    """
+    Compute the union of sorted lists of document IDs, merging them in a single pass.
+    """
+    return [document_id for document_id, _ in itertools.groupby(heapq.merge(*postings_lists))]
+
+
+def intersect_all_postings(postings_lists: Iterable[list[int]]) -> list[int]:
+    """
+    Intersect sorted lists of document IDs, stopping as soon as no candidates are left.
+
+    The lists should come shortest first, so that the candidates shrink quickly. They are consumed lazily, so the
+    lists after an empty intersection are never read.
+    """
+    result = None
+
+    for postings in postings_lists:
+        if result is None:
+            result = postings
+        else:
+            result = intersect_postings(*sorted((result, postings), key=len))
+
+        if not result:
+            break
+
+    return list(result) if result else []
+
+
+def parse_boolean_query(query: list[str]) -> tuple[list[list[str]], list[str]]:
+    """
+    Parse a boolean query into the clauses that must all be matched, each one being the list of (lowercase) words
+    any of which must appear, and the words that must not appear.
+
+    Terms are implicitly joined by AND, "OR" joins the terms around it and "NOT" excludes the term following it.
+    """
+    clauses, excluded = [], []
+    join_next, exclude_next = False, False
+
+    for token in query:
+        if token == "OR":
+            if not clauses or join_next or exclude_next:
+                raise Exception("OR must be placed between two terms")
+            join_next = True
+        elif token == "NOT":
+            if join_next or exclude_next:
+                raise Exception("NOT must be followed by a term")
+            exclude_next = True
+        elif exclude_next:
+            excluded.append(token.lower())
+            exclude_next = False
+        elif join_next:
+            clauses[-1].append(token.lower())
+            join_next = False
+        else:
+            clauses.append([token.lower()])
+
+    if join_next or exclude_next:
+        raise Exception("The query can't end with an operator")
+
+    if not clauses:
+        raise Exception("Please supply at least one query term that is not excluded")
+
+    return clauses, excluded
+
+
 def run_query_on_first_index(query: list[str]) -> list[tuple[str, str, str]]:
     """
     Given a query, return title, synopsis and url of the animes that match it.
     """
-    with open(VOCABULARY_FILE, "r") as fin:
-        vocabulary = [word.strip() for word in fin.readlines()]
+    from search_engine import get_search_engine  # Imported here to avoid a circular import
 
-    if not query:
-        raise Exception("Please supply at least one query term")
+    return get_search_engine().run_query_on_first_index(query)
 
-    if any(word.lower() not in vocabulary for word in query):  # If a word is missing from the vocabulary, the query can't be matched
-        return []
 
-    index = load_first_index()
-
-    # First retrieve all documents matching the first query term
-    matches = set(index[vocabulary.index(query[0])])
+def run_boolean_query(query: list[str]) -> list[tuple[str, str, str]]:
+    """
+    Given a boolean query, return title, synopsis and url of the animes that match it.
 
-    # Then compute the intersection with all other terms' partial matches
-    for query_term in query[1:]:
-        partial_result = set(index[vocabulary.index(query_term)])
-        matches = matches.intersection(partial_result)
+    Terms are implicitly joined by AND, "OR" joins the terms around it and "NOT" excludes the term following it, e.g.
+    `["alchemy", "edward", "OR", "alphonse", "NOT", "military"]`.
+    """
+    from search_engine import get_search_engine  # Imported here to avoid a circular import
 
-    return [retrieve_title_synopsis_and_url(i) for i in matches]
+    return get_search_engine().run_boolean_query(query)
 
 
 if __name__ == "__main__":
     """
     Test to check that the method defined above works as expected.
     """
-    print(run_query_on_first_index(["saiyan"]))
\ No newline at end of file
+    print(run_query_on_first_index(["saiyan"]))
+    print(run_boolean_query(["alchemy", "edward", "OR", "alphonse", "NOT", "military"]))
\ No newline at end of file
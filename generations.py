@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Optional
+
+from constants import GENERATIONS_DIRECTORY, GENERATION_MANIFEST_FILE, CURRENT_GENERATION_FILE, GENERATIONS_TO_KEEP, \
+    VOCABULARY_FILE, FIRST_INDEX_FILE, FIRST_INDEX_BINARY_FILE, SECOND_INDEX_FILE, SECOND_INDEX_MATRIX_FILE, \
+    SECOND_INDEX_NORMS_FILE, POSITIONAL_INDEX_FILE, METADATA_FILE, DOCUMENT_STORE_FILE, TOP_ANIME_URLS_FILE, \
+    SEGMENTS_DIRECTORY, SEGMENTS_MANIFEST_FILE, VERBOSE
+from utils import atomic_open
+
+# The files making up a generation, if they have been built, along with the segmented index. The vocabulary, the first
+# index and the URLs (giving the results' URLs and the number of documents) are required
+GENERATION_FILES = [
+    TOP_ANIME_URLS_FILE,
+    VOCABULARY_FILE,
+    FIRST_INDEX_FILE,
+    FIRST_INDEX_BINARY_FILE,
+    SECOND_INDEX_FILE,
+    SECOND_INDEX_MATRIX_FILE,
+    SECOND_INDEX_NORMS_FILE,
+    POSITIONAL_INDEX_FILE,
+    METADATA_FILE,
+    DOCUMENT_STORE_FILE,
+]
+REQUIRED_GENERATION_FILES = [TOP_ANIME_URLS_FILE, VOCABULARY_FILE, FIRST_INDEX_FILE]
+
+
+def file_checksum(path: str) -> str:
+    """Return the SHA-256 digest of a file's content, reading it in chunks."""
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as fin:
+        for chunk in iter(lambda: fin.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def files_version(directory: str = "") -> str:
+    """
+    Return a version identifying the indexes built in a directory outside of generations, which changes whenever
+    they are rebuilt (from the size and modification time of their files).
+    """
+    signature = hashlib.sha256()
+
+    for filename in GENERATION_FILES:
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature.update(f"{filename}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+
+    return signature.hexdigest()[:16]
+
+
+def read_segments_snapshot(source_directory: str) -> Optional[tuple[bytes, list[str]]]:
+    """
+    Return the content of the segmented index's manifest in a directory and the paths (relative to the directory) of
+    the segments it lists, or None if the segmented index hasn't been built there.
+
+    The manifest is read once, so the segments are the ones it lists even if the index is updated meanwhile: the files
+    of merged segments are only deleted a while later (see `SegmentedIndexWriter`), so they can still be copied.
+    """
+    try:
+        with open(os.path.join(source_directory, SEGMENTS_DIRECTORY, SEGMENTS_MANIFEST_FILE), "rb") as fin:
+            content = fin.read()
+    except FileNotFoundError:
+        return None
+
+    segments = json.loads(content)["segments"]
+    return content, [os.path.join(SEGMENTS_DIRECTORY, f"{entry['name']}.npz") for entry in segments]
+
+
+def generation_path(name: str, directory: str = GENERATIONS_DIRECTORY) -> str:
+    return os.path.join(directory, name)
+
+
+def list_generations(directory: str = GENERATIONS_DIRECTORY) -> list[str]:
+    """Return the names of the published generations, from the oldest to the newest."""
+    if not os.path.isdir(directory):
+        return []
+
+    # Generations being written have a temporary name, and are only listed once complete
+    return sorted(
+        path.name for path in Path(directory).iterdir()
+        if path.name.startswith("generation_") and (path / GENERATION_MANIFEST_FILE).exists()
+    )
+
+
+def current_generation(directory: str = GENERATIONS_DIRECTORY) -> Optional[str]:
+    """Return the name of the generation queries should be served from, or None if none was published."""
+    try:
+        with open(os.path.join(directory, CURRENT_GENERATION_FILE), "r") as fin:
+            return fin.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_generation_manifest(name: str, directory: str = GENERATIONS_DIRECTORY) -> dict:
+    with open(os.path.join(generation_path(name, directory), GENERATION_MANIFEST_FILE), "r") as fin:
+        return json.load(fin)
+
+
+def verify_generation(name: str, directory: str = GENERATIONS_DIRECTORY):
+    """
+    Check that the files of a generation are the ones listed in its manifest, raising an exception otherwise.
+    """
+    path = generation_path(name, directory)
+    manifest = load_generation_manifest(name, directory)
+
+    for filename, info in manifest["files"].items():
+        file_path = os.path.join(path, filename)
+        if not os.path.exists(file_path):
+            raise Exception(f"Generation {name} is missing {filename}")
+        if os.path.getsize(file_path) != info["size"] or file_checksum(file_path) != info["sha256"]:
+            raise Exception(f"Generation {name} has a corrupted {filename}")
+
+
+def switch_generation(name: str, directory: str = GENERATIONS_DIRECTORY):
+    """
+    Make a published generation the one queries are served from, replacing the pointer file atomically.
+    """
+    if name not in list_generations(directory):
+        raise Exception(f"Unknown generation: {name}")
+
+    with atomic_open(os.path.join(directory, CURRENT_GENERATION_FILE)) as fout:
+        fout.write(name)
+
+
+def publish_generation(source_directory: str = ".", directory: str = GENERATIONS_DIRECTORY) -> str:
+    """
+    Publish the indexes built in a directory as a new generation, and make it the current one. Return its name.
+
+    The files are copied to a new directory along with a manifest of their checksums. The directory only gets its
+    final name once complete, and the pointer to the current generation is then switched atomically, so readers
+    never see a partially written generation, and the files they are reading are never overwritten.
+
+    The segmented index, if built, is copied as it is when publishing, so the generation serves the same documents
+    whichever index answers a query. Later updates to it are served once published in a new generation.
+    """
+    for filename in REQUIRED_GENERATION_FILES:
+        if not os.path.exists(os.path.join(source_directory, filename)):
+            raise Exception(f"Cannot publish a generation without {filename}")
+
+    Path(directory).mkdir(exist_ok=True)
+
+    # Names sort in order of creation, the timestamp keeping them unique across runs
+    generations = list_generations(directory)
+    number = int(generations[-1].split("_")[1]) + 1 if generations else 0
+    name = f"generation_{number:06}_{int(time.time())}"
+
+    temporary_path = generation_path(f".{name}.tmp", directory)
+    os.makedirs(temporary_path)
+
+    try:
+        filenames = [
+            filename for filename in GENERATION_FILES if os.path.exists(os.path.join(source_directory, filename))
+        ]
+
+        segments = read_segments_snapshot(source_directory)
+        if segments is not None:
+            manifest_content, segment_filenames = segments
+            os.makedirs(os.path.join(temporary_path, SEGMENTS_DIRECTORY))
+            with open(os.path.join(temporary_path, SEGMENTS_DIRECTORY, SEGMENTS_MANIFEST_FILE), "wb") as fout:
+                fout.write(manifest_content)
+            filenames += segment_filenames
+
+        for filename in filenames:
+            # Copied rather than hard linked, since rebuilding the indexes overwrites the files in place
+            shutil.copyfile(os.path.join(source_directory, filename), os.path.join(temporary_path, filename))
+
+        if segments is not None:
+            filenames.append(os.path.join(SEGMENTS_DIRECTORY, SEGMENTS_MANIFEST_FILE))
+
+        files = {}
+        for filename in filenames:
+            path = os.path.join(temporary_path, filename)
+            files[filename] = {"size": os.path.getsize(path), "sha256": file_checksum(path)}
+
+        with open(os.path.join(temporary_path, GENERATION_MANIFEST_FILE), "w") as fout:
+            json.dump({"name": name, "created": time.time(), "files": files}, fout, indent=2)
+
+        os.replace(temporary_path, generation_path(name, directory))
+    finally:
+        if os.path.exists(temporary_path):
+            shutil.rmtree(temporary_path)
+
+    switch_generation(name, directory)
+
+    if VERBOSE:
+        print(f"Published {name} ({len(files)} files)")
+
+    return name
+
+
+def prune_generations(keep: int = GENERATIONS_TO_KEEP, directory: str = GENERATIONS_DIRECTORY) -> list[str]:
+    """
+    Delete the oldest generations, keeping the `keep` latest ones and the current one. Return the deleted ones.
+
+    Readers still using a deleted generation keep working, since the files they have open or memory-mapped are only
+    freed once closed.
+    """
+    current = current_generation(directory)
+    generations = list_generations(directory)
+
+    deleted = [name for name in generations[:max(len(generations) - keep, 0)] if name != current]
+    for name in deleted:
+        shutil.rmtree(generation_path(name, directory))
+
+    return deleted
+
+
+if __name__ == "__main__":
+    """
+    This script publishes the indexes built in the current directory as a new generation, which running search engines
+    then pick up without restarting, and deletes the oldest generations.
+    """
+    name = publish_generation()
+    verify_generation(name)
+
+    for deleted in prune_generations():
+        print(f"Deleted {deleted}")
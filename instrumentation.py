@@ -0,0 +1,283 @@
+import atexit
+import cProfile
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+from constants import METRICS_FILE_VARIABLE, PROFILE_VARIABLE, PROFILES_DIRECTORY, PROGRESS_INTERVAL, VERBOSE
+
+# Upper bounds (in milliseconds) of the latency histograms' buckets, doubling from 10 µs to about 84 s
+HISTOGRAM_BOUNDS = [0.01 * 2**k for k in range(24)]
+
+TRACEMALLOC_TOP_ALLOCATIONS = 10  # How many of the lines allocating the most memory to report when tracing
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies with exponentially growing buckets, from which approximate percentiles are computed.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)  # The last bucket counts latencies above all bounds
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        milliseconds = seconds * 1000
+        self.counts[bisect_left(HISTOGRAM_BOUNDS, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+
+    def percentile(self, percentile: float) -> float:
+        """Return an upper bound of a percentile (between 0 and 100): the upper bound of its bucket."""
+        rank = percentile / 100 * self.count
+        seen = 0
+        for bound, count in zip(HISTOGRAM_BOUNDS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count if self.count else 0.0,
+            "max_ms": self.max,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            # Only the non-empty buckets, by upper bound
+            "buckets": {
+                f"{bound:g}" if i < len(HISTOGRAM_BOUNDS) else "inf": count
+                for i, (bound, count) in enumerate(zip(HISTOGRAM_BOUNDS + [float("inf")], self.counts)) if count
+            },
+        }
+
+
+_events_file = None
+_events_lock = threading.Lock()
+
+
+def emit(event: str, **fields):
+    """
+    Write an event, with its time and process ID, as a JSON line to the file named by the metrics environment
+    variable. Nothing is written if it isn't set.
+    """
+    global _events_file
+
+    path = os.environ.get(METRICS_FILE_VARIABLE)
+    if not path:
+        return
+
+    line = json.dumps({"time": time.time(), "event": event, "pid": os.getpid(), **fields}, default=str) + "\n"
+
+    with _events_lock:
+        if _events_file is None or _events_file.name != path:
+            # Appended to line by line, so that the events of concurrent processes don't get mixed
+            _events_file = open(path, "a", buffering=1)
+        _events_file.write(line)
+
+
+def peak_memory_mb() -> dict[str, float]:
+    """Return the peak resident memory of the current process and of the largest of its finished child processes."""
+    scale = 1 if sys.platform == "darwin" else 1024  # Bytes on macOS, kilobytes on Linux
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1024 * 1024),
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / (1024 * 1024),
+    }
+
+
+def profiling_modes() -> set[str]:
+    """Return the profilers enabled by the profiling environment variable ("cprofile", "tracemalloc" or both)."""
+    return {mode.strip().lower() for mode in os.environ.get(PROFILE_VARIABLE, "").split(",") if mode.strip()}
+
+
+class Profiler:
+    """
+    Profile a block of code with the profilers enabled by the profiling environment variable, if any.
+
+    cProfile statistics are saved to a file (to be read with `pstats` or e.g. snakeviz), while tracemalloc's peak
+    traced memory and top allocating lines are returned, to be reported with the block's other metrics.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.modes = profiling_modes()
+        self._profile = None
+        self._started_tracemalloc = False
+
+    def start(self):
+        if "tracemalloc" in self.modes and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        if "cprofile" in self.modes:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self) -> dict:
+        report = {}
+
+        if self._profile is not None:
+            self._profile.disable()
+            Path(PROFILES_DIRECTORY).mkdir(exist_ok=True)
+            path = os.path.join(PROFILES_DIRECTORY, f"{self.name}-{os.getpid()}-{int(time.time())}.prof")
+            self._profile.dump_stats(path)
+            report["cprofile"] = path
+
+        if self._started_tracemalloc:
+            _, peak = tracemalloc.get_traced_memory()
+            top_allocations = tracemalloc.take_snapshot().statistics("lineno")[:TRACEMALLOC_TOP_ALLOCATIONS]
+            tracemalloc.stop()
+            report["tracemalloc"] = {
+                "peak_mb": peak / (1024 * 1024),
+                "top_allocations": [
+                    {"line": str(statistic.traceback), "size_mb": statistic.size / (1024 * 1024)}
+                    for statistic in top_allocations
+                ],
+            }
+
+        return report
+
+
+class Stage:
+    """
+    Instrument a stage of the pipeline (e.g. downloading or parsing pages): used as a context manager around the
+    stage, it is told about each item processed, error and retry.
+
+    Progress is printed and emitted as an event at most every `interval` seconds, and a summary is emitted at the end
+    with the items per second, the histogram of the items' latencies (when timed), the error and retry counts, the
+    peak memory and the profilers' reports. It can be shared by threads.
+    """
+
+    def __init__(self, name: str, total: Optional[int] = None, interval: float = PROGRESS_INTERVAL):
+        self.name = name
+        self.total = total
+        self.interval = interval
+
+        self.items = 0
+        self.errors = 0
+        self.retries = 0
+        self.latencies = LatencyHistogram()
+
+        self._lock = threading.Lock()
+        self._profiler = Profiler(name)
+        self._start = None
+        self._last_report = None
+
+    def __enter__(self) -> "Stage":
+        self._start = self._last_report = time.perf_counter()
+        emit("stage_start", stage=self.name, total=self.total)
+        self._profiler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        profile = self._profiler.stop()
+        summary = dict(self.metrics(), status="ok" if exc_type is None else f"failed: {exc_type.__name__}")
+        emit("stage_end", **summary, latency=self.latencies.to_dict(), memory_mb=peak_memory_mb(), **profile)
+
+        if VERBOSE:
+            errors = f", {self.errors} errors" if self.errors else ""
+            retries = f", {self.retries} retries" if self.retries else ""
+            print(
+                f"{self.name}: {self.items} items in {summary['seconds']:.1f} s "
+                f"({summary['items_per_second']:.1f}/s){errors}{retries}"
+            )
+
+    def metrics(self) -> dict:
+        seconds = time.perf_counter() - self._start
+        return {
+            "stage": self.name,
+            "items": self.items,
+            "total": self.total,
+            "seconds": seconds,
+            "items_per_second": self.items / seconds if seconds > 0 else 0.0,
+            "errors": self.errors,
+            "retries": self.retries,
+        }
+
+    def item(self, seconds: Optional[float] = None, count: int = 1):
+        """Count processed items, along with the latency of processing one of them if known."""
+        with self._lock:
+            self.items += count
+            if seconds is not None:
+                self.latencies.record(seconds)
+        self._report_progress()
+
+    @contextmanager
+    def timed_item(self):
+        """Time the processing of an item, counted once done."""
+        start = time.perf_counter()
+        yield
+        self.item(time.perf_counter() - start)
+
+    def error(self, count: int = 1):
+        with self._lock:
+            self.errors += count
+
+    def retry(self, count: int = 1):
+        with self._lock:
+            self.retries += count
+
+    def _report_progress(self):
+        now = time.perf_counter()
+        with self._lock:
+            if now - self._last_report < self.interval:
+                return
+            self._last_report = now
+
+        metrics = self.metrics()
+        emit("stage_progress", **metrics)
+
+        if VERBOSE:
+            total = f"/{self.total}" if self.total is not None else ""
+            print(f"{self.name}: {self.items}{total} ({metrics['items_per_second']:.1f}/s)...")
+
+
+_query_latencies: dict[str, LatencyHistogram] = {}
+
+
+def instrumented_query(mode: str):
+    """
+    Decorator timing each call of a query function, emitting an event per query and a summary of each mode's
+    latencies when the process exits.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            results, error = None, None
+            try:
+                results = function(*args, **kwargs)
+                return results
+            except Exception as e:
+                error = str(e)
+                raise
+            finally:
+                seconds = time.perf_counter() - start
+                with _events_lock:
+                    _query_latencies.setdefault(mode, LatencyHistogram()).record(seconds)
+                emit(
+                    "query", mode=mode, latency_ms=seconds * 1000,
+                    results=len(results) if results is not None else None, error=error
+                )
+
+        return wrapper
+
+    return decorator
+
+
+@atexit.register
+def _emit_query_summaries():
+    for mode, latencies in _query_latencies.items():
+        emit("query_summary", mode=mode, latency=latencies.to_dict())
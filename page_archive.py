@@ -0,0 +1,135 @@
+import gzip
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+from constants import ANIMES_ARCHIVE, ANIMES_DIRECTORY, TOP_CHARTS_ARCHIVE, TOP_CHARTS_PAGES_DIRECTORY, \
+    TOP_ANIME_URLS_FILE
+from utils import anime_filename, top_anime_filename
+
+
+class PageArchive:
+    """
+    Append-only archive of downloaded pages, similar to a WARC file.
+
+    Pages are stored as raw bytes, each one compressed as a separate gzip member appended to a single data file
+    (so that the data file as a whole is a valid gzip file). A separate index file records, for each page, its key,
+    URL, offset and length in the data file, so that any page can be read with a single seek.
+
+    A page is added to the index only once its data has been written, so an interrupted download never leaves a
+    partial page in the archive. An index entry left incomplete by an interrupted write is ignored, and removed before
+    the next page is added. Adding a page with an existing key replaces it.
+    """
+
+    def __init__(self, path: str):
+        self.data_path = Path(f"{path}.gz")
+        self.index_path = Path(f"{path}.idx")
+
+        self._entries: dict[str, tuple[int, int]] = {}  # Maps keys to (offset, length) pairs
+        self._keys_by_url: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._torn_index_end = None  # Where the complete entries end, if followed by an incomplete one
+
+        if self.index_path.exists():
+            with open(self.index_path, "rb") as fin:
+                end = 0
+                for line in fin:
+                    if not line.endswith(b"\n"):  # Entry left incomplete by an interrupted write
+                        self._torn_index_end = end
+                        break
+                    end += len(line)
+
+                    key, url, offset, length = line.decode("utf-8").rstrip("\n").split("\t")
+                    self._entries[key] = (int(offset), int(length))
+                    if url:
+                        self._keys_by_url[url] = key
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def keys(self) -> list[str]:
+        return list(self._entries)
+
+    def put(self, key: str, content: bytes, url: str = ""):
+        """Add a page to the archive."""
+        record = gzip.compress(content)
+
+        with self._lock:
+            if self._torn_index_end is not None:
+                # Remove the incomplete entry, so that the new one isn't appended to it
+                os.truncate(self.index_path, self._torn_index_end)
+                self._torn_index_end = None
+
+            with open(self.data_path, "ab") as fout:
+                offset = fout.seek(0, os.SEEK_END)
+                fout.write(record)
+                fout.flush()
+                os.fsync(fout.fileno())
+
+            with open(self.index_path, "a") as fout:
+                fout.write(f"{key}\t{url}\t{offset}\t{len(record)}\n")
+
+            self._entries[key] = (offset, len(record))
+            if url:
+                self._keys_by_url[url] = key
+
+    def get(self, key: str) -> bytes:
+        """Return the content of a page, raising KeyError if missing."""
+        offset, length = self._entries[key]
+
+        with open(self.data_path, "rb") as fin:
+            fin.seek(offset)
+            return gzip.decompress(fin.read(length))
+
+    def location(self, key: str) -> Optional[tuple[int, int]]:
+        """
+        Return the offset and length of a page's record in the data file, or None if missing.
+
+        Since the archive is append-only, a page's location changes whenever it is replaced.
+        """
+        return self._entries.get(key)
+
+    def get_by_url(self, url: str) -> bytes:
+        """Return the content of the page downloaded from a URL, raising KeyError if missing."""
+        return self.get(self._keys_by_url[url])
+
+    def key_of_url(self, url: str) -> Optional[str]:
+        return self._keys_by_url.get(url)
+
+
+def anime_key(index: int) -> str:
+    """Return the key of the page of the index-th anime (0-indexed, by rank) in the animes' archive."""
+    return f"{index:05}"
+
+
+def top_anime_key(page: int) -> str:
+    """Return the key of the page-th (0-indexed) top chart page in the top charts' archive."""
+    return f"{page:03}"
+
+
+if __name__ == "__main__":
+    """
+    This script imports pages downloaded as individual files by previous versions of the downloaders into the archives.
+    """
+    urls = []
+    if os.path.exists(TOP_ANIME_URLS_FILE):
+        with open(TOP_ANIME_URLS_FILE, "r") as fin:
+            urls = [url.strip() for url in fin.readlines()]
+
+    for directory, archive_path, filename, key, url_of in (
+            (TOP_CHARTS_PAGES_DIRECTORY, TOP_CHARTS_ARCHIVE, top_anime_filename, top_anime_key, lambda i: ""),
+            (ANIMES_DIRECTORY, ANIMES_ARCHIVE, anime_filename, anime_key, lambda i: urls[i]),
+    ):
+        archive = PageArchive(archive_path)
+        num_files = len(list(Path(directory).glob("*.html")))
+
+        for i in range(num_files):
+            if key(i) not in archive:
+                with open(os.path.join(directory, filename(i)), "rb") as fin:
+                    archive.put(key(i), fin.read(), url_of(i))
+
+        print(f"{directory}: {num_files} pages imported into {archive.data_path}")
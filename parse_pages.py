@@ -1,15 +1,25 @@
 import csv
+import functools
 import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from pathlib import Path
 from typing import Tuple, Optional
 
 import bs4
 import re
 from bs4 import BeautifulSoup
-from pathlib import Path
+from lxml import etree
 
-from constants import ANIMES_DIRECTORY, PARSED_ANIMES_DIRECTORY
-from utils import Anime, prepare_to_download, parsed_anime_filename
+import fast_extraction
+from constants import METADATA_FILE, ANIMES_ARCHIVE, PARSED_ANIMES_DIRECTORY, PARSE_ERRORS_FILE, PARSE_CHUNK_SIZE, NUM_WORKERS, \
+    FAST_EXTRACTION
+from custom_metrics_utils import extract_metadata, save_metadata
+from instrumentation import Stage
+from page_archive import PageArchive, anime_key
+from utils import Anime, atomic_open, load_urls, parsed_anime_filename
 
 
 def get_tag_text(tag: Optional[bs4.element.Tag]) -> Optional[str]:
@@ -17,6 +27,25 @@ def get_tag_text(tag: Optional[bs4.element.Tag]) -> Optional[str]:
     return ''.join(tag.find_all(text=True, recursive=False)).strip() if tag else None
 
 
+def delegates_to(fast_extractor):
+    """
+    Make an extractor delegate to its lxml-based counterpart in `fast_extraction.py` when given an lxml tree instead of
+    a BeautifulSoup object.
+    """
+
+    def decorator(extractor):
+        @functools.wraps(extractor)
+        def wrapper(document, *args):
+            if isinstance(document, etree._Element):
+                return fast_extractor(document, *args)
+            return extractor(document, *args)
+
+        return wrapper
+
+    return decorator
+
+
+@delegates_to(fast_extraction.extract_title)
 def extract_title(soup: BeautifulSoup) -> str:
     """Extract an anime's title."""
     return soup.find("div", class_="h1-title").div.h1.strong.get_text().strip()
@@ -44,6 +73,7 @@ def _parse_airing_dates(dates: Optional[str]) -> Tuple[Optional[datetime], Optio
         return date, date
 
 
+@delegates_to(fast_extraction.extract_type_episodes_and_dates)
 def extract_type_episodes_and_dates(soup: BeautifulSoup) -> Tuple[str, int, Optional[datetime], Optional[datetime]]:
     """Extract an anime's type, number of episodes and start/end dates."""
 
@@ -72,6 +102,7 @@ def extract_type_episodes_and_dates(soup: BeautifulSoup) -> Tuple[str, int, Opti
     return _type, episodes, start_date, end_date
 
 
+@delegates_to(fast_extraction.extract_score_info)
 def extract_score_info(soup: BeautifulSoup, rank: int) -> Tuple[int, float, int, int, int]:
     """Extract an anime's members, score, users, rank and popularity."""
     members, score, users, popularity = 0, 0.0, 0, 0
@@ -103,28 +134,31 @@ def extract_score_info(soup: BeautifulSoup, rank: int) -> Tuple[int, float, int,
     return members, score, users, rank, popularity
 
 
+@delegates_to(fast_extraction.extract_description)
 def extract_description(soup: BeautifulSoup) -> Optional[str]:
     """Extract an anime's synopsis."""
     tag = soup.find("p", {"itemprop": "description"})
     return get_tag_text(tag) if tag else None
 
 
+@delegates_to(fast_extraction.extract_related_anime)
 def extract_related_anime(soup: BeautifulSoup) -> list[str]:
     """Extract an anime's list of related animes."""
     related_anime_table = soup.find("table", class_="anime_detail_related_anime")
     if not related_anime_table:
         return []
 
-    related_anime_names = set()
+    related_anime_names = {}  # Used as an ordered set, so that the output doesn't depend on the process' hash seed
 
     # Related animes must have a link (and the link must start with /anime, otherwise it's a manga)
     for anime_link in related_anime_table.find_all("a", href=lambda href: re.match("/anime", href)):
         anime_name = get_tag_text(anime_link)
-        related_anime_names.add(anime_name)
+        related_anime_names[anime_name] = None
 
     return list(related_anime_names)
 
 
+@delegates_to(fast_extraction.extract_characters_and_voices)
 def extract_characters_and_voices(soup: BeautifulSoup) -> tuple[list[str], list[str]]:
     """Extract an anime's characters and their voice actors."""
     characters_div = soup.find("div", class_="detail-characters-list") # First one is characters/VAs, second is staff
@@ -141,6 +175,7 @@ def extract_characters_and_voices(soup: BeautifulSoup) -> tuple[list[str], list[
     return characters, voices
 
 
+@delegates_to(fast_extraction.extract_anime_staff)
 def extract_anime_staff(soup: BeautifulSoup) -> list[list[str]]:
     """Extract an anime's staff."""
     divs = list(soup.find_all("div", class_="detail-characters-list"))
@@ -162,51 +197,132 @@ def extract_anime_staff(soup: BeautifulSoup) -> list[list[str]]:
     return staff
 
 
+def parse_anime(page: bytes, rank: int, fast: bool = FAST_EXTRACTION) -> Anime:
+    """
+    Parse an anime's page, extracting all the required information.
+
+    If `fast`, the page is parsed with lxml, which is much faster than BeautifulSoup and gives the same results.
+    """
+    soup = fast_extraction.parse_page(page) if fast else BeautifulSoup(page, "html.parser")
+    anime = Anime()
+
+    anime.animeTtle = extract_title(soup)
+    anime.animeType, anime.animeNumEpisode, anime.releaseDate, anime.endDate = extract_type_episodes_and_dates(soup)
+    (
+        anime.animeNumMembers,
+        anime.animeScore,
+        anime.animeUsers,
+        anime.animeRank,
+        anime.animePopularity
+    ) = extract_score_info(soup, rank)
+    anime.animeDescription = extract_description(soup)
+    anime.animeRelated = extract_related_anime(soup)
+    anime.animeCharacters, anime.animeVoices = extract_characters_and_voices(soup)
+    anime.animeStaff = extract_anime_staff(soup)
+
+    return anime
+
+
+TSV_HEADER = [
+    "animeTitle", "animeType", "animeNumEpisode", "releaseDate", "endDate",
+    "animeNumMembers", "animeScore", "animeUsers", "animeRank", "animePopularity",
+    "animeDescription", "animeRelated", "animeCharacters", "animeVoices", "animeStaff"
+]
+
+
+def anime_row(anime: Anime) -> list[str]:
+    """Return the fields of an anime as they are written to (and read back from) its TSV file."""
+    return ["" if value is None else str(value) for value in [
+        anime.animeTtle, anime.animeType, anime.animeNumEpisode, anime.releaseDate, anime.endDate,
+        anime.animeNumMembers, anime.animeScore, anime.animeUsers, anime.animeRank, anime.animePopularity,
+        anime.animeDescription, anime.animeRelated, anime.animeCharacters, anime.animeVoices, anime.animeStaff
+    ]]
+
+
+def save_anime(i: int, anime: Anime):
+    """Write the TSV file for the i-th anime."""
+    with atomic_open(os.path.join(PARSED_ANIMES_DIRECTORY, parsed_anime_filename(i))) as tsv_file:
+        tsv_writer = csv.writer(tsv_file, delimiter='\t')
+        tsv_writer.writerow(TSV_HEADER)
+        tsv_writer.writerow(anime_row(anime))
+
+
+_archive: Optional[PageArchive] = None
+
+
+def parse_and_save_anime(i: int) -> tuple[Optional[str], float]:
+    """
+    Parse the page of the i-th anime and save the result, returning the error if parsing failed and how long it took.
+
+    Meant to be run in worker processes, each one opening the archive on its first call.
+    """
+    global _archive
+
+    if _archive is None:
+        _archive = PageArchive(ANIMES_ARCHIVE)
+
+    start = time.perf_counter()
+    try:
+        save_anime(i, parse_anime(_archive.get(anime_key(i)), i+1))
+    except Exception:
+        return traceback.format_exc(), time.perf_counter() - start
+
+    return None, time.perf_counter() - start
+
+
 if __name__ == "__main__":
     """
     This scripts iterates the individual anime's pages. For each anime, it parses the required information
     and saves them to a TSV file.
+
+    Pages are parsed in parallel by several worker processes, unless only one is configured. Pages that can't be
+    parsed are reported in an error file instead of stopping the whole run, and pages already parsed are skipped,
+    so the script can be relaunched after fixing the errors.
+
+    Finally, once all animes are parsed, their numeric fields are saved as columns, to be used by the custom metrics.
     """
-    files_to_parse = sorted(Path(ANIMES_DIRECTORY).glob("*.html"))
-    start_file = prepare_to_download(PARSED_ANIMES_DIRECTORY)
+    # Pages that failed to download are missing from the archive, so the animes are listed from their URLs
+    num_animes = len(load_urls())
+    archive = PageArchive(ANIMES_ARCHIVE)
+    Path(PARSED_ANIMES_DIRECTORY).mkdir(exist_ok=True)
+
+    missing_pages = [i for i in range(num_animes) if anime_key(i) not in archive]
+    pages_to_parse = [
+        i for i in range(num_animes)
+        if anime_key(i) in archive
+        and not os.path.exists(os.path.join(PARSED_ANIMES_DIRECTORY, parsed_anime_filename(i)))
+    ]
 
-    try:
-        for i, path in enumerate(files_to_parse[start_file:], start=start_file):
-
-            with open(path, "r") as fin:
-                soup = BeautifulSoup(fin, "html.parser")
-                anime = Anime()
-
-                anime.animeTtle = extract_title(soup)
-                anime.animeType, anime.animeNumEpisode, anime.releaseDate, anime.endDate = extract_type_episodes_and_dates(soup)
-                (
-                    anime.animeNumMembers,
-                    anime.animeScore,
-                    anime.animeUsers,
-                    anime.animeRank,
-                    anime.animePopularity
-                ) = extract_score_info(soup, i+1)
-                anime.animeDescription = extract_description(soup)
-                anime.animeRelated = extract_related_anime(soup)
-                anime.animeCharacters, anime.animeVoices = extract_characters_and_voices(soup)
-                anime.animeStaff = extract_anime_staff(soup)
-
-            # Write the TSV file for this anime
-            with open(os.path.join(PARSED_ANIMES_DIRECTORY, parsed_anime_filename(i)), "w") as tsv_file:
-                tsv_writer = csv.writer(tsv_file, delimiter='\t')
-                tsv_writer.writerow([
-                    "animeTitle", "animeType", "animeNumEpisode", "releaseDate", "endDate",
-                    "animeNumMembers", "animeScore", "animeUsers", "animeRank", "animePopularity",
-                    "animeDescription", "animeRelated", "animeCharacters", "animeVoices", "animeStaff"
-                ])
-                tsv_writer.writerow([
-                    anime.animeTtle, anime.animeType, anime.animeNumEpisode, anime.releaseDate, anime.endDate,
-                    anime.animeNumMembers, anime.animeScore, anime.animeUsers, anime.animeRank, anime.animePopularity,
-                    anime.animeDescription, anime.animeRelated, anime.animeCharacters, anime.animeVoices, anime.animeStaff
-                ])
-
-            if i%100 == 0:
-                print(f"{i}/{len(files_to_parse)}...")
-    except Exception as e:
-        print(str(path))  # Log which file caused the error
-        raise e
+    num_workers = NUM_WORKERS or os.cpu_count()
+    if num_workers > 1:
+        executor = ProcessPoolExecutor(num_workers)
+        results = executor.map(parse_and_save_anime, pages_to_parse, chunksize=PARSE_CHUNK_SIZE)
+    else:
+        executor = None
+        results = map(parse_and_save_anime, pages_to_parse)
+
+    errors = []
+    with Stage("parse_pages", total=len(pages_to_parse)) as stage:
+        for i, (error, seconds) in zip(pages_to_parse, results):
+            if error is not None:
+                errors.append((i, error))
+                stage.error()
+                print(f"Page {anime_key(i)} could not be parsed")
+
+            stage.item(seconds)
+
+    if executor is not None:
+        executor.shutdown()
+
+    # Report all errors at once
+    with open(PARSE_ERRORS_FILE, "w") as fout:
+        for i, error in errors:
+            fout.write(f"Page {anime_key(i)}:\n{error}\n")
+
+    print(f"{len(pages_to_parse) - len(errors)}/{len(pages_to_parse)} pages parsed, errors reported in {PARSE_ERRORS_FILE}")
+
+    if missing_pages:
+        print(f"{len(missing_pages)} pages have not been downloaded yet, relaunch download_anime.py: {missing_pages}")
+    elif not errors:
+        save_metadata(extract_metadata(num_animes))
+        print(f"Metadata of {num_animes} animes saved to {METADATA_FILE}")
@@ -0,0 +1,650 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from graphlib import TopologicalSorter
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+import requests
+
+import instrumentation
+from constants import BASE_URL, LIMIT_PARAM, NUM_ANIMES_PER_PAGE, NUM_CHARTS_PAGES_TO_DOWNLOAD, CRAWLER_CONCURRENCY, \
+    TOP_CHARTS_ARCHIVE, TOP_ANIME_URLS_FILE, ANIMES_ARCHIVE, PARSED_ANIMES_DIRECTORY, \
+    SEARCH_INFO_DIRECTORY, METADATA_FILE, SEGMENTS_DIRECTORY, SEGMENTS_MANIFEST_FILE, VOCABULARY_FILE, \
+    FIRST_INDEX_FILE, SECOND_INDEX_FILE, DOCUMENT_STORE_FILE, PIPELINE_STATE_FILE, PIPELINE_CHECKPOINT_INTERVAL, \
+    PARSE_CHUNK_SIZE, LEMMATIZE_CHUNK_SIZE, LEMMA_CACHE_FILE, POSITIONAL_ANALYSIS, POSITIONAL_INDEX_FILE, NUM_WORKERS, \
+    VERBOSE
+from crawler import Crawler
+from generations import file_checksum
+from page_archive import PageArchive, anime_key, top_anime_key
+from utils import atomic_open, load_urls, load_search_info_words, parsed_anime_filename, search_info_filename
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def file_signature(path: str) -> Optional[str]:
+    """
+    Return a cheap fingerprint of a file (its size and modification time), or None if missing.
+
+    If it hasn't changed, neither has the file's content, so there is no need to hash it again.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def text_digest(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class PipelineState:
+    """
+    The state of the pipeline, persisted between runs: for each stage, the digests of the inputs and outputs it last
+    ran on, or of each of its items' inputs and outputs.
+    """
+
+    def __init__(self, path: str = PIPELINE_STATE_FILE):
+        self.path = path
+
+        if os.path.exists(path):
+            with open(path, "r") as fin:
+                self.stages: dict[str, dict] = json.load(fin)
+        else:
+            self.stages = {}
+
+    def stage(self, name: str) -> dict:
+        return self.stages.setdefault(name, {})
+
+    def save(self):
+        with atomic_open(self.path) as fout:
+            json.dump(self.stages, fout)
+
+
+class PipelineStage(ABC):
+    """
+    A stage of the pipeline, declaring the files and directories it reads and writes: a stage depends on the stages
+    writing its inputs.
+    """
+
+    name: str
+    inputs: list[str] = []
+    outputs: list[str] = []
+
+    @abstractmethod
+    def run(self, pipeline: "Pipeline"):
+        pass
+
+
+class ScriptStage(PipelineStage):
+    """
+    A stage run by one of the scripts as a whole, only when its inputs changed since its last successful run or some
+    of its outputs are missing.
+    """
+
+    def __init__(self, name: str, script: str, inputs: list[str], outputs: list[str]):
+        self.name = name
+        self.script = script
+        self.inputs = inputs
+        self.outputs = outputs
+
+    def run(self, pipeline: "Pipeline"):
+        state = pipeline.state.stage(self.name)
+        inputs_digest = pipeline.digest(self.inputs)
+
+        if state.get("inputs") == inputs_digest and all(os.path.exists(output) for output in self.outputs):
+            if VERBOSE:
+                print(f"{self.name}: up to date")
+            return
+
+        if VERBOSE:
+            print(f"{self.name}: running {self.script}")
+        process = subprocess.run(
+            [sys.executable, os.path.join(REPOSITORY_DIRECTORY, self.script)],
+            env=dict(os.environ, PYTHONPATH=REPOSITORY_DIRECTORY)
+        )
+        if process.returncode != 0:
+            raise Exception(f"Stage {self.name} failed: {self.script} exited with code {process.returncode}")
+
+        state["inputs"] = inputs_digest
+        state["outputs"] = pipeline.digest(self.outputs)
+
+
+class ItemStage(PipelineStage):
+    """
+    A stage processing each anime separately, only re-processing the animes whose inputs changed since they were last
+    processed, whose output is missing or was altered, or that failed.
+
+    The digest of each item's inputs and output is recorded along with a cheap fingerprint of them (e.g. the size and
+    modification time of a file): as long as the fingerprint is the same, the content is assumed to be too and isn't
+    hashed again. Otherwise, the content is hashed, so that an item whose content is actually unchanged (e.g. a page
+    downloaded again) is not processed again.
+
+    Items that disappeared since the last run have their outputs removed. Items that failed are recorded in `failed`,
+    and processed again on the next run.
+    """
+
+    def __init__(self):
+        self.failed: list[int] = []  # The items that failed during the last run
+
+    @abstractmethod
+    def items(self) -> list[int]:
+        """Return the IDs of the items to process."""
+
+    @abstractmethod
+    def signature(self, i: int) -> str:
+        """Return a cheap fingerprint of an item's inputs."""
+
+    @abstractmethod
+    def input_digest(self, i: int) -> str:
+        """Return the digest of the content of an item's inputs."""
+
+    def output_path(self, i: int) -> Optional[str]:
+        """Return the file an item is processed into, if any."""
+        return None
+
+    def outputs_lost(self) -> bool:
+        """Whether the outputs of all items were lost, so that they must all be processed again."""
+        return False
+
+    @abstractmethod
+    def process(self, document_ids: list[int]) -> Iterator[tuple[int, Optional[str], float]]:
+        """
+        Process items, yielding the ID of each processed item, the error if its processing failed, and how long it
+        took.
+        """
+
+    def remove(self, document_ids: list[int]):
+        """Remove the outputs of items that no longer exist."""
+        for i in document_ids:
+            path = self.output_path(i)
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+    def finish(self, changed: list[int], deleted: list[int]):
+        """Update the outputs built from all the items, called once the changed items have been processed."""
+        pass
+
+    def _output_unchanged(self, i: int, record: dict) -> bool:
+        path = self.output_path(i)
+        if path is None:
+            return True
+
+        signature = file_signature(path)
+        if signature is None:
+            return False
+        if signature != record.get("output_signature"):
+            if file_checksum(path) != record["output"]:
+                return False
+            record["output_signature"] = signature
+
+        return True
+
+    def _record(self, i: int, signature: str, digest: str) -> dict:
+        path = self.output_path(i)
+        if path is None:
+            return {"signature": signature, "input": digest, "output": digest}
+        return {
+            "signature": signature, "input": digest,
+            "output": file_checksum(path), "output_signature": file_signature(path),
+        }
+
+    def run(self, pipeline: "Pipeline"):
+        records = pipeline.state.stage(self.name).setdefault("items", {})
+        if self.outputs_lost():
+            records.clear()
+
+        items = self.items()
+        to_process: dict[int, tuple[str, str]] = {}  # Maps the items to process to their inputs' signature and digest
+
+        for i in items:
+            record = records.get(str(i))
+            signature = self.signature(i)
+
+            if record is not None and record["signature"] == signature and self._output_unchanged(i, record):
+                continue
+
+            digest = self.input_digest(i)
+            if record is not None and record["input"] == digest and self._output_unchanged(i, record):
+                record["signature"] = signature
+                continue
+
+            to_process[i] = (signature, digest)
+
+        existing = set(items)
+        deleted = sorted(int(i) for i in records if int(i) not in existing)
+        changed = []
+        self.failed = []
+
+        if VERBOSE:
+            print(f"{self.name}: {len(to_process)} to process, {len(deleted)} deleted, "
+                  f"{len(items) - len(to_process)} up to date")
+
+        try:
+            with instrumentation.Stage(self.name, total=len(to_process)) as stage:
+                processed = 0
+                for i, error, seconds in self.process(sorted(to_process)):
+                    if error is not None:
+                        records.pop(str(i), None)  # Processed again on the next run
+                        self.failed.append(i)
+                        stage.error()
+                        print(f"{self.name}: anime {i} failed: {error}")
+                        continue
+
+                    previous_output = records.get(str(i), {}).get("output")
+                    records[str(i)] = self._record(i, *to_process[i])
+                    if records[str(i)]["output"] != previous_output:
+                        changed.append(i)
+
+                    stage.item(seconds)
+                    processed += 1
+                    if processed % PIPELINE_CHECKPOINT_INTERVAL == 0:
+                        pipeline.state.save()
+
+            self.remove(deleted)
+            for i in deleted:
+                del records[str(i)]
+
+            self.finish(changed, deleted)
+        finally:
+            pipeline.state.save()  # So that an interrupted run doesn't have to process the same items again
+
+
+class DownloadPagesStage(ItemStage):
+    """
+    Download pages into an archive, each page being an item: a page is only downloaded if it's missing from the
+    archive or its URL changed (e.g. when an anime moved to another rank), so pages that could not be downloaded stay
+    pending and are retried on the next run.
+
+    If `required`, the stage fails once the pages it could download are saved if some are still missing, so that the
+    stages depending on it don't run on an incomplete archive.
+    """
+
+    def __init__(
+            self, name: str, archive_path: str, key: Callable[[int], str], urls: Callable[[], list[str]],
+            inputs: list[str], required: bool = False
+    ):
+        super().__init__()
+        self.name = name
+        self.archive_path = archive_path
+        self.key = key
+        self.load_urls = urls
+        self.inputs = inputs
+        self.outputs = [f"{archive_path}.idx"]
+        self.required = required
+
+        self.archive = None
+        self.urls = []
+
+    def items(self) -> list[int]:
+        self.archive = PageArchive(self.archive_path)
+        self.urls = self.load_urls()
+        return list(range(len(self.urls)))
+
+    def signature(self, i: int) -> str:
+        return self.urls[i]
+
+    def input_digest(self, i: int) -> str:
+        return text_digest(self.urls[i])
+
+    def _output_unchanged(self, i: int, record: dict) -> bool:
+        return self.key(i) in self.archive
+
+    def outputs_lost(self) -> bool:
+        return not os.path.exists(f"{self.archive_path}.idx")
+
+    def process(self, document_ids: list[int]) -> Iterator[tuple[int, Optional[str], float]]:
+        crawler = Crawler(self.urls, None, None)
+
+        def download(i: int) -> tuple[int, Optional[str], float]:
+            # Pages downloaded before the pipeline recorded them (e.g. by the download scripts) are kept
+            if self.archive.key_of_url(self.urls[i]) == self.key(i):
+                return i, None, 0.0
+
+            start = time.perf_counter()
+            try:
+                content = crawler.fetch(i)
+            except requests.HTTPError as err:
+                return i, str(err), time.perf_counter() - start
+            if content is None:
+                return i, "download failed", time.perf_counter() - start
+
+            self.archive.put(self.key(i), content, self.urls[i])
+            return i, None, time.perf_counter() - start
+
+        with ThreadPoolExecutor(CRAWLER_CONCURRENCY) as executor:
+            yield from executor.map(download, document_ids)
+
+    def finish(self, changed: list[int], deleted: list[int]):
+        missing = [i for i in range(len(self.urls)) if self.key(i) not in self.archive]
+        if missing and self.required:
+            raise Exception(f"{len(missing)} pages could not be downloaded, relaunch to retry them: {missing}")
+        if missing:
+            print(f"{self.name}: {len(missing)} pages could not be downloaded, relaunch to retry them: {missing}")
+
+
+def top_charts_urls() -> list[str]:
+    """Return the URLs of the top anime charts' pages, as requested by `download_top_charts.py`."""
+    return [f"{BASE_URL}?{LIMIT_PARAM}={NUM_ANIMES_PER_PAGE * page}" for page in range(NUM_CHARTS_PAGES_TO_DOWNLOAD)]
+
+
+class ParsePagesStage(ItemStage):
+    """
+    Parse the downloaded pages into TSV files, and save the metadata of all animes.
+    """
+
+    name = "parse_pages"
+    inputs = [f"{ANIMES_ARCHIVE}.idx", TOP_ANIME_URLS_FILE]
+    outputs = [PARSED_ANIMES_DIRECTORY, METADATA_FILE]
+
+    def __init__(self):
+        super().__init__()
+        self.archive = None
+
+    def items(self) -> list[int]:
+        Path(PARSED_ANIMES_DIRECTORY).mkdir(exist_ok=True)
+        self.archive = PageArchive(ANIMES_ARCHIVE)
+        return [i for i in range(len(load_urls())) if anime_key(i) in self.archive]
+
+    def signature(self, i: int) -> str:
+        offset, length = self.archive.location(anime_key(i))  # Changes whenever the page is downloaded again
+        return f"{offset}:{length}"
+
+    def input_digest(self, i: int) -> str:
+        return hashlib.sha256(self.archive.get(anime_key(i))).hexdigest()
+
+    def output_path(self, i: int) -> Optional[str]:
+        return os.path.join(PARSED_ANIMES_DIRECTORY, parsed_anime_filename(i))
+
+    def process(self, document_ids: list[int]) -> Iterator[tuple[int, Optional[str], float]]:
+        from parse_pages import parse_and_save_anime  # Imported here since it loads the whole parsing module
+
+        num_workers = NUM_WORKERS or os.cpu_count()
+        if num_workers > 1 and len(document_ids) > PARSE_CHUNK_SIZE:
+            with ProcessPoolExecutor(num_workers) as executor:
+                results = executor.map(parse_and_save_anime, document_ids, chunksize=PARSE_CHUNK_SIZE)
+                for i, (error, seconds) in zip(document_ids, results):
+                    yield i, error, seconds
+        else:
+            for i in document_ids:
+                yield i, *parse_and_save_anime(i)
+
+    def finish(self, changed: list[int], deleted: list[int]):
+        from custom_metrics_utils import extract_metadata, save_metadata
+
+        if changed or deleted or not os.path.exists(METADATA_FILE):
+            # Animes that couldn't be downloaded or parsed yet have missing values
+            save_metadata(extract_metadata(len(load_urls())))
+
+
+class ExtractSearchInfoStage(ItemStage):
+    """
+    Lemmatize the synopses of the parsed animes into search info files.
+
+    An anime is only lemmatized again if its title, synopsis or URL changed, not when other fields of its TSV file
+    did (e.g. its number of members), or if positional analysis was turned on or off.
+    """
+
+    name = "extract_search_info"
+    inputs = [PARSED_ANIMES_DIRECTORY, TOP_ANIME_URLS_FILE]
+    outputs = [SEARCH_INFO_DIRECTORY]
+
+    def __init__(self):
+        super().__init__()
+        self.urls = []
+
+    def items(self) -> list[int]:
+        Path(SEARCH_INFO_DIRECTORY).mkdir(exist_ok=True)
+        self.urls = load_urls()
+        return [
+            i for i in range(len(self.urls))
+            if os.path.exists(os.path.join(PARSED_ANIMES_DIRECTORY, parsed_anime_filename(i)))
+        ]
+
+    def signature(self, i: int) -> str:
+        signature = f"{file_signature(os.path.join(PARSED_ANIMES_DIRECTORY, parsed_anime_filename(i)))}:{self.urls[i]}"
+        return f"{signature}:positional" if POSITIONAL_ANALYSIS else signature
+
+    def input_digest(self, i: int) -> str:
+        from extract_search_info import read_search_info  # Imported here since it loads NLTK
+
+        digest = text_digest(*read_search_info(i, self.urls))
+        return text_digest(digest, "positional") if POSITIONAL_ANALYSIS else digest
+
+    def output_path(self, i: int) -> Optional[str]:
+        return os.path.join(SEARCH_INFO_DIRECTORY, search_info_filename(i))
+
+    def process(self, document_ids: list[int]) -> Iterator[tuple[int, Optional[str], float]]:
+        from extract_search_info import download_nltk_data, get_analyzer, lemmatize_chunk, read_search_info, \
+            save_search_info
+
+        if not document_ids:
+            return
+
+        download_nltk_data()
+        analyzer = get_analyzer()
+        num_workers = NUM_WORKERS or os.cpu_count()
+
+        try:
+            if num_workers > 1 and len(document_ids) > LEMMATIZE_CHUNK_SIZE:
+                chunks = [
+                    document_ids[start:start + LEMMATIZE_CHUNK_SIZE]
+                    for start in range(0, len(document_ids), LEMMATIZE_CHUNK_SIZE)
+                ]
+                search_info = {i: read_search_info(i, self.urls) for i in document_ids}
+                synopses_chunks = ([search_info[i][1] for i in chunk] for chunk in chunks)
+
+                with ProcessPoolExecutor(num_workers) as executor:
+                    for chunk, (lemmas, new_cache_entries, durations) in zip(
+                            chunks, executor.map(lemmatize_chunk, synopses_chunks)
+                    ):
+                        analyzer.add_entries(new_cache_entries)
+                        for i, synopsis_lemmas, seconds in zip(chunk, lemmas, durations):
+                            title, _, url = search_info[i]
+                            save_search_info(i, title, url, synopsis_lemmas)
+                            yield i, None, seconds
+            else:
+                for i in document_ids:
+                    start = time.perf_counter()
+                    title, synopsis, url = read_search_info(i, self.urls)
+                    save_search_info(i, title, url, analyzer.lemmatize(synopsis))
+                    yield i, None, time.perf_counter() - start
+        finally:
+            analyzer.save_cache(LEMMA_CACHE_FILE)
+
+
+class UpdateSegmentsStage(ItemStage):
+    """
+    Add the animes whose lemmas changed to the segmented index, and delete the animes that disappeared from it, so
+    that only the changes are indexed. Segments are then merged if needed.
+    """
+
+    name = "update_segments"
+    inputs = [SEARCH_INFO_DIRECTORY]
+    outputs = [SEGMENTS_DIRECTORY]
+
+    def __init__(self):
+        super().__init__()
+        self._writer = None
+
+    @property
+    def writer(self):
+        if self._writer is None:
+            from segments import SegmentedIndexWriter  # Imported here since it loads the whole index module
+
+            self._writer = SegmentedIndexWriter()
+        return self._writer
+
+    def items(self) -> list[int]:
+        return sorted(
+            int(path.stem.split("_")[-1]) for path in Path(SEARCH_INFO_DIRECTORY).glob("*.txt")
+        )
+
+    def signature(self, i: int) -> str:
+        return file_signature(os.path.join(SEARCH_INFO_DIRECTORY, search_info_filename(i)))
+
+    def input_digest(self, i: int) -> str:
+        return file_checksum(os.path.join(SEARCH_INFO_DIRECTORY, search_info_filename(i)))
+
+    def outputs_lost(self) -> bool:
+        return not os.path.exists(os.path.join(SEGMENTS_DIRECTORY, SEGMENTS_MANIFEST_FILE))
+
+    def process(self, document_ids: list[int]) -> Iterator[tuple[int, Optional[str], float]]:
+        # Documents are added in batches, each making a new segment
+        for start in range(0, len(document_ids), PIPELINE_CHECKPOINT_INTERVAL):
+            batch = document_ids[start:start + PIPELINE_CHECKPOINT_INTERVAL]
+            batch_start = time.perf_counter()
+            self.writer.add_documents({i: load_search_info_words(i) for i in batch})
+
+            seconds = (time.perf_counter() - batch_start) / len(batch)
+            for i in batch:
+                yield i, None, seconds
+
+    def remove(self, document_ids: list[int]):
+        self.writer.delete_documents(document_ids)
+
+    def finish(self, changed: list[int], deleted: list[int]):
+        while self.writer.merge():
+            pass
+
+
+class Pipeline:
+    """
+    The pipeline's stages, run in the order of their dependencies (the DAG made by their declared inputs and outputs).
+
+    Each stage only does the work its changed inputs require, and records what it did in the pipeline state, so the
+    pipeline can be run again at any time (e.g. after downloading pages again or changing the parser's output).
+
+    While some animes failed in a per-anime stage, the script stages depending on it (directly or not) are not run,
+    since they need all the animes (e.g. to build the indexes), and run once the failed animes are processed.
+    """
+
+    def __init__(self, stages: list[PipelineStage], state: Optional[PipelineState] = None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.state = state if state is not None else PipelineState()
+
+        self.producers = {output: stage for stage in stages for output in stage.outputs}
+        self.dependencies = {
+            stage.name: {self.producers[path].name for path in stage.inputs if path in self.producers}
+            for stage in stages
+        }
+        self.order = list(TopologicalSorter(self.dependencies).static_order())
+
+    def digest(self, paths: list[str]) -> str:
+        """
+        Return a digest of files and directories. The outputs of item stages are summarized by their items' digests,
+        other directories by the fingerprints of their files.
+        """
+        digest = hashlib.sha256()
+
+        for path in paths:
+            producer = self.producers.get(path)
+            if isinstance(producer, ItemStage):
+                items = self.state.stage(producer.name).get("items", {})
+                part = json.dumps({i: record["output"] for i, record in items.items()}, sort_keys=True)
+            elif os.path.isfile(path):
+                part = file_checksum(path)
+            elif os.path.isdir(path):
+                part = json.dumps(sorted(
+                    (str(file), file_signature(str(file))) for file in Path(path).rglob("*") if file.is_file()
+                ))
+            else:
+                part = "missing"
+            digest.update(f"{path}:{part};".encode("utf-8"))
+
+        return digest.hexdigest()
+
+    def downstream(self, name: str) -> set[str]:
+        """Return a stage and all the stages depending on it, directly or not."""
+        stages = {name}
+        for stage in self.order:  # Dependencies always come before the stages depending on them
+            if self.dependencies[stage] & stages:
+                stages.add(stage)
+        return stages
+
+    def run(self, start: Optional[str] = None):
+        """
+        Run all the stages, or only the stages from `start` on (i.e. depending on it), the stages before being assumed
+        to be up to date.
+        """
+        if start is not None and start not in self.stages:
+            raise Exception(f"Unknown stage: {start}, the stages are: {', '.join(self.order)}")
+
+        to_run = self.downstream(start) if start is not None else set(self.order)
+        incomplete = set()  # The stages that failed on some animes, or depend on such a stage
+
+        for name in self.order:
+            stage = self.stages[name]
+            waiting_for = self.dependencies[name] & incomplete
+
+            if name in to_run:
+                if isinstance(stage, ScriptStage) and waiting_for:
+                    print(f"{name}: not run until all animes are processed by {', '.join(sorted(waiting_for))}")
+                else:
+                    stage.run(self)
+                    self.state.save()
+
+            if waiting_for or (name in to_run and isinstance(stage, ItemStage) and stage.failed):
+                incomplete.add(name)
+
+
+def default_pipeline() -> Pipeline:
+    """
+    Return the stages from downloading the pages to building the indexes. The segmented index is updated with the
+    changed animes only, while the `build_indexes` and `document_store` stages rebuild their files as a whole.
+    """
+    stages = [
+        # The anime URLs are extracted from all the charts' pages, so none of them can be missing
+        DownloadPagesStage(
+            "download_top_charts", TOP_CHARTS_ARCHIVE, top_anime_key, top_charts_urls, [], required=True
+        ),
+        ScriptStage(
+            "extract_anime_urls", "extract_anime_urls.py", [f"{TOP_CHARTS_ARCHIVE}.idx"], [TOP_ANIME_URLS_FILE]
+        ),
+        DownloadPagesStage("download_anime", ANIMES_ARCHIVE, anime_key, load_urls, [TOP_ANIME_URLS_FILE]),
+        ParsePagesStage(),
+        ExtractSearchInfoStage(),
+        UpdateSegmentsStage(),
+        ScriptStage(
+            "build_indexes", "build_indexes.py",
+            [SEARCH_INFO_DIRECTORY], [VOCABULARY_FILE, FIRST_INDEX_FILE, SECOND_INDEX_FILE]
+        ),
+        ScriptStage(
+            "document_store", "document_store.py", [PARSED_ANIMES_DIRECTORY, TOP_ANIME_URLS_FILE], [DOCUMENT_STORE_FILE]
+        ),
+    ]
+
+    if POSITIONAL_ANALYSIS:
+        stages.append(ScriptStage(
+            "positional_index", "create_positional_index.py",
+            [SEARCH_INFO_DIRECTORY, VOCABULARY_FILE], [POSITIONAL_INDEX_FILE]
+        ))
+
+    return Pipeline(stages)
+
+
+if __name__ == "__main__":
+    """
+    This script runs the whole pipeline, from downloading the pages to building the indexes, only redoing the work
+    whose inputs changed since the last run: pages already downloaded are kept (those that failed are retried), animes
+    whose page, parsed info or lemmas are unchanged are skipped, and only the animes whose lemmas changed are
+    reindexed in the segmented index.
+
+    Only the segmented index is updated incrementally. The vocabulary and the first and second index files are
+    rebuilt from scratch by `build_indexes.py` whenever any anime's lemmas changed, since the idf of every term, and
+    thus every document's tf-idf scores, depend on all the documents.
+
+    The name of a stage can be given to start from it, e.g. `python pipeline.py parse_pages` when the pages were
+    downloaded some other way.
+    """
+    default_pipeline().run(sys.argv[1] if len(sys.argv) > 1 else None)
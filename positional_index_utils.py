@@ -0,0 +1,143 @@
+import heapq
+from typing import Iterable
+
+from compression_utils import write_compressed_index, encode_positional_postings, POSITIONAL_MAGIC
+from constants import POSITIONAL_INDEX_FILE, NEAR_DISTANCE
+from first_index_utils import intersect_all_postings
+from instrumentation import Stage
+
+
+def build_positional_index(
+        num_documents: int, documents_words: Iterable[list[str]], vocabulary: dict[str, int]
+) -> list[list[tuple[int, list[int]]]]:
+    """
+    Build the positional index from the lemmas of each document, in the order they appear in it.
+
+    Each term ID is mapped to the (document ID, positions) pairs of the documents containing the term, sorted by
+    document ID, the positions being the indexes of the term in the document's lemmas.
+    """
+    index = [[] for i in range(len(vocabulary))]
+
+    with Stage("create_positional_index", total=num_documents) as stage:
+        for i, words in enumerate(documents_words):
+            with stage.timed_item():
+                positions = {}
+                for position, word in enumerate(words):
+                    positions.setdefault(word, []).append(position)
+
+                for word, word_positions in positions.items():
+                    term_id = vocabulary.get(word)
+                    if term_id is not None:  # Should always be the case, just a safety check
+                        index[term_id].append((i, word_positions))
+
+    return index
+
+
+def save_positional_index(index: list[list[tuple[int, list[int]]]], path: str = POSITIONAL_INDEX_FILE):
+    """Save the positional index to a compressed file, with the positions of each document delta-encoded."""
+    write_compressed_index(len(index), index, path, encode_positional_postings, POSITIONAL_MAGIC)
+
+
+def phrase_starts(positions_lists: list[list[int]]) -> list[int]:
+    """
+    Return the positions at which a phrase starts in a document, given the positions of each of its terms in it.
+
+    The n-th term must appear n positions after the first one, so the positions of each term are shifted back by its
+    offset in the phrase and intersected.
+    """
+    starts = positions_lists[0]
+
+    for offset, positions in enumerate(positions_lists[1:], 1):
+        shifted = set(position - offset for position in positions)
+        starts = [start for start in starts if start in shifted]
+        if not starts:
+            break
+
+    return starts
+
+
+def within_distance(positions_lists: list[list[int]], distance: int) -> bool:
+    """
+    Return whether a document contains an occurrence of each term at most `distance` positions apart from each other,
+    given the positions of each term in it.
+
+    The smallest window containing all the terms is searched by moving forward the earliest position of the window,
+    as in a k-way merge of the position lists.
+    """
+    heap = [(positions[0], term) for term, positions in enumerate(positions_lists)]
+    heapq.heapify(heap)
+    last = max(position for position, _ in heap)
+    next_indexes = [1] * len(positions_lists)
+
+    while True:
+        first, term = heap[0]
+        if last - first <= distance:
+            return True
+
+        if next_indexes[term] == len(positions_lists[term]):  # The window can't move forward anymore
+            return False
+
+        position = positions_lists[term][next_indexes[term]]
+        next_indexes[term] += 1
+        heapq.heapreplace(heap, (position, term))
+        last = max(last, position)
+
+
+def documents_containing_all(postings: list[list[tuple[int, list[int]]]]) -> tuple[list[int], list[dict]]:
+    """
+    Return the IDs of the documents containing all the terms whose positional posting lists are given, along with
+    each term's positions in each document.
+    """
+    # Intersect the posting lists starting from the shortest one
+    document_ids = intersect_all_postings(
+        sorted(([document_id for document_id, _ in term_postings] for term_postings in postings), key=len)
+    )
+    return document_ids, [dict(term_postings) for term_postings in postings]
+
+
+def match_phrase(postings: list[list[tuple[int, list[int]]]]) -> list[int]:
+    """
+    Return the IDs of the documents containing a phrase, given the positional posting list of each of its terms (in
+    the phrase's order).
+    """
+    document_ids, positions = documents_containing_all(postings)
+    return [i for i in document_ids if phrase_starts([term_positions[i] for term_positions in positions])]
+
+
+def match_near(postings: list[list[tuple[int, list[int]]]], distance: int) -> list[int]:
+    """
+    Return the IDs of the documents containing all the terms at most `distance` positions apart, in any order, given
+    the positional posting list of each term.
+    """
+    document_ids, positions = documents_containing_all(postings)
+    return [
+        i for i in document_ids if within_distance([term_positions[i] for term_positions in positions], distance)
+    ]
+
+
+def run_phrase_query(query: list[str]) -> list[tuple[str, str, str]]:
+    """
+    Given a phrase, return title, synopsis and url of the animes whose synopsis contains its terms next to each other
+    and in order, e.g. `["state", "alchemist"]`.
+    """
+    from search_engine import get_search_engine  # Imported here to avoid a circular import
+
+    return get_search_engine().run_phrase_query(query)
+
+
+def run_proximity_query(query: list[str], distance: int = NEAR_DISTANCE) -> list[tuple[str, str, str]]:
+    """
+    Given a query, return title, synopsis and url of the animes whose synopsis contains all its terms at most
+    `distance` positions apart, in any order.
+    """
+    from search_engine import get_search_engine  # Imported here to avoid a circular import
+
+    return get_search_engine().run_proximity_query(query, distance)
+
+
+if __name__ == "__main__":
+    """
+    Test to check that the methods defined above work as expected.
+    """
+    print(run_phrase_query(["state", "alchemist"]))
+    print(run_proximity_query(["edward", "alphonse"], 3))
@@ -0,0 +1,129 @@
+import functools
+import inspect
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+from constants import QUERY_CACHE_SIZE
+
+
+class QueryCache:
+    """
+    Cache of query results, evicting the least recently used ones once it holds `size` results.
+
+    It counts hits, misses and evictions, and can be shared by threads serving queries concurrently.
+    """
+
+    def __init__(self, size: int = QUERY_CACHE_SIZE):
+        self.size = size
+        self._results: OrderedDict[Hashable, list] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def get(self, key: Hashable):
+        """Return the results cached for a key, or None if missing."""
+        with self._lock:
+            results = self._results.get(key)
+            if results is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._results.move_to_end(key)
+            return results
+
+    def put(self, key: Hashable, results: list):
+        with self._lock:
+            self._results[key] = results
+            self._results.move_to_end(key)
+            while len(self._results) > self.size:
+                self._results.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all cached results, e.g. when the indexes they were computed on are replaced."""
+        with self._lock:
+            self._results.clear()
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._results),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_query_cache = QueryCache()
+
+
+def get_query_cache() -> QueryCache:
+    """Return the cache shared by all search engines."""
+    return _query_cache
+
+
+def terms_set(query: list[str]) -> tuple[str, ...]:
+    """Normalize a query whose results only depend on which terms it contains (e.g. conjunctive queries)."""
+    return tuple(sorted(set(word.lower() for word in query)))
+
+
+def terms_multiset(query: list[str]) -> tuple[str, ...]:
+    """Normalize a query whose results depend on how many times each term appears, but not on their order."""
+    return tuple(sorted(word.lower() for word in query))
+
+
+def terms_sequence(query: list[str]) -> tuple[str, ...]:
+    """
+    Normalize a query whose results depend on the order of its terms (e.g. boolean queries). Case is kept, since
+    operators are told apart from terms by it.
+    """
+    return tuple(query)
+
+
+def _hashable(value) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((key, _hashable(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(item) for item in value)
+    return value
+
+
+def cached_query(normalize_query: Callable[[list[str]], tuple[str, ...]]):
+    """
+    Decorator caching the results of a search engine's query method.
+
+    Results are keyed by the method, the index version of the engine, the normalized query and the method's other
+    arguments (defaults included, so that passing them or not makes no difference). They are only cached when the
+    query succeeds, and a shallow copy is returned so that callers can't alter the cached list.
+    """
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(engine, query: list[str], *args, **kwargs):
+            arguments = signature.bind(engine, query, *args, **kwargs)
+            arguments.apply_defaults()
+            options = tuple(
+                (name, _hashable(value)) for name, value in list(arguments.arguments.items())[2:]  # Skip engine, query
+            )
+            key = (method.__name__, engine.version, normalize_query(query), options)
+
+            cache = get_query_cache()
+            results = cache.get(key)
+            if results is None:
+                results = method(engine, query, *args, **kwargs)
+                cache.put(key, results)
+
+            return list(results)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from typing import Optional
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+from constants import SERVER_HOST, SERVER_PORT, SERVER_MAX_BODY_SIZE, SERVER_LATENCY_WINDOW, NUM_WORKERS, NEAR_DISTANCE
+
+
+def _warm_up_worker():
+    """Load the indexes in a worker process as soon as it starts, so that they stay resident for all queries."""
+    from search_engine import get_search_engine  # Imported here so that only worker processes load the indexes
+
+    get_search_engine().warm_up()
+
+
+def run_query(mode: str, query: list[str], options: dict) -> list[dict]:
+    """
+    Run a query on the search engine of the current process, returning its results as JSON objects.
+    """
+    from search_engine import get_search_engine  # Imported here so that only worker processes load the indexes
+
+    engine = get_search_engine()
+    limit = options.get("limit", 10)
+
+    if mode == "conjunctive":
+        results = engine.run_query_on_first_index(query)
+    elif mode == "boolean":
+        results = engine.run_boolean_query(query)
+    elif mode == "phrase":
+        results = engine.run_phrase_query(query)
+    elif mode == "near":
+        results = engine.run_proximity_query(query, options.get("distance", NEAR_DISTANCE))
+    elif mode == "tfidf":
+        results = engine.run_query_on_second_index(query, limit)
+    elif "weights" in options:
+        results = engine.run_weighted_query(query, options["weights"], limit)
+    else:
+        results = engine.run_custom_query(query, options.get("popularity", "popular"), limit)
+
+    fields = ["title", "synopsis", "url", "score"]
+    return [dict(zip(fields, result)) for result in results]
+
+
+class LatencyRecorder:
+    """
+    Record the latency of the latest requests to each endpoint, to report their percentiles.
+    """
+
+    def __init__(self, window: int = SERVER_LATENCY_WINDOW):
+        self.window = window
+        self._latencies: dict[str, deque] = {}
+        self._counts: dict[str, int] = {}
+
+    def record(self, endpoint: str, seconds: float):
+        self._latencies.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+        self._counts[endpoint] = self._counts.get(endpoint, 0) + 1
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Return the number of requests and the p50, p99 and mean latency (in milliseconds) of each endpoint."""
+        summary = {}
+
+        for endpoint, latencies in self._latencies.items():
+            milliseconds = np.array(latencies) * 1000
+            p50, p99 = np.percentile(milliseconds, [50, 99])
+            summary[endpoint] = {
+                "requests": self._counts[endpoint],
+                "p50_ms": float(p50),
+                "p99_ms": float(p99),
+                "mean_ms": float(milliseconds.mean()),
+            }
+
+        return summary
+
+
+class QueryServer:
+    """
+    HTTP server exposing the search engine's queries as JSON endpoints, running on asyncio.
+
+    The event loop only parses requests and writes responses: queries are run by a pool of worker processes, each of
+    which keeps the indexes loaded (and picks up new generations of them, see `search_engine.GenerationReader`).
+
+    Queries are sent either as GET requests, e.g. `/tfidf?q=edward+elric&limit=5`, or as POST requests with a JSON
+    body, e.g. `{"query": ["edward", "elric"], "limit": 5}`, to the following endpoints:
+    - `/conjunctive`: the animes containing all the terms (first index)
+    - `/boolean`: the animes matching a boolean query, with OR and NOT operators (first index)
+    - `/phrase`: the animes whose synopsis contains the terms next to each other, in order (positional index)
+    - `/near`: the animes whose synopsis contains all the terms at most `distance` positions apart (positional index)
+    - `/tfidf`: the `limit` best animes by cosine similarity (second index)
+    - `/custom`: the `limit` best animes by cosine similarity with a custom metric, given either a `popularity`
+      ("popular" or "unpopular") or the `weights` of each metric (as JSON)
+    `/stats` reports the latency percentiles of each endpoint, and `/health` whether the server is up.
+    """
+
+    QUERY_ENDPOINTS = {"/conjunctive", "/boolean", "/phrase", "/near", "/tfidf", "/custom"}
+
+    def __init__(self, host: str = SERVER_HOST, port: int = SERVER_PORT, num_workers: Optional[int] = NUM_WORKERS):
+        self.host = host
+        self.port = port
+        self.num_workers = num_workers
+        self.latencies = LatencyRecorder()
+        self._executor = None
+
+    async def serve(self):
+        self._executor = ProcessPoolExecutor(self.num_workers, initializer=_warm_up_worker)
+
+        try:
+            # Start all the workers (loading the indexes) now rather than on the first queries
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(
+                loop.run_in_executor(self._executor, os.getpid) for _ in range(self.num_workers or os.cpu_count())
+            ))
+
+            server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+            async with server:
+                print(f"Serving queries on http://{self.host}:{self.port}")
+                await server.serve_forever()
+        finally:
+            self._executor.shutdown(cancel_futures=True)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve the requests sent on a connection, keeping it open between them unless the client asks otherwise."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                content_length = int(headers.get("content-length", 0))
+                if content_length > SERVER_MAX_BODY_SIZE:
+                    status, payload = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "Request body too large"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(content_length)
+                    status, payload = await self.handle_request(method, target, body)
+                    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+            pass  # Malformed request or client gone, drop the connection
+        finally:
+            writer.close()
+
+    @staticmethod
+    def parse_query(method: str, url, body: bytes) -> tuple[list[str], dict]:
+        """Return the query terms and the options (limit, distance, popularity, weights) of a request."""
+        if method == "POST":
+            parameters = json.loads(body or b"{}")
+            query = parameters.pop("query", [])
+        elif method == "GET":
+            parameters = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            query = parameters.pop("q", "")
+            if "weights" in parameters:
+                parameters["weights"] = json.loads(parameters["weights"])
+        else:
+            raise Exception(f"Unsupported method: {method}")
+
+        if isinstance(query, str):
+            query = query.split()
+        for name in ["limit", "distance"]:
+            if name in parameters:
+                parameters[name] = int(parameters[name])
+
+        return query, parameters
+
+    async def handle_request(self, method: str, target: str, body: bytes) -> tuple[HTTPStatus, object]:
+        url = urlsplit(target)
+
+        if url.path == "/health":
+            return HTTPStatus.OK, {"status": "ok"}
+        if url.path == "/stats":
+            return HTTPStatus.OK, {"latency": self.latencies.summary()}
+        if url.path not in self.QUERY_ENDPOINTS:
+            return HTTPStatus.NOT_FOUND, {"error": f"Unknown endpoint: {url.path}"}
+
+        start = time.perf_counter()
+        try:
+            query, options = self.parse_query(method, url, body)
+            results = await asyncio.get_running_loop().run_in_executor(
+                self._executor, run_query, url.path[1:], query, options
+            )
+        except Exception as e:  # Invalid queries (e.g. too few terms) are reported to the client
+            return HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        finally:
+            self.latencies.record(url.path, time.perf_counter() - start)
+
+        return HTTPStatus.OK, {"results": results}
+
+
+if __name__ == "__main__":
+    """
+    This script starts the query server, which keeps serving queries until interrupted.
+    """
+    try:
+        asyncio.run(QueryServer().serve())
+    except KeyboardInterrupt:
+        pass
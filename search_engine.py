@@ -0,0 +1,519 @@
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from constants import SEARCH_INFO_DIRECTORY, SECOND_INDEX_MATRIX_FILE, DOCUMENT_STORE_FILE, SEGMENTS_DIRECTORY, \
+    SEGMENTS_MANIFEST_FILE, VOCABULARY_FILE, FIRST_INDEX_FILE, FIRST_INDEX_BINARY_FILE, SECOND_INDEX_FILE, \
+    SECOND_INDEX_NORMS_FILE, METADATA_FILE, GENERATIONS_DIRECTORY, GENERATION_CHECK_INTERVAL, POSITIONAL_INDEX_FILE, \
+    NEAR_DISTANCE, TOP_ANIME_URLS_FILE
+from compression_utils import PositionalIndex
+from custom_metrics_utils import load_metadata, metric_features, POPULARITY_WEIGHTS
+from document_store import DocumentStore
+from first_index_utils import open_first_index, posting_list_size, intersect_all_postings, merge_postings, \
+    subtract_postings, parse_boolean_query
+from generations import current_generation, generation_path, verify_generation, files_version
+from instrumentation import instrumented_query
+from positional_index_utils import match_phrase, match_near
+from query_cache import cached_query, get_query_cache, terms_set, terms_multiset, terms_sequence
+from second_index_utils import load_second_index, accumulate_dot_products, query_squared_norm, cosine_similarities, \
+    top_scores_of_array, max_score_top_scores, load_second_index_matrix, load_second_index_norms, SecondIndexMatrix
+from segments import SegmentedIndex
+from utils import load_vocabulary, load_urls, retrieve_title_synopsis_and_url
+
+
+class SearchEngine:
+    """
+    Search engine serving queries on all the indexes.
+
+    The vocabulary and the indexes are loaded only once (the indexes lazily, on their first use), so that many queries
+    can be run without reading and parsing the files every time. They are read from `directory`, e.g. a generation's,
+    along with the URLs and the segmented index, so that all the queries are answered on the same documents.
+    """
+
+    def __init__(self, directory: str = "", version: Optional[str] = None):
+        self.directory = directory
+        # Identifies the indexes, so that results cached for other versions of them are never returned
+        self.version = version if version is not None else files_version(directory)
+        self.vocabulary = load_vocabulary(self._path(VOCABULARY_FILE))  # Maps each term to its ID
+        self.urls = load_urls(self._path(TOP_ANIME_URLS_FILE))
+        # Documents are read from the TSV files of the parsed animes if the document store hasn't been built
+        self.documents = (
+            DocumentStore(self._path(DOCUMENT_STORE_FILE)) if os.path.exists(self._path(DOCUMENT_STORE_FILE)) else None
+        )
+        self.num_documents = (
+            len(self.documents) if self.documents is not None else len(list(Path(SEARCH_INFO_DIRECTORY).glob("*.txt")))
+        )
+
+        self._first_index = None
+        self._second_index = None
+        self._second_index_matrix = None
+        self._second_index_norms = None
+        self._metadata = None
+        self._positional_index = None
+        # Queries on the first and second index are answered by the segmented index instead, if it has been built
+        self.segments = (
+            SegmentedIndex(self._path(SEGMENTS_DIRECTORY))
+            if os.path.exists(self._path(os.path.join(SEGMENTS_DIRECTORY, SEGMENTS_MANIFEST_FILE))) else None
+        )
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    @property
+    def first_index(self) -> list[list[int]]:
+        if self._first_index is None:
+            self._first_index = open_first_index(self._path(FIRST_INDEX_FILE), self._path(FIRST_INDEX_BINARY_FILE))
+        return self._first_index
+
+    @property
+    def second_index(self) -> list[list[tuple[int, float]]]:
+        if self._second_index is None:
+            self._second_index = load_second_index(self._path(SECOND_INDEX_FILE))
+        return self._second_index
+
+    @property
+    def second_index_matrix(self) -> Optional[SecondIndexMatrix]:
+        """The vectorized ranker on the second index, if its matrix has been built."""
+        if self._second_index_matrix is None and os.path.exists(self._path(SECOND_INDEX_MATRIX_FILE)):
+            matrix, norms = load_second_index_matrix(self._path(SECOND_INDEX_MATRIX_FILE))
+            self._second_index_matrix = SecondIndexMatrix(matrix, norms)
+        return self._second_index_matrix
+
+    @property
+    def second_index_norms(self) -> tuple[np.ndarray, np.ndarray]:
+        """The norms of the documents' tf-idf vectors and the terms' maximum normalized tf-idf."""
+        if self._second_index_norms is None:
+            self._second_index_norms = load_second_index_norms(self._path(SECOND_INDEX_NORMS_FILE))
+        return self._second_index_norms
+
+    @property
+    def positional_index(self) -> PositionalIndex:
+        """The positions of each term in each document, used by phrase and proximity queries."""
+        if self._positional_index is None:
+            if not os.path.exists(self._path(POSITIONAL_INDEX_FILE)):
+                raise Exception("The positional index hasn't been built, see create_positional_index.py")
+            self._positional_index = PositionalIndex(self._path(POSITIONAL_INDEX_FILE))
+        return self._positional_index
+
+    @property
+    def metadata(self) -> dict[str, np.ndarray]:
+        """The values of each metric usable in custom queries, for all documents."""
+        if self._metadata is None:
+            self._metadata = load_metadata(self.num_documents, self._path(METADATA_FILE))
+        return self._metadata
+
+    def warm_up(self):
+        """Load the indexes that have been built now, rather than on the first query using them."""
+        _ = self.first_index
+        _ = self.second_index_matrix
+        if os.path.exists(self._path(SECOND_INDEX_NORMS_FILE)):
+            _ = self.second_index_norms
+        if os.path.exists(self._path(METADATA_FILE)):
+            _ = self.metadata
+        if os.path.exists(self._path(POSITIONAL_INDEX_FILE)):
+            _ = self.positional_index
+
+    def term_ids(self, query: list[str]) -> Optional[list[int]]:
+        """Return the IDs of the query terms, or None if any of them is missing from the vocabulary."""
+        term_ids = [self.vocabulary.get(word.lower()) for word in query]
+        return None if any(term_id is None for term_id in term_ids) else term_ids
+
+    def retrieve(self, document_id: int) -> tuple[str, str, str]:
+        """Return the title, unprocessed synopsis and url of an anime."""
+        if self.documents is not None:
+            return self.documents[document_id]
+        return retrieve_title_synopsis_and_url(document_id, self.urls)
+
+    def retrieve_many(self, document_ids: list[int]) -> list[tuple[str, str, str]]:
+        """Return the title, unprocessed synopsis and url of many animes, e.g. all the results of a query."""
+        if self.documents is not None:
+            return self.documents.get_many(document_ids)
+        return [retrieve_title_synopsis_and_url(document_id, self.urls) for document_id in document_ids]
+
+    def _retrieve_results(self, scores: list[tuple[int, float]]) -> list[tuple[str, str, str, float]]:
+        """Retrieve the documents for a list of (document ID, score) pairs, appending the score to each of them."""
+        documents = self.retrieve_many([document_id for document_id, _ in scores])
+        return [list(document) + [score] for document, (_, score) in zip(documents, scores)]
+
+    @instrumented_query("conjunctive")
+    @cached_query(terms_set)
+    def run_query_on_first_index(self, query: list[str]) -> list[tuple[str, str, str]]:
+        """
+        Given a query, return title, synopsis and url of the animes that match it.
+        """
+        if not query:
+            raise Exception("Please supply at least one query term")
+
+        if self.segments is not None:
+            return self.retrieve_many(self.segments.conjunctive(query))
+
+        term_ids = self.term_ids(query)
+        if term_ids is None:  # If a word is missing from the vocabulary, the query can't be matched
+            return []
+
+        # Intersect the posting lists starting from the rarest terms, whose posting lists are the shortest
+        term_ids = sorted(set(term_ids), key=lambda term_id: posting_list_size(self.first_index, term_id))
+        matches = intersect_all_postings(self.first_index[term_id] for term_id in term_ids)
+
+        return self.retrieve_many(matches)
+
+    @instrumented_query("boolean")
+    @cached_query(terms_sequence)
+    def run_boolean_query(self, query: list[str]) -> list[tuple[str, str, str]]:
+        """
+        Given a boolean query, return title, synopsis and url of the animes that match it.
+
+        Terms are implicitly joined by AND, "OR" joins the terms around it and "NOT" excludes the term following it.
+        """
+        clauses, excluded = parse_boolean_query(query)
+
+        # Each clause matches the union of its terms' posting lists (terms missing from the vocabulary match nothing)
+        clauses_term_ids = [
+            [self.vocabulary[word] for word in clause if word in self.vocabulary] for clause in clauses
+        ]
+        if any(not term_ids for term_ids in clauses_term_ids):
+            return []
+
+        def clause_size(term_ids: list[int]) -> int:
+            return sum(posting_list_size(self.first_index, term_id) for term_id in term_ids)
+
+        def clause_postings(term_ids: list[int]) -> list[int]:
+            if len(term_ids) == 1:
+                return self.first_index[term_ids[0]]
+            return merge_postings(self.first_index[term_id] for term_id in term_ids)
+
+        # Intersect the clauses starting from the ones matching the fewest documents
+        clauses_term_ids.sort(key=clause_size)
+        matches = intersect_all_postings(clause_postings(term_ids) for term_ids in clauses_term_ids)
+
+        excluded_term_ids = [self.vocabulary[word] for word in excluded if word in self.vocabulary]
+        if matches and excluded_term_ids:
+            matches = subtract_postings(matches, clause_postings(excluded_term_ids))
+
+        return self.retrieve_many(matches)
+
+    def _positional_postings(self, query: list[str]) -> Optional[list[list[tuple[int, list[int]]]]]:
+        """
+        Return the positional posting list of each query term, or None if any of them is missing from the vocabulary.
+        """
+        term_ids = self.term_ids(query)
+        if term_ids is None:
+            return None
+
+        # Repeated terms are only decoded once
+        postings = {term_id: self.positional_index[term_id] for term_id in set(term_ids)}
+        return [postings[term_id] for term_id in term_ids]
+
+    @instrumented_query("phrase")
+    @cached_query(terms_sequence)
+    def run_phrase_query(self, query: list[str]) -> list[tuple[str, str, str]]:
+        """
+        Given a phrase, return title, synopsis and url of the animes whose synopsis contains its terms next to each
+        other and in order, e.g. `["state", "alchemist"]`.
+
+        Like the synopses, phrases are made of lemmas without stopwords, so "lord of the rings" is `["lord", "ring"]`.
+        """
+        if not query:
+            raise Exception("Please supply at least one query term")
+
+        postings = self._positional_postings(query)
+        if postings is None:  # If a word is missing from the vocabulary, the query can't be matched
+            return []
+
+        return self.retrieve_many(match_phrase(postings))
+
+    @instrumented_query("near")
+    @cached_query(terms_set)
+    def run_proximity_query(self, query: list[str], distance: int = NEAR_DISTANCE) -> list[tuple[str, str, str]]:
+        """
+        Given a query, return title, synopsis and url of the animes whose synopsis contains all its terms at most
+        `distance` positions apart, in any order (e.g. with a distance of 1, the terms must be next to each other).
+        """
+        if len(query) < 2:
+            raise Exception("Please supply at least two query terms")
+        if distance < 1:
+            raise Exception("Please supply a distance of at least one position")
+
+        postings = self._positional_postings(sorted(set(word.lower() for word in query)))
+        if postings is None:  # If a word is missing from the vocabulary, the query can't be matched
+            return []
+
+        return self.retrieve_many(match_near(postings, distance))
+
+    @instrumented_query("tfidf")
+    @cached_query(terms_multiset)
+    def run_query_on_second_index(
+            self, query: list[str], limit: int = 10, prune: bool = False
+    ) -> list[tuple[str, str, str, float]]:
+        """
+        Given a query, return title, synopsis, url and query score of the first `limit` animes with the best score.
+
+        The documents are ranked by the segmented index if it has been built. Otherwise they are ranked with the second
+        index's matrix if available, or, if it isn't or if `prune`, by walking the posting lists with MaxScore dynamic
+        pruning, skipping the documents that can't enter the results.
+        """
+        if len(query) < 2:
+            raise Exception("Please supply at least two query terms")
+
+        if self.segments is not None:
+            return self._retrieve_results(self.segments.rank(query, limit))
+
+        term_ids = self.term_ids(query)
+        if term_ids is None:  # If a word is missing from the vocabulary, the query can't be matched
+            return []
+
+        if self.second_index_matrix is not None and not prune:
+            return self._retrieve_results(self.second_index_matrix.rank(term_ids, limit))
+
+        document_norms, term_max_scores = self.second_index_norms
+        return self._retrieve_results(
+            max_score_top_scores(self.second_index, term_ids, limit, document_norms, term_max_scores)
+        )
+
+    @instrumented_query("tfidf_batch")
+    def run_queries_on_second_index(
+            self, queries: list[list[str]], limit: int = 10
+    ) -> list[list[tuple[str, str, str, float]]]:
+        """
+        Run many queries on the second index at once, returning the results of each of them.
+
+        If the second index's matrix is available, all queries are scored with a single sparse matrix product.
+        """
+        if any(len(query) < 2 for query in queries):
+            raise Exception("Please supply at least two query terms")
+
+        if self.second_index_matrix is None or self.segments is not None:
+            return [self.run_query_on_second_index(query, limit) for query in queries]
+
+        queries_term_ids = [self.term_ids(query) for query in queries]
+
+        # Queries with words missing from the vocabulary can't be matched
+        matchable_term_ids = [term_ids for term_ids in queries_term_ids if term_ids is not None]
+        rankings = iter(self.second_index_matrix.rank_queries(matchable_term_ids, limit) if matchable_term_ids else [])
+
+        return [
+            self._retrieve_results(next(rankings)) if term_ids is not None else []
+            for term_ids in queries_term_ids
+        ]
+
+    @instrumented_query("custom")
+    def run_custom_query(
+            self, query: list[str], requested_popularity: str, limit: int = 10
+    ) -> list[tuple[str, str, str, float]]:
+        """
+        Given a query, return title, synopsis, url and query score of the first `limit` animes with the best score.
+        """
+        if requested_popularity not in POPULARITY_WEIGHTS:
+            raise Exception("Please supply a valid value for popularity")
+
+        # Not through `run_weighted_query`, so that the query is only reported once, as a custom one
+        return self._run_weighted_query(query, POPULARITY_WEIGHTS[requested_popularity], limit)
+
+    def _accumulate_dot_products(self, term_ids: list[int]) -> np.ndarray:
+        """
+        Return the dot products between the query and all documents, as an array indexed by document ID.
+        """
+        if self.second_index_matrix is not None:
+            dot_products, _ = self.second_index_matrix.accumulate_queries([term_ids])
+            return dot_products[:, 0]
+
+        dot_products_by_id = accumulate_dot_products([self.second_index[term_id] for term_id in term_ids])
+
+        document_ids = np.fromiter(dot_products_by_id.keys(), dtype=np.int64, count=len(dot_products_by_id))
+        dot_products = np.zeros(self.num_documents)
+        dot_products[document_ids] = list(dot_products_by_id.values())
+
+        return dot_products
+
+    @instrumented_query("weighted")
+    def run_weighted_query(
+            self, query: list[str], weights: dict[str, float], limit: int = 10
+    ) -> list[tuple[str, str, str, float]]:
+        """
+        Given a query and the weight of each metric (see `custom_metrics_utils.METADATA_COLUMNS`), return title,
+        synopsis, url and query score of the first `limit` animes with the best score.
+
+        Each metric with a non-zero weight adds a component to the vectors compared with the cosine similarity:
+        a positive weight favours animes with high values, a negative one animes with low values.
+        """
+        return self._run_weighted_query(query, weights, limit)
+
+    @cached_query(terms_multiset)
+    def _run_weighted_query(
+            self, query: list[str], weights: dict[str, float], limit: int = 10
+    ) -> list[tuple[str, str, str, float]]:
+        """Run a weighted query, shared by custom and weighted queries without being instrumented."""
+        if len(query) < 1:
+            raise Exception("Please supply at least one query term")
+
+        term_ids = self.term_ids(query)
+        if term_ids is None:  # If a word is missing from the vocabulary, the query can't be matched
+            return []
+
+        dot_products = self._accumulate_dot_products(term_ids)
+        document_norms, _ = self.second_index_norms
+        squared_norms = document_norms*document_norms
+
+        # The query vector is made of ones for the terms, followed by the metrics' weights
+        features, query_features = metric_features(self.metadata, weights)
+        squared_query_norm = query_squared_norm(term_ids) + float(np.dot(query_features, query_features))
+
+        # Without custom metrics, only the documents containing a query term are scored. The metrics give a non-zero
+        # component to (almost) every document, so all of them are scored, except those whose vector is all zeros
+        if features is None:
+            excluded = dot_products == 0
+        else:
+            dot_products = dot_products + features @ query_features
+            squared_norms = squared_norms + np.einsum("ij,ij->i", features, features)
+            excluded = squared_norms == 0
+
+        scores = cosine_similarities(dot_products, squared_query_norm, squared_norms)
+
+        return self._retrieve_results(top_scores_of_array(scores, excluded, limit))
+
+
+class GenerationReader:
+    """
+    Serve the search engine of the current generation of the indexes, swapping in new generations as they are
+    published (see `generations.py`).
+
+    The pointer to the current generation is checked at most every `check_interval` seconds. A new generation is
+    verified and loaded in a background thread while queries keep being served by the previous one, then swapped in by
+    replacing a single reference: queries in progress finish on the engine they started with. Until a generation is
+    published, the indexes are read from the working directory, and reloaded in the same way when rebuilt there or
+    when its segmented index is updated. A generation holds a copy of the segmented index, so it keeps serving the same
+    documents until a new one is published.
+    """
+
+    def __init__(self, directory: str = GENERATIONS_DIRECTORY, check_interval: float = GENERATION_CHECK_INTERVAL):
+        self.directory = directory
+        self.check_interval = check_interval
+
+        self.generation, version = self._current()
+        self._engine = self._open(self.generation, version)
+
+        self._lock = threading.Lock()
+        self._loading = None  # The version being loaded, if any
+        self._failed = set()  # Versions that could not be loaded, not to be retried
+        self._last_check = time.monotonic()
+
+    def _current(self) -> tuple[Optional[str], str]:
+        """
+        Return the current generation (None for the working directory) and the version of the indexes to serve.
+        """
+        generation = current_generation(self.directory)
+        if generation is not None:
+            return generation, generation
+
+        version = files_version()
+        segments_manifest = os.path.join(SEGMENTS_DIRECTORY, SEGMENTS_MANIFEST_FILE)
+        if os.path.exists(segments_manifest):
+            version += f"+segments@{os.stat(segments_manifest).st_mtime_ns}"
+
+        return None, version
+
+    def _open(self, generation: Optional[str], version: str) -> SearchEngine:
+        directory = generation_path(generation, self.directory) if generation is not None else ""
+        return SearchEngine(directory, version)
+
+    @property
+    def engine(self) -> SearchEngine:
+        """The search engine of the latest generation loaded."""
+        self.check()
+        return self._engine
+
+    def check(self):
+        """Start loading the current generation in the background if it changed since the last one loaded."""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+
+        generation, version = self._current()
+        if version == self._engine.version or version in self._failed:
+            return
+
+        with self._lock:
+            if self._loading is not None:
+                return
+            self._loading = version
+
+        threading.Thread(target=self._load, args=(generation, version), daemon=True).start()
+
+    def _load(self, generation: Optional[str], version: str):
+        try:
+            if generation is not None:
+                verify_generation(generation, self.directory)
+
+            engine = self._open(generation, version)
+            engine.warm_up()
+
+            # The previous engine's files are closed once the queries still using it are done with it
+            self._engine, self.generation = engine, generation
+
+            # The results cached for the previous version can't be requested anymore
+            get_query_cache().clear()
+        except Exception as e:
+            self._failed.add(version)
+            print(f"Could not load {generation or 'the rebuilt indexes'}, still serving {self._engine.version}: {e}")
+        finally:
+            with self._lock:
+                self._loading = None
+
+
+_generation_reader: Optional[GenerationReader] = None
+
+
+def get_search_engine() -> SearchEngine:
+    """
+    Return the search engine shared by the module-level query functions, loading it on first use.
+
+    Callers should get the engine again for each query, so that new generations of the indexes are picked up.
+    """
+    global _generation_reader
+
+    if _generation_reader is None:
+        _generation_reader = GenerationReader()
+    return _generation_reader.engine
+
+
+if __name__ == "__main__":
+    """
+    Run the same queries many times on a single search engine, reporting the average latency of each query mode.
+    """
+    engine = get_search_engine()
+
+    queries = [
+        ("first index", lambda: engine.run_query_on_first_index(["saiyan"])),
+        ("second index", lambda: engine.run_query_on_second_index(["edward", "alphonse", "elric", "alchemy"])),
+        (
+            "second index (MaxScore)",
+            lambda: engine.run_query_on_second_index(["edward", "alphonse", "elric", "alchemy"], prune=True)
+        ),
+        ("custom metric", lambda: engine.run_custom_query(["alchemy"], "popular")),
+    ]
+
+    cache = get_query_cache()
+
+    for name, run_query in queries:
+        run_query()  # Warm up, loading the index used by the query
+
+        num_runs = 20
+        elapsed = 0.0
+        for _ in range(num_runs):
+            cache.clear()  # Measure the query itself, not the cache
+            start = time.perf_counter()
+            run_query()
+            elapsed += time.perf_counter() - start
+        print(f"{name}: {elapsed / num_runs * 1000:.2f} ms per query")
+
+        start = time.perf_counter()
+        for _ in range(num_runs):
+            run_query()
+        print(f"{name} (cached): {(time.perf_counter() - start) / num_runs * 1000:.3f} ms per query")
+
+    print(f"Cache: {cache.stats()}")
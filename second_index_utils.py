@@ -1,19 +1,59 @@
 import heapq
-import os
-from pathlib import Path
-from scipy.spatial.distance import cosine
+import math
+from collections import Counter, defaultdict
 
-from constants import VOCABULARY_FILE, SECOND_INDEX_FILE, SEARCH_INFO_DIRECTORY
-from utils import retrieve_title_synopsis_and_url, search_info_filename
+import numpy as np
+from scipy.sparse import csr_matrix, csc_matrix
 
+from constants import SECOND_INDEX_FILE, SECOND_INDEX_MATRIX_FILE, SECOND_INDEX_NORMS_FILE
+from first_index_utils import gallop
 
-def load_second_index():
+# Relative margin by which a document's upper bound must be below the threshold to be skipped, so that rounding errors
+# in the scores never make MaxScore skip a document that exhaustive scoring would keep
+PRUNING_TOLERANCE = 1e-9
+
+
+def tf(words, count: int = 1) -> float:
+    """
+    Term frequency: the number of times a term appears in a document, weighted over the document's word count.
+
+    Without positional analysis, the documents' words are sets, so this is a boolean term frequency.
+    """
+
+    return count/len(words)
+
+
+def idf(num_all_documents, num_documents_containing_term) -> float:
+    """Inverse document frequency for a word. Uses the precomputed data from the first index."""
+
+    return math.log(num_all_documents/num_documents_containing_term)
+
+
+def save_second_index(index: list[list[tuple[int, float]]], num_documents: int):
+    """
+    Save the second index to a file, along with its document x term matrix.
+    """
+    with open(SECOND_INDEX_FILE, "w") as out_txt:
+        for i in range(len(index)):
+            # The n-th line contains the IDs of the documents that include the term with ID n followed by their tf-idf score
+            out_txt.write(" ".join(f"{document_id} {tf_idf}" for document_id, tf_idf in index[i]) + "\n")
+
+    # The documents' norms normalize the cosine similarity, and the terms' maximum scores bound it for MaxScore
+    matrix = build_second_index_matrix(index, num_documents)
+    norms = compute_document_norms(matrix)
+    save_second_index_norms(norms, compute_term_max_scores(matrix, norms))
+
+    # The matrix, along with the documents' norms, is used for vectorized ranking
+    save_second_index_matrix(matrix, norms)
+
+
+def load_second_index(path: str = SECOND_INDEX_FILE):
     """
     Load the first index from the file where it was saved.
     """
     index = []
 
-    with open(SECOND_INDEX_FILE, "r") as fin:
+    with open(path, "r") as fin:
         for line in fin.readlines():
             tokens = line.strip().split(" ")
 
@@ -28,67 +68,311 @@ def load_second_index():
     return index
 
 
-def compute_document_vector(document_id, query, vocabulary, index):
-    """Return the vector for a document, to be used in the cosine similarity check."""
-    vector = [0.0]*len(query)
+def accumulate_dot_products(query_postings: list[list[tuple[int, float]]]) -> dict[int, float]:
+    """
+    Walk each query term's posting list exactly once, accumulating the dot product between the query and each document.
+
+    Since the query vector is made of ones (or of the number of times each term appears in the query), the dot product
+    is the sum of the document's tf-idf values for the query terms. Only the documents appearing in some posting list
+    get an accumulator.
+    """
+    dot_products = defaultdict(float)
 
-    for i, query_term in enumerate(query):
-        for current_doc_id, tfidf in index[vocabulary.index(query_term)]:
-            if document_id == current_doc_id:
-                vector[i] = tfidf
+    for postings in query_postings:
+        for document_id, tf_idf in postings:
+            dot_products[document_id] += tf_idf
 
-    return vector
+    return dot_products
 
 
-def cosine_similarity(v1: list[float], v2: list[float]):
-    """Compute the cosine similarity between two vectors."""
-    return 1.0 - cosine(v1, v2)
+def query_squared_norm(term_ids: list[int]) -> float:
+    """Return the squared norm of a query's vector, counting how many times each term appears in the query."""
+    return float(sum(count*count for count in Counter(term_ids).values()))
 
 
-def run_query_on_second_index(query: list[str], limit: int = 10) -> list[tuple[str, str, str, float]]:
+def cosine_similarity(dot_product: float, query_squared_norm: float, document_squared_norm: float) -> float:
     """
-    Given a query, return title, synopsis, url and query score of the first `limit` animes with the best score.
+    Compute the cosine similarity between two vectors, given their dot product and squared norms.
+
+    The result is clipped to the [-1, 1] range, matching `1 - scipy.spatial.distance.cosine`.
     """
-    with open(VOCABULARY_FILE, "r") as fin:
-        vocabulary = [word.strip() for word in fin.readlines()]
+    return 1.0 - min(max(1.0 - dot_product/math.sqrt(query_squared_norm*document_squared_norm), 0.0), 2.0)
+
 
-    if len(query) < 2:
-        raise Exception("Please supply at least two query terms")
+def cosine_similarities(
+        dot_products: np.ndarray, query_squared_norms, document_squared_norms: np.ndarray
+) -> np.ndarray:
+    """
+    Vectorized version of `cosine_similarity`, on arrays of dot products and squared norms.
 
-    if any(word.lower() not in vocabulary for word in query):  # If a word is missing from the vocabulary, the query can't be matched
+    Documents whose vector is all zeros get NaN scores, so they must be excluded from the results.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = dot_products / np.sqrt(query_squared_norms * document_squared_norms)
+    return 1.0 - np.clip(1.0 - scores, 0.0, 2.0)
+
+
+def max_score_top_scores(
+        index: list[list[tuple[int, float]]], term_ids: list[int], limit: int,
+        document_norms: np.ndarray, term_max_scores: np.ndarray
+) -> list[tuple[int, float]]:
+    """
+    Select the `limit` (document ID, score) pairs with the highest cosine similarity to a query using MaxScore
+    dynamic pruning, giving the same results as scoring all the documents in the query terms' posting lists.
+
+    A term contributes at most its maximum normalized tf-idf (times the number of times it appears in the query) to
+    the score. Once `limit` documents have been scored, the terms are split into "non-essential" ones, whose
+    contributions together can't give a document a score above the current threshold, and "essential" ones. Only the
+    documents in the essential terms' posting lists are candidates, and the non-essential posting lists are only
+    searched (with galloping) for the candidates that may still enter the top `limit`.
+
+    Documents are visited in increasing order of ID, so that ties are broken in favour of the lowest ID like in
+    `top_scores_of_array`.
+    """
+    if limit <= 0:
         return []
 
-    index = load_second_index()
+    counts = Counter(term_ids)  # Repeated query terms count several times
+    squared_query_norm = query_squared_norm(term_ids)
+    query_norm = math.sqrt(squared_query_norm)
+
+    # Terms in increasing order of upper bound, so that the non-essential terms are a prefix of this list
+    terms = sorted(counts, key=lambda term_id: counts[term_id] * term_max_scores[term_id])
+    bounds = [counts[term_id] * float(term_max_scores[term_id]) / query_norm for term_id in terms]
+    prefix_bounds = [0.0]
+    for bound in bounds:
+        prefix_bounds.append(prefix_bounds[-1] + bound)
+
+    def can_enter(score_bound: float) -> bool:
+        return score_bound * (1 + PRUNING_TOLERANCE) > top[0][0]
+
+    postings_lists = [index[term_id] for term_id in terms]
+    positions = [0] * len(terms)
+    top = []  # Min-heap of the (score, -document ID) pairs of the best documents so far
+    num_non_essential = 0
+
+    while True:
+        # The next candidate is the lowest document ID not yet visited in the essential posting lists
+        candidate = None
+        for i in range(num_non_essential, len(terms)):
+            postings, position = postings_lists[i], positions[i]
+            if position < len(postings) and (candidate is None or postings[position][0] < candidate):
+                candidate = postings[position][0]
+
+        if candidate is None:
+            break
+
+        norm = float(document_norms[candidate])
+        tf_idfs = {}
+        partial_score = 0.0
+        for i in range(num_non_essential, len(terms)):
+            postings, position = postings_lists[i], positions[i]
+            if position < len(postings) and postings[position][0] == candidate:
+                tf_idf = postings[position][1]
+                tf_idfs[terms[i]] = tf_idf
+                positions[i] = position + 1
+                partial_score += counts[terms[i]] * tf_idf / (query_norm * norm) if norm else 0.0
+
+        # Search the non-essential posting lists, the ones with the highest bounds first, as long as the document may
+        # still enter the top `limit`
+        skipped = False
+        for j in range(num_non_essential - 1, -1, -1):
+            if not can_enter(partial_score + prefix_bounds[j + 1]):
+                skipped = True
+                break
+
+            postings = postings_lists[j]
+            position = positions[j] = gallop(postings, (candidate,), positions[j])
+            if position < len(postings) and postings[position][0] == candidate:
+                tf_idf = postings[position][1]
+                tf_idfs[terms[j]] = tf_idf
+                partial_score += counts[terms[j]] * tf_idf / (query_norm * norm) if norm else 0.0
+
+        if skipped:
+            continue
+
+        # Accumulate in the query's order, to get exactly the same values as `accumulate_dot_products`
+        dot_product = 0.0
+        for term_id in term_ids:
+            dot_product += tf_idfs.get(term_id, 0.0)
+
+        if dot_product == 0 or norm == 0:  # Skip documents sharing no (weighted) term with the query
+            continue
+
+        entry = (cosine_similarity(dot_product, squared_query_norm, norm*norm), -candidate)
+        if len(top) < limit:
+            heapq.heappush(top, entry)
+        elif entry > top[0]:
+            heapq.heapreplace(top, entry)
+        else:
+            continue
+
+        # The threshold may have risen, making more terms non-essential (once all of them are, no other document can
+        # enter the top `limit`)
+        if len(top) == limit:
+            while num_non_essential < len(terms) and not can_enter(prefix_bounds[num_non_essential + 1]):
+                num_non_essential += 1
+
+    return [(-negated_id, score) for score, negated_id in sorted(top, reverse=True)]
+
+
+def build_second_index_matrix(index: list[list[tuple[int, float]]], num_documents: int) -> csr_matrix:
+    """
+    Build the document x term matrix of the tf-idf scores from the second index.
+    """
+    rows, columns, values = [], [], []
+
+    for term_id, postings in enumerate(index):
+        for document_id, tf_idf in postings:
+            rows.append(document_id)
+            columns.append(term_id)
+            values.append(tf_idf)
 
-    # We have to compute the cosine similarity between the query and all documents.
-    # Let's first compute the query vector
+    return csr_matrix((values, (rows, columns)), shape=(num_documents, len(index)), dtype=np.float64)
 
-    query_vector = [1.0]*len(query)
 
-    # Now let's compute scores for each document and add them to a heap
-    heap = []
+def compute_document_norms(matrix: csr_matrix) -> np.ndarray:
+    """
+    Compute the L2 norm of each document's tf-idf vector, i.e. of each row of the document x term matrix.
+    """
+    return np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
 
-    files_to_parse = sorted(Path(SEARCH_INFO_DIRECTORY).glob("*.txt"))
-    for i, path in enumerate(files_to_parse):
 
-        # Compute the vector for the document.
-        document_vector = compute_document_vector(i, query, vocabulary, index)
+def compute_term_max_scores(matrix: csr_matrix, norms: np.ndarray) -> np.ndarray:
+    """
+    Compute, for each term, the maximum of its tf-idf values divided by the document's norm, which bounds the term's
+    contribution to the cosine similarity between a document and a query.
+    """
+    inverse_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms != 0)
+    normalized = csc_matrix(matrix.multiply(inverse_norms[:, np.newaxis]))
+    return np.asarray(normalized.max(axis=0).todense()).ravel()
+
 
-        # Compute the cosine similarity
-        score = cosine_similarity(query_vector, document_vector)
+def save_second_index_norms(
+        norms: np.ndarray, term_max_scores: np.ndarray, path: str = SECOND_INDEX_NORMS_FILE
+):
+    """
+    Save the documents' norms and the terms' maximum scores, used along with the second index's posting lists.
+    """
+    np.savez(path, norms=norms, term_max_scores=term_max_scores)
+
+
+def load_second_index_norms(path: str = SECOND_INDEX_NORMS_FILE) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Load the documents' norms and the terms' maximum scores from the file where they were saved.
+    """
+    with np.load(path) as npz:
+        return npz["norms"], npz["term_max_scores"]
 
-        if not all(vector_dimension == 0 for vector_dimension in document_vector):
-            heap.append((-score, i)) # Use -score to have pop return elements from highest to lowest
 
-    # Build list to be returned
-    heapq.heapify(heap)
-    result = []
+def save_second_index_matrix(matrix: csr_matrix, norms: np.ndarray, path: str = SECOND_INDEX_MATRIX_FILE):
+    """
+    Save the document x term tf-idf matrix, together with the L2 norm of each document's tf-idf vector.
+    """
+    np.savez(
+        path, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr, shape=matrix.shape, norms=norms
+    )
+
+
+def load_second_index_matrix(path: str = SECOND_INDEX_MATRIX_FILE) -> tuple[csr_matrix, np.ndarray]:
+    """
+    Load the document x term tf-idf matrix and the documents' norms from the file where they were saved.
+    """
+    with np.load(path) as npz:
+        matrix = csr_matrix((npz["data"], npz["indices"], npz["indptr"]), shape=tuple(npz["shape"]))
+        return matrix, npz["norms"]
+
+
+class SecondIndexMatrix:
+    """
+    Vectorized ranker on the document x term tf-idf matrix.
+
+    Queries are scored against all documents at once with sparse matrix products. Since these only need the query
+    terms' columns, the matrix is kept in column-major (CSC) format.
+    """
+
+    def __init__(self, matrix: csr_matrix, norms: np.ndarray):
+        self.matrix = csc_matrix(matrix)
+        self.norms = norms
+
+    @property
+    def num_documents(self) -> int:
+        return self.matrix.shape[0]
+
+    def accumulate_queries(self, queries_term_ids: list[list[int]]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the dot products between every document and each of the queries, like `accumulate_dot_products`.
+
+        Return the document x query matrix of the dot products and the squared norms of the queries' vectors.
+        """
+        # Only keep the columns of the terms appearing in some query
+        term_ids = sorted(set(term_id for query_term_ids in queries_term_ids for term_id in query_term_ids))
+        column_of_term = {term_id: column for column, term_id in enumerate(term_ids)}
+
+        # Build the (dense, as it is small) term x query matrix, counting how many times each term appears in each query
+        query_matrix = np.zeros((len(term_ids), len(queries_term_ids)))
+        for query_id, query_term_ids in enumerate(queries_term_ids):
+            for term_id in query_term_ids:
+                query_matrix[column_of_term[term_id], query_id] += 1.0
+
+        return self.matrix[:, term_ids] @ query_matrix, (query_matrix*query_matrix).sum(axis=0)
+
+    def score_queries(self, queries_term_ids: list[list[int]]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the cosine similarity between every document and each of the queries.
+
+        Return a document x query matrix of scores, and a boolean one telling whether the document shares no
+        (weighted) term with the query, in which case it does not match the query.
+        """
+        dot_products, query_squared_norms = self.accumulate_queries(queries_term_ids)
+        document_squared_norms = (self.norms*self.norms)[:, np.newaxis]
+
+        scores = cosine_similarities(dot_products, query_squared_norms, document_squared_norms)
+        return scores, (dot_products == 0) | (document_squared_norms == 0)
+
+    def rank_queries(self, queries_term_ids: list[list[int]], limit: int) -> list[list[tuple[int, float]]]:
+        """
+        Return, for each query, the (document ID, score) pairs of the `limit` documents with the highest scores.
+        """
+        scores, empty = self.score_queries(queries_term_ids)
+        return [top_scores_of_array(scores[:, i], empty[:, i], limit) for i in range(len(queries_term_ids))]
+
+    def rank(self, term_ids: list[int], limit: int) -> list[tuple[int, float]]:
+        """
+        Return the (document ID, score) pairs of the `limit` documents with the highest scores for a query.
+        """
+        return self.rank_queries([term_ids], limit)[0]
+
+
+def top_scores_of_array(scores: np.ndarray, excluded: np.ndarray, limit: int) -> list[tuple[int, float]]:
+    """
+    Select the `limit` (document ID, score) pairs with the highest scores from an array of scores, ignoring the
+    excluded documents.
+
+    Ties are broken in favour of the lowest document ID.
+    """
+    if limit <= 0:
+        return []
+
+    candidates = np.flatnonzero(~excluded)
+    if len(candidates) > limit:
+        # Only keep the candidates that may be in the top `limit`, including those tied with the last one
+        top = np.argpartition(-scores[candidates], limit - 1)[:limit]
+        threshold = scores[candidates[top]].min()
+        candidates = candidates[scores[candidates] >= threshold]
+
+    # Sort by decreasing score, then by increasing document ID
+    candidates = candidates[np.lexsort((candidates, -scores[candidates]))][:limit]
+    return [(int(document_id), float(scores[document_id])) for document_id in candidates]
+
+
+def run_query_on_second_index(query: list[str], limit: int = 10) -> list[tuple[str, str, str, float]]:
+    """
+    Given a query, return title, synopsis, url and query score of the first `limit` animes with the best score.
+    """
+    from search_engine import get_search_engine  # Imported here to avoid a circular import
 
-    for i in range(min([limit, len(heap)])):
-        score, document_id = heapq.heappop(heap)
-        # Revert the sign change on score
-        result.append(list(retrieve_title_synopsis_and_url(document_id)) + [-score])
-    return result
+    return get_search_engine().run_query_on_second_index(query, limit)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,500 @@
+import fcntl
+import json
+import os
+import threading
+import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+from scipy.sparse import csr_matrix, csc_matrix
+
+from constants import SEGMENTS_DIRECTORY, SEGMENTS_MANIFEST_FILE, SEGMENTS_MERGE_FACTOR, SEGMENTS_MAX_DELETED_RATIO, \
+    SEGMENTS_RETIRED_DELAY, SEGMENTS_LOCK_FILE, SEARCH_INFO_DIRECTORY, VERBOSE
+from first_index_utils import intersect_all_postings
+from second_index_utils import idf, cosine_similarities, top_scores_of_array
+from utils import atomic_open, load_search_info_words
+
+
+def words_checksum(words: list[str]) -> int:
+    """Return a checksum of a document's words, used to detect the documents that changed since they were indexed."""
+    return zlib.crc32("\n".join(words).encode("utf-8"))
+
+
+class Segment:
+    """
+    Immutable part of the segmented index, holding some documents.
+
+    A segment has its own vocabulary (its words, sorted), and stores its documents as a document x term matrix of the
+    number of occurrences of each word (always one without positional analysis), whose rows are in increasing order of
+    document ID: its columns are the first index's posting lists. Words are not given global IDs, so adding documents
+    never changes what is already written.
+    """
+
+    def __init__(
+            self, name: str, document_ids: np.ndarray, matrix: csr_matrix, terms: np.ndarray, checksums: np.ndarray
+    ):
+        self.name = name
+        self.document_ids = document_ids
+        self.matrix = matrix
+        self.terms = terms
+        self.checksums = checksums
+
+    @classmethod
+    def build(cls, name: str, documents: dict[int, list[str]], checksums: Optional[dict[int, int]] = None) -> "Segment":
+        """
+        Build a segment from the words of some documents, mapped to by their IDs.
+
+        The checksums of the documents' words are computed unless given (e.g. when merging segments, whose documents'
+        words are no longer in their original order).
+        """
+        document_ids = sorted(documents)
+        terms = sorted(set(word for words in documents.values() for word in words))
+        term_ids = {term: i for i, term in enumerate(terms)}
+
+        indptr, indices, counts = [0], [], []
+        for document_id in document_ids:
+            term_counts = sorted(Counter(term_ids[word] for word in documents[document_id]).items())
+            indices.extend(term_id for term_id, _ in term_counts)
+            counts.extend(count for _, count in term_counts)
+            indptr.append(len(indices))
+
+        matrix = csr_matrix(
+            (np.array(counts, dtype=np.int32), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+            shape=(len(document_ids), len(terms))
+        )
+
+        if checksums is None:
+            checksums = {document_id: words_checksum(words) for document_id, words in documents.items()}
+
+        return cls(
+            name,
+            np.array(document_ids, dtype=np.int64),
+            matrix,
+            np.array(terms, dtype=str),
+            np.array([checksums[document_id] for document_id in document_ids], dtype=np.uint32),
+        )
+
+    @staticmethod
+    def path(directory: Path, name: str) -> Path:
+        return directory / f"{name}.npz"
+
+    def save(self, directory: Path):
+        with atomic_open(str(self.path(directory, self.name)), "wb") as fout:
+            np.savez(
+                fout, document_ids=self.document_ids, indptr=self.matrix.indptr, indices=self.matrix.indices,
+                counts=self.matrix.data, terms=self.terms, checksums=self.checksums
+            )
+
+    @classmethod
+    def load(cls, directory: Path, name: str) -> "Segment":
+        with np.load(cls.path(directory, name)) as npz:
+            document_ids, indptr, indices = npz["document_ids"], npz["indptr"], npz["indices"]
+            terms = npz["terms"]
+            # Segments written before term counts were stored hold each of their documents' words once
+            counts = npz["counts"] if "counts" in npz.files else np.ones(len(indices), dtype=np.int32)
+            matrix = csr_matrix((counts, indices, indptr), shape=(len(document_ids), len(terms)))
+            return cls(name, document_ids, matrix, terms, npz["checksums"])
+
+    @staticmethod
+    def load_checksums(directory: Path, name: str) -> dict[int, int]:
+        """Load the IDs of a segment's documents and the checksums of their words, without loading the rest."""
+        with np.load(Segment.path(directory, name)) as npz:
+            return dict(zip(npz["document_ids"].tolist(), npz["checksums"].tolist()))
+
+    def documents(self, excluded: set[int] = frozenset()) -> Iterator[tuple[int, list[str], int]]:
+        """
+        Iterate the ID, words and checksum of the segment's documents not excluded. The words are sorted, each one
+        repeated as many times as it appears in the document.
+        """
+        for row, document_id in enumerate(self.document_ids.tolist()):
+            if document_id not in excluded:
+                start, end = self.matrix.indptr[row], self.matrix.indptr[row + 1]
+                words = np.repeat(self.terms[self.matrix.indices[start:end]], self.matrix.data[start:end]).tolist()
+                yield document_id, words, int(self.checksums[row])
+
+
+class SegmentedIndexWriter:
+    """
+    Writer adding, replacing and deleting documents in the segmented index.
+
+    New and changed documents are written to a new segment, while their previous versions and deleted documents are
+    only marked as deleted ("tombstoned") in the manifest, which lists the segments and their deleted documents.
+    Segments are compacted by merging: when there are too many of them the smallest ones are merged together, and
+    segments with too many deleted documents are rewritten without them.
+
+    The manifest is replaced atomically, so readers always see a consistent list of segments. The files of merged
+    segments are only deleted `retired_delay` seconds later, so that readers that loaded the previous manifest can
+    still load them. Writers in different threads or processes (e.g. the pipeline and the streaming ingest) are
+    serialized by locking a file.
+    """
+
+    def __init__(
+            self,
+            directory: str = SEGMENTS_DIRECTORY,
+            merge_factor: int = SEGMENTS_MERGE_FACTOR,
+            max_deleted_ratio: float = SEGMENTS_MAX_DELETED_RATIO,
+            retired_delay: float = SEGMENTS_RETIRED_DELAY
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(exist_ok=True)
+        self.merge_factor = merge_factor
+        self.max_deleted_ratio = max_deleted_ratio
+        self.retired_delay = retired_delay
+        self._thread_lock = threading.Lock()
+
+    @contextmanager
+    def _lock(self):
+        """Serialize changes to the manifest with the other threads of this process and with other processes."""
+        with self._thread_lock, open(self.directory / SEGMENTS_LOCK_FILE, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.directory / SEGMENTS_MANIFEST_FILE
+
+    def load_manifest(self) -> dict:
+        if not self.manifest_path.exists():
+            return {"next_segment": 0, "segments": [], "retired": []}
+
+        with open(self.manifest_path, "r") as fin:
+            manifest = json.load(fin)
+            manifest.setdefault("retired", [])  # Merged segments whose files are still kept
+            return manifest
+
+    def _save_manifest(self, manifest: dict):
+        with atomic_open(str(self.manifest_path)) as fout:
+            json.dump(manifest, fout)
+
+    def _new_segment_name(self, manifest: dict) -> str:
+        name = f"segment_{manifest['next_segment']:05}"
+        manifest["next_segment"] += 1
+        return name
+
+    def live_checksums(self) -> dict[int, int]:
+        """Return the IDs of the documents in the index (not deleted), mapped to the checksums of their words."""
+        checksums = {}
+
+        for entry in self.load_manifest()["segments"]:
+            deleted = set(entry["deleted"])
+            for document_id, checksum in Segment.load_checksums(self.directory, entry["name"]).items():
+                if document_id not in deleted:
+                    checksums[document_id] = checksum
+
+        return checksums
+
+    @staticmethod
+    def _tombstone(manifest: dict, document_ids: set[int], directory: Path):
+        """Mark the documents as deleted in all the segments containing them."""
+        for entry in manifest["segments"]:
+            deleted = set(entry["deleted"])
+            contained = set(Segment.load_checksums(directory, entry["name"])) & document_ids
+            entry["deleted"] = sorted(deleted | contained)
+
+    def add_documents(self, documents: dict[int, list[str]]):
+        """
+        Add documents, mapped to by their IDs, to the index, replacing their previous versions if any.
+        """
+        if not documents:
+            return
+
+        with self._lock():
+            manifest = self.load_manifest()
+            segment = Segment.build(self._new_segment_name(manifest), documents)
+            segment.save(self.directory)
+
+            self._tombstone(manifest, set(documents), self.directory)
+            manifest["segments"].append({"name": segment.name, "deleted": []})
+            self._save_manifest(manifest)
+
+    def delete_documents(self, document_ids: list[int]):
+        """
+        Delete documents from the index.
+        """
+        if not document_ids:
+            return
+
+        with self._lock():
+            manifest = self.load_manifest()
+            self._tombstone(manifest, set(document_ids), self.directory)
+            self._save_manifest(manifest)
+
+    def _select_merge(self, manifest: dict) -> list[str]:
+        """
+        Choose which segments to merge: the smallest ones if there are too many segments, and the ones with too many
+        deleted documents.
+        """
+        sizes = {}
+        selected = set()
+
+        for entry in manifest["segments"]:
+            size = len(Segment.load_checksums(self.directory, entry["name"]))
+            sizes[entry["name"]] = size - len(entry["deleted"])
+            if size == 0 or len(entry["deleted"]) / size > self.max_deleted_ratio:
+                selected.add(entry["name"])
+
+        if len(manifest["segments"]) > self.merge_factor:
+            selected |= set(sorted(sizes, key=lambda name: sizes[name])[:self.merge_factor])
+
+        return [entry["name"] for entry in manifest["segments"] if entry["name"] in selected]
+
+    def merge(self) -> bool:
+        """
+        Merge segments according to the merge policy, returning whether anything was merged.
+
+        The merged segment is built without holding the lock, so documents can be added or deleted in the meantime:
+        deletions of documents from the merged segments are then carried over to the merged segment. If all the
+        documents of the merged segments were deleted, they are just removed, since an empty segment would be merged
+        again.
+        """
+        with self._lock():
+            manifest = self.load_manifest()
+            if self._delete_retired(manifest):
+                self._save_manifest(manifest)
+
+            names = self._select_merge(manifest)
+            if not names:
+                return False
+
+            snapshot = {
+                entry["name"]: set(entry["deleted"]) for entry in manifest["segments"] if entry["name"] in names
+            }
+            merged_name = self._new_segment_name(manifest)
+            self._save_manifest(manifest)  # Reserve the merged segment's name
+
+        documents, checksums = {}, {}
+        for name in names:
+            for document_id, words, checksum in Segment.load(self.directory, name).documents(snapshot[name]):
+                documents[document_id] = words
+                checksums[document_id] = checksum
+
+        if documents:
+            Segment.build(merged_name, documents, checksums).save(self.directory)
+
+        with self._lock():
+            manifest = self.load_manifest()
+
+            # Documents deleted from the merged segments while merging are deleted from the merged segment
+            deleted = set()
+            for entry in manifest["segments"]:
+                if entry["name"] in snapshot:
+                    deleted |= set(entry["deleted"]) - snapshot[entry["name"]]
+
+            # The merged segment takes the place of the first one it replaces, so segments stay in order of age
+            segments = []
+            for entry in manifest["segments"]:
+                if entry["name"] == names[0] and documents:
+                    segments.append({"name": merged_name, "deleted": sorted(deleted & set(documents))})
+                elif entry["name"] not in snapshot:
+                    segments.append(entry)
+            manifest["segments"] = segments
+
+            # Readers that loaded the previous manifest may still have to load the merged segments
+            manifest["retired"].extend({"name": name, "retired_at": time.time()} for name in names)
+            self._save_manifest(manifest)
+
+        if VERBOSE and documents:
+            print(f"Merged {len(names)} segments ({len(documents)} documents) into {merged_name}")
+        elif VERBOSE:
+            print(f"Removed {len(names)} segments whose documents were all deleted")
+
+        return True
+
+    def _delete_retired(self, manifest: dict) -> bool:
+        """
+        Delete the files of the merged segments retired for long enough, removing them from the manifest. Return
+        whether any was.
+        """
+        retired = []
+
+        for entry in manifest["retired"]:
+            if time.time() - entry["retired_at"] >= self.retired_delay:
+                Segment.path(self.directory, entry["name"]).unlink(missing_ok=True)
+            else:
+                retired.append(entry)
+
+        deleted = len(retired) < len(manifest["retired"])
+        manifest["retired"] = retired
+        return deleted
+
+    def merge_in_background(self) -> threading.Thread:
+        """
+        Merge segments (repeatedly, as long as the merge policy asks for it) in a background thread.
+        """
+        def merge_all():
+            while self.merge():
+                pass
+
+        thread = threading.Thread(target=merge_all, daemon=True)
+        thread.start()
+        return thread
+
+
+class SegmentedIndex:
+    """
+    Reader answering queries on all the segments of the segmented index at once.
+
+    The segments listed in the manifest when the index is opened are loaded in memory, ignoring their deleted
+    documents. Document frequencies, and thus the idf of each word, are computed across all segments, so that the
+    results are the same as the first and second index built from scratch on the same documents.
+    """
+
+    def __init__(self, directory: str = SEGMENTS_DIRECTORY):
+        self.directory = Path(directory)
+        writer = SegmentedIndexWriter(directory)
+        manifest = writer.load_manifest()
+
+        try:
+            self.segments = [Segment.load(self.directory, entry["name"]) for entry in manifest["segments"]]
+        except FileNotFoundError:
+            # The manifest was read before the segments were merged, and their files deleted: read the new one
+            manifest = writer.load_manifest()
+            self.segments = [Segment.load(self.directory, entry["name"]) for entry in manifest["segments"]]
+        self._live = [
+            ~np.isin(segment.document_ids, np.array(entry["deleted"], dtype=np.int64))
+            for segment, entry in zip(self.segments, manifest["segments"])
+        ]
+        self.num_documents = int(sum(live.sum() for live in self._live))
+
+        # Map the words of each segment to global term IDs, valid while the index is open
+        self.vocabulary: dict[str, int] = {}
+        self._global_term_ids = []
+        for segment in self.segments:
+            self._global_term_ids.append(np.array(
+                [self.vocabulary.setdefault(term, len(self.vocabulary)) for term in segment.terms.tolist()],
+                dtype=np.int64
+            ))
+
+        # Document frequencies only count the documents not deleted
+        document_frequencies = np.zeros(len(self.vocabulary), dtype=np.int64)
+        for segment, live, global_term_ids in zip(self.segments, self._live, self._global_term_ids):
+            live_matrix = segment.matrix[live]
+            document_frequencies += np.bincount(global_term_ids[live_matrix.indices], minlength=len(self.vocabulary))
+        self.document_frequencies = document_frequencies
+
+        idfs = np.array([
+            idf(self.num_documents, frequency) if frequency else 0.0 for frequency in document_frequencies.tolist()
+        ])
+
+        # The tf-idf matrix of each segment, in column-major format to read the query terms' columns, and the norms
+        self._tf_idf_matrices = []
+        self._norms = []
+        for segment, global_term_ids in zip(self.segments, self._global_term_ids):
+            matrix = segment.matrix
+            num_terms = np.diff(matrix.indptr)
+            # Each term's frequency is its number of occurrences over the document's number of words
+            num_words = np.asarray(matrix.sum(axis=1)).ravel()
+            tfs = np.divide(1.0, num_words, out=np.zeros(len(num_words)), where=num_words != 0)
+            data = np.repeat(tfs, num_terms) * matrix.data * idfs[global_term_ids[matrix.indices]]
+
+            tf_idf_matrix = csr_matrix((data, matrix.indices, matrix.indptr), shape=matrix.shape)
+            self._norms.append(np.sqrt(np.asarray(tf_idf_matrix.multiply(tf_idf_matrix).sum(axis=1)).ravel()))
+            self._tf_idf_matrices.append(csc_matrix(tf_idf_matrix))
+
+        self._posting_matrices = [segment.matrix.tocsc() for segment in self.segments]
+        for matrix in self._posting_matrices:
+            matrix.sort_indices()
+        self._term_ids = [{term: i for i, term in enumerate(segment.terms.tolist())} for segment in self.segments]
+
+    def conjunctive(self, query: list[str]) -> list[int]:
+        """
+        Return the sorted IDs of the documents containing all the query words.
+        """
+        words = [word.lower() for word in query]
+        if any(word not in self.vocabulary for word in words):
+            return []
+
+        matches = []
+        for segment, live, term_ids, columns in zip(self.segments, self._live, self._term_ids, self._posting_matrices):
+            if any(word not in term_ids for word in words):
+                continue
+
+            # Each column of the matrix in column-major format lists the rows of the documents containing a term
+            rows_lists = sorted(
+                (columns.indices[columns.indptr[term_id]:columns.indptr[term_id + 1]].tolist()
+                 for term_id in set(term_ids[word] for word in words)),
+                key=len
+            )
+            rows = np.array(intersect_all_postings(rows_lists), dtype=np.int64)
+            if len(rows):
+                matches.append(segment.document_ids[rows[live[rows]]])
+
+        return sorted(np.concatenate(matches).tolist()) if matches else []
+
+    def rank(self, query: list[str], limit: int = 10) -> list[tuple[int, float]]:
+        """
+        Return the (document ID, score) pairs of the `limit` documents with the highest cosine similarity to a query,
+        like the second index.
+        """
+        words = [word.lower() for word in query]
+        if any(word not in self.vocabulary for word in words):
+            return []
+
+        counts = {}
+        for word in words:
+            counts[word] = counts.get(word, 0) + 1
+        squared_query_norm = float(sum(count*count for count in counts.values()))
+
+        document_ids, scores = [], []
+        for segment, live, term_ids, matrix, norms in zip(
+                self.segments, self._live, self._term_ids, self._tf_idf_matrices, self._norms
+        ):
+            columns = [term_ids[word] for word in counts if word in term_ids]
+            if not columns:
+                continue
+
+            query_vector = np.array([counts[word] for word in counts if word in term_ids], dtype=np.float64)
+            dot_products = matrix[:, columns] @ query_vector
+            candidates = live & (dot_products != 0) & (norms != 0)
+
+            document_ids.append(segment.document_ids[candidates])
+            scores.append(cosine_similarities(dot_products[candidates], squared_query_norm, norms[candidates]**2))
+
+        if not document_ids:
+            return []
+
+        # Order the candidates by document ID, so that ties are broken in favour of the lowest one
+        document_ids, scores = np.concatenate(document_ids), np.concatenate(scores)
+        order = np.argsort(document_ids, kind="stable")
+        document_ids, scores = document_ids[order], scores[order]
+
+        return [
+            (int(document_ids[position]), score)
+            for position, score in top_scores_of_array(scores, np.zeros(len(scores), dtype=bool), limit)
+        ]
+
+
+if __name__ == "__main__":
+    """
+    This script updates the segmented index from the search info files: new and changed animes are added to a new
+    segment, and animes whose file disappeared are deleted. Segments are then merged if needed.
+
+    On the first run, all animes are indexed in a single segment.
+    """
+    writer = SegmentedIndexWriter()
+    indexed = writer.live_checksums()
+
+    num_documents = len(list(Path(SEARCH_INFO_DIRECTORY).glob("*.txt")))
+
+    changed = {}
+    for i in range(num_documents):
+        words = load_search_info_words(i)
+        if indexed.get(i) != words_checksum(words):
+            changed[i] = words
+
+    deleted = [document_id for document_id in indexed if document_id >= num_documents]
+
+    writer.delete_documents(deleted)
+    writer.add_documents(changed)
+
+    print(f"{len(changed)} animes added or updated, {len(deleted)} deleted")
+
+    while writer.merge():
+        pass
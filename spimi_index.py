@@ -0,0 +1,158 @@
+import heapq
+import mmap
+import shutil
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from compression_utils import encode_varint, encode_postings, decode_varint, decode_postings, write_compressed_index
+from constants import SEARCH_INFO_DIRECTORY, FIRST_INDEX_FILE, FIRST_INDEX_BINARY_FILE, INDEX_MEMORY_BUDGET, \
+    INDEX_RUNS_DIRECTORY, VERBOSE
+from instrumentation import Stage
+from utils import load_search_info_words, save_vocabulary
+
+# Rough estimates of the memory used by the in-memory block, to decide when to spill it to disk
+POSTING_SIZE = 36  # A reference in a list plus an int object
+TERM_SIZE = 200  # A dict entry plus an (initially small) list
+
+
+class SpimiIndexBuilder:
+    """
+    Single-pass in-memory indexer (SPIMI) building the first index within a bounded amount of memory.
+
+    Term IDs are assigned on the fly, in order of first appearance, so no separate pass to build the vocabulary is
+    needed. Postings are accumulated in an in-memory block which, once it exceeds the memory budget, is sorted by term
+    ID and spilled to a run file on disk. In the end, all runs are merged into the final index.
+    """
+
+    def __init__(self, memory_budget: int = INDEX_MEMORY_BUDGET, runs_directory: str = INDEX_RUNS_DIRECTORY):
+        self.memory_budget = memory_budget
+        self.runs_directory = Path(runs_directory)
+
+        self.vocabulary: list[str] = []  # The n-th word has ID n
+        self.word_ids: dict[str, int] = {}
+
+        self._block = defaultdict(list)
+        self._block_size = 0
+        self._runs: list[Path] = []
+
+    def add_document(self, document_id: int, words: Iterable[str]):
+        """
+        Add a document to the index. Documents must be added in increasing order of ID.
+        """
+        for word in dict.fromkeys(words):  # Remove duplicates, keeping the words' order
+            term_id = self.word_ids.get(word)
+            if term_id is None:
+                term_id = self.word_ids[word] = len(self.vocabulary)
+                self.vocabulary.append(word)
+
+            postings = self._block[term_id]
+            if not postings:
+                self._block_size += TERM_SIZE
+            postings.append(document_id)
+            self._block_size += POSTING_SIZE
+
+        if self._block_size >= self.memory_budget:
+            self._spill()
+
+    def _spill(self):
+        """Write the in-memory block to a new run file, sorted by term ID, and empty it."""
+        if not self._block:
+            return
+
+        self.runs_directory.mkdir(exist_ok=True)
+        run_path = self.runs_directory / f"run_{len(self._runs):05}.bin"
+
+        # Each entry in the run is the term ID, the length of its encoded posting list and the posting list itself
+        with open(run_path, "wb") as fout:
+            for term_id in sorted(self._block):
+                out = bytearray()
+                postings = encode_postings(self._block[term_id])
+                encode_varint(term_id, out)
+                encode_varint(len(postings), out)
+                fout.write(out)
+                fout.write(postings)
+
+        self._runs.append(run_path)
+        self._block = defaultdict(list)
+        self._block_size = 0
+
+        if VERBOSE:
+            print(f"Spilled run #{len(self._runs)} to {run_path}")
+
+    @staticmethod
+    def _read_run(run_path: Path) -> Iterator[tuple[int, list[int]]]:
+        """Iterate the (term ID, document IDs) pairs in a run file, in increasing order of term ID."""
+        with open(run_path, "rb") as fin, mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            position = 0
+            while position < len(buffer):
+                term_id, position = decode_varint(buffer, position)
+                length, position = decode_varint(buffer, position)
+                yield term_id, decode_postings(buffer, position, position + length)
+                position += length
+
+    def _merged_postings(self) -> Iterator[list[int]]:
+        """
+        Merge all runs, yielding the complete posting list of each term in increasing order of term ID.
+
+        Runs are created in increasing order of document ID and `heapq.merge` is stable, so concatenating the partial
+        posting lists of a term keeps them sorted.
+        """
+        runs = [self._read_run(run_path) for run_path in self._runs]
+
+        current_term_id, current_postings = None, []
+        for term_id, postings in heapq.merge(*runs, key=lambda entry: entry[0]):
+            if term_id != current_term_id:
+                if current_term_id is not None:
+                    yield current_postings
+                current_term_id, current_postings = term_id, []
+            current_postings.extend(postings)
+
+        if current_term_id is not None:
+            yield current_postings
+
+    def finish(self):
+        """
+        Merge the runs into the final index, saved in both text and compressed format, and save the vocabulary.
+        Then delete the runs.
+        """
+        self._spill()
+
+        try:
+            with open(FIRST_INDEX_FILE, "w") as out_txt:
+
+                def save_as_text(index: Iterable[list[int]]) -> Iterator[list[int]]:
+                    """Save each posting list to the text index as it is merged, before passing it on."""
+                    for document_ids in index:
+                        out_txt.write(" ".join(str(doc_id) for doc_id in document_ids) + "\n")
+                        yield document_ids
+
+                write_compressed_index(
+                    len(self.vocabulary), save_as_text(self._merged_postings()), FIRST_INDEX_BINARY_FILE
+                )
+
+            save_vocabulary(self.vocabulary)
+        finally:
+            shutil.rmtree(self.runs_directory, ignore_errors=True)
+            self._runs = []
+
+
+if __name__ == "__main__":
+    """
+    This script builds the vocabulary and the first index from the tokenized synopses in a single pass, using a
+    bounded amount of memory regardless of the number of documents.
+
+    Words get different IDs than with `create_vocabulary.py`, so the second index must be rebuilt afterwards.
+    """
+    files_to_parse = sorted(Path(SEARCH_INFO_DIRECTORY).glob("*.txt"))
+
+    builder = SpimiIndexBuilder()
+
+    with Stage("spimi_index", total=len(files_to_parse)) as stage:
+        for i, path in enumerate(files_to_parse):
+            with stage.timed_item():
+                builder.add_document(i, load_search_info_words(i))
+
+        builder.finish()
+
+    print(f"The vocabulary contains {len(builder.vocabulary)} words.")
@@ -0,0 +1,338 @@
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import requests
+
+from build_indexes import index_documents, save_indexes
+from constants import ANIMES_ARCHIVE, CRAWLER_CONCURRENCY, PARSE_CHUNK_SIZE, LEMMATIZE_CHUNK_SIZE, LEMMA_CACHE_FILE, \
+    SEGMENTS_DIRECTORY, SEGMENTS_MANIFEST_FILE, STREAM_QUEUE_SIZE, STREAM_BATCH_SIZE, STREAM_CHECKPOINT_DIRECTORY, \
+    POSITIONAL_ANALYSIS, NUM_WORKERS
+from crawler import Crawler
+from custom_metrics_utils import metadata_from_rows, save_metadata
+from document_store import write_document_store
+from extract_search_info import download_nltk_data, get_analyzer, lemmatize_chunk
+from instrumentation import Stage
+from page_archive import PageArchive, anime_key
+from parse_pages import parse_anime, anime_row
+from positional_index_utils import build_positional_index, save_positional_index
+from utils import Anime, atomic_open, load_urls
+
+_END = None  # Put in a queue after the last item
+
+
+class StopIngest(Exception):
+    """Raised in a stage's thread when another stage failed, so that it stops instead of blocking forever."""
+
+
+def parse_pages_chunk(pages: list[tuple[int, bytes]]) -> list[tuple[int, Optional[Anime], Optional[str], float]]:
+    """
+    Parse a chunk of pages in a worker process, returning for each of them its ID, the parsed anime or the error if
+    parsing failed, and how long it took.
+    """
+    results = []
+
+    for i, page in pages:
+        start = time.perf_counter()
+        try:
+            results.append((i, parse_anime(page, i + 1), None, time.perf_counter() - start))
+        except Exception:
+            results.append((i, None, traceback.format_exc(), time.perf_counter() - start))
+
+    return results
+
+
+def chunks(items: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class StreamingIngest:
+    """
+    Ingest the animes end to end without materializing a file per anime: the pages are fetched, parsed, lemmatized
+    and indexed by stages connected by bounded queues, so that each stage blocks (instead of piling up items in
+    memory) when the next one falls behind.
+
+    Pages are fetched by threads, from the page archive if already downloaded or else from the web; parsing and
+    lemmatization run in a pool of worker processes, with a bounded number of chunks in flight; the indexing stage,
+    in the calling thread, collects the results.
+
+    Every `batch_size` documents, the parsed fields and lemmas of the documents collected since the previous checkpoint
+    are written to a new `batch_NNNNN.json` file in the checkpoint directory, and the batches are merged back when
+    resumed, so that an interrupted ingest only processes the remaining documents. Once all documents are ingested, the
+    indexes, the document store and the metadata are written, and the checkpoint directory is removed. Documents
+    that could not be fetched or parsed are reported, and retried when the ingest is run again.
+    """
+
+    def __init__(
+            self,
+            urls: list[str],
+            num_workers: Optional[int] = NUM_WORKERS,
+            queue_size: int = STREAM_QUEUE_SIZE,
+            batch_size: int = STREAM_BATCH_SIZE,
+            checkpoint_directory: str = STREAM_CHECKPOINT_DIRECTORY
+    ):
+        self.urls = urls
+        self.num_workers = num_workers or os.cpu_count()
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.checkpoint_directory = Path(checkpoint_directory)
+        self.max_in_flight = 2 * self.num_workers  # Chunks submitted to the worker processes by each stage at once
+
+        self.failed: dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._errors: list[BaseException] = []
+
+    def load_checkpoint(self) -> dict[int, dict]:
+        """Return the documents checkpointed by previous runs, mapped to by their IDs."""
+        documents = {}
+
+        for path in sorted(self.checkpoint_directory.glob("batch_*.json")):
+            with open(path, "r") as fin:
+                documents.update((int(i), document) for i, document in json.load(fin).items())
+
+        return documents
+
+    def _checkpoint(self, batch: dict[int, dict]):
+        self.checkpoint_directory.mkdir(exist_ok=True)
+        batch_number = len(list(self.checkpoint_directory.glob("batch_*.json")))
+
+        with atomic_open(str(self.checkpoint_directory / f"batch_{batch_number:05}.json")) as fout:
+            json.dump({str(i): document for i, document in batch.items()}, fout)
+
+    def _fail(self, i: int, error: str):
+        with self._lock:
+            self.failed[i] = error
+
+    def _put(self, items: queue.Queue, item):
+        """Put an item in a queue, waiting while it's full unless the ingest is stopped."""
+        while True:
+            if self._stop.is_set():
+                raise StopIngest()
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _get_all(self, items: queue.Queue) -> Iterator:
+        """Yield the items put in a queue, until the end of the stream."""
+        while True:
+            if self._stop.is_set():
+                raise StopIngest()
+            try:
+                item = items.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _END:
+                return
+            yield item
+
+    def _run_stage(self, target, *args):
+        """Run a stage in its thread, signalling the end of its output even if it fails, and recording its error."""
+        output = args[-1]
+        try:
+            target(*args)
+        except StopIngest:
+            pass
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            try:
+                self._put(output, _END)
+            except StopIngest:
+                pass
+
+    def _fetch(self, document_ids: list[int], pages: queue.Queue):
+        archive = PageArchive(ANIMES_ARCHIVE)
+        crawler = Crawler(self.urls, None, None)
+
+        def fetch(i: int):
+            if self._stop.is_set():
+                return
+
+            start = time.perf_counter()
+            error = "download failed"
+            try:
+                page = archive.get(anime_key(i)) if anime_key(i) in archive else crawler.fetch(i)
+            except requests.HTTPError as err:
+                page, error = None, str(err)
+
+            if page is None:
+                self._fail(i, error)
+                stage.error()
+                return
+
+            self._put(pages, (i, page))
+            stage.item(time.perf_counter() - start)
+
+        with Stage("stream_fetch", total=len(document_ids)) as stage:
+            crawler.stage = stage
+            with ThreadPoolExecutor(CRAWLER_CONCURRENCY) as executor:
+                for _ in executor.map(fetch, document_ids):
+                    pass
+
+    def _parse(self, executor: ProcessPoolExecutor, pages: queue.Queue, parsed: queue.Queue):
+        def collect(future):
+            for i, anime, error, seconds in future.result():
+                if error is not None:
+                    self._fail(i, error)
+                    stage.error()
+                else:
+                    self._put(parsed, (i, anime_row(anime)))
+                    stage.item(seconds)
+
+        with Stage("stream_parse") as stage:
+            in_flight = deque()
+            for chunk in chunks(self._get_all(pages), PARSE_CHUNK_SIZE):
+                in_flight.append(executor.submit(parse_pages_chunk, chunk))
+                if len(in_flight) >= self.max_in_flight:
+                    collect(in_flight.popleft())
+            while in_flight:
+                collect(in_flight.popleft())
+
+    def _lemmatize(self, executor: ProcessPoolExecutor, parsed: queue.Queue, lemmatized: queue.Queue):
+        analyzer = get_analyzer()  # Only used to collect and persist the workers' cache entries
+
+        def collect(chunk, future):
+            lemmas, new_cache_entries, durations = future.result()
+            analyzer.add_entries(new_cache_entries)
+            for (i, row), synopsis_lemmas, seconds in zip(chunk, lemmas, durations):
+                self._put(lemmatized, (i, row, synopsis_lemmas))
+                stage.item(seconds)
+
+        with Stage("stream_lemmatize") as stage:
+            in_flight = deque()
+            for chunk in chunks(self._get_all(parsed), LEMMATIZE_CHUNK_SIZE):
+                # The synopsis is the 11th field, as in the TSV files
+                in_flight.append((chunk, executor.submit(lemmatize_chunk, [row[10] for _, row in chunk])))
+                if len(in_flight) >= self.max_in_flight:
+                    collect(*in_flight.popleft())
+            while in_flight:
+                collect(*in_flight.popleft())
+
+    def _index(self, lemmatized: queue.Queue, documents: dict[int, dict]):
+        with Stage("stream_index") as stage:
+            batch = {}
+            for i, row, lemmas in self._get_all(lemmatized):
+                batch[i] = {"row": row, "lemmas": lemmas}
+                stage.item()
+
+                if len(batch) >= self.batch_size:
+                    self._checkpoint(batch)
+                    documents.update(batch)
+                    batch = {}
+
+            if batch:
+                self._checkpoint(batch)
+                documents.update(batch)
+
+    def run(self) -> bool:
+        """
+        Ingest the documents not checkpointed yet, and write the outputs if all documents are ingested. Return whether
+        they were.
+        """
+        documents = self.load_checkpoint()
+        pending = [i for i in range(len(self.urls)) if i not in documents]
+        print(f"{len(documents)} documents checkpointed, {len(pending)} to ingest")
+
+        download_nltk_data()
+
+        pages, parsed, lemmatized = (queue.Queue(self.queue_size) for _ in range(3))
+        with ProcessPoolExecutor(self.num_workers) as executor:
+            # Start all the workers now, before the stages' threads, rather than forking them from a busy process
+            for future in [executor.submit(os.getpid) for _ in range(self.num_workers)]:
+                future.result()
+
+            threads = [
+                threading.Thread(target=self._run_stage, args=(self._fetch, pending, pages)),
+                threading.Thread(target=self._run_stage, args=(self._parse, executor, pages, parsed)),
+                threading.Thread(target=self._run_stage, args=(self._lemmatize, executor, parsed, lemmatized)),
+            ]
+            for thread in threads:
+                thread.start()
+
+            try:
+                self._index(lemmatized, documents)
+            except StopIngest:
+                pass
+            except BaseException as e:
+                self._errors.append(e)
+                self._stop.set()
+            finally:
+                for thread in threads:
+                    thread.join()
+                get_analyzer().save_cache(LEMMA_CACHE_FILE)
+
+        if self._errors:
+            raise self._errors[0]
+
+        if self.failed:
+            print(f"{len(self.failed)} documents could not be ingested, relaunch to retry them: {sorted(self.failed)}")
+            return False
+
+        self.write_outputs(documents)
+        shutil.rmtree(self.checkpoint_directory, ignore_errors=True)
+        return True
+
+    def write_outputs(self, documents: dict[int, dict]):
+        """
+        Write the indexes (the positional one too, with positional analysis), the document store and the metadata of
+        all the documents.
+        """
+        num_documents = len(self.urls)
+        rows = [documents[i]["row"] for i in range(num_documents)]
+        documents_words = [documents[i]["lemmas"] for i in range(num_documents)]
+
+        vocabulary, _, _ = save_indexes(num_documents, [index_documents(range(num_documents), documents_words)])
+        if POSITIONAL_ANALYSIS:
+            word_ids = {word: i for i, word in enumerate(vocabulary)}
+            save_positional_index(build_positional_index(num_documents, documents_words, word_ids))
+        # The title and synopsis are the 1st and 11th fields, as in the TSV files
+        write_document_store(num_documents, ((row[0], row[10], self.urls[i]) for i, row in enumerate(rows)))
+        save_metadata(metadata_from_rows(num_documents, rows))
+
+        if os.path.exists(os.path.join(SEGMENTS_DIRECTORY, SEGMENTS_MANIFEST_FILE)):
+            self.update_segments(documents_words)
+
+    @staticmethod
+    def update_segments(documents_words: list[list[str]]):
+        """Bring the segmented index, if it was built, up to date with the ingested documents."""
+        from segments import SegmentedIndexWriter, words_checksum  # Imported here since it loads the whole index module
+
+        writer = SegmentedIndexWriter()
+        indexed = writer.live_checksums()
+
+        writer.delete_documents([i for i in indexed if i >= len(documents_words)])
+        writer.add_documents({
+            i: words for i, words in enumerate(documents_words) if indexed.get(i) != words_checksum(words)
+        })
+        while writer.merge():
+            pass
+
+
+if __name__ == "__main__":
+    """
+    This script runs the whole pipeline in streaming mode, from fetching the pages in the "top_anime_urls.txt" file
+    (or reading them from the archive, if already downloaded) to writing the indexes and the document store, without
+    writing the intermediate TSV and search info files.
+
+    If stopped, it can be relaunched as is and will continue from its last checkpoint.
+    """
+    StreamingIngest(load_urls()).run()
@@ -0,0 +1,211 @@
+import os
+import random
+from datetime import datetime, timedelta
+from html import escape
+from pathlib import Path
+
+from constants import ANIMES_ARCHIVE, PARSED_ANIMES_DIRECTORY, SEARCH_INFO_DIRECTORY, TOP_ANIME_URLS_FILE
+from page_archive import PageArchive, anime_key
+from utils import Anime, search_info_filename
+
+SYLLABLES = [
+    "ka", "ki", "ku", "ke", "ko", "sa", "shi", "su", "se", "so", "ta", "chi", "tsu", "te", "to", "na", "ni", "nu",
+    "ne", "no", "ha", "hi", "fu", "he", "ho", "ma", "mi", "mu", "me", "mo", "ya", "yu", "yo", "ra", "ri", "ru", "re",
+    "ro", "wa", "ga", "gi", "gu", "ge", "go", "za", "ji", "zu", "ze", "zo", "da", "de", "do", "ba", "bi", "bu", "be",
+    "bo", "pa", "pi", "pu", "pe", "po", "n",
+]
+TYPES = ["TV", "Movie", "OVA", "ONA", "Special", "Music"]
+ROLES = ["Director", "Producer", "Music", "Script", "Character Design"]
+
+MIN_SYNOPSIS_WORDS = 20
+MAX_SYNOPSIS_WORDS = 200
+
+
+def synthetic_vocabulary(num_words: int, seed: int = 0) -> list[str]:
+    """
+    Return `num_words` distinct made-up words, always the same for a given seed.
+
+    Words are made of Japanese-like syllables and are already lowercase lemmas, so that lemmatizing a synopsis made of
+    them gives back the same words.
+    """
+    rng = random.Random(seed)
+    words = {}  # Used as an ordered set, so that the output doesn't depend on the process' hash seed
+
+    while len(words) < num_words:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 5)))
+        words[word] = None
+
+    return list(words)
+
+
+def vocabulary_size(num_documents: int) -> int:
+    """Grow the vocabulary with the corpus like natural language does (Heaps' law), with at least 5000 words."""
+    return max(5000, int(400 * num_documents ** 0.5))
+
+
+def synthetic_anime(i: int, vocabulary: list[str], num_documents: int, seed: int = 0) -> Anime:
+    """
+    Return the i-th anime of a synthetic corpus, always the same for a given seed whatever the others.
+
+    Synopsis words follow a Zipf-like distribution, so that some words are in most synopses and most are rare.
+    """
+    rng = random.Random(seed * 1_000_003 + i)
+    anime = Anime()
+
+    anime.animeTtle = " ".join(rng.choice(vocabulary).capitalize() for _ in range(rng.randint(1, 4))) + f" {i}"
+    anime.animeType = rng.choice(TYPES)
+    anime.animeNumEpisode = rng.randint(1, 100) if rng.random() < 0.95 else None
+
+    if rng.random() < 0.9:
+        anime.releaseDate = datetime(1960, 1, 1) + timedelta(days=rng.randrange(60 * 365))
+        anime.endDate = anime.releaseDate + timedelta(days=rng.randrange(2 * 365)) if rng.random() < 0.8 else None
+    else:
+        anime.releaseDate, anime.endDate = None, None
+
+    anime.animeNumMembers = int(10 ** rng.uniform(2, 6.5))
+    anime.animeScore = rng.randint(1, 10) if rng.random() < 0.9 else None
+    anime.animeUsers = int(anime.animeNumMembers * rng.uniform(0.1, 0.9)) if anime.animeScore is not None else None
+    anime.animeRank = i + 1
+    anime.animePopularity = rng.randint(1, num_documents)
+
+    num_words = rng.randint(MIN_SYNOPSIS_WORDS, MAX_SYNOPSIS_WORDS)
+    anime.animeDescription = " ".join(
+        vocabulary[int(len(vocabulary) ** rng.random()) - 1] for _ in range(num_words)
+    )
+
+    # Related animes are deduplicated by name when parsed
+    anime.animeRelated = list(dict.fromkeys(f"Related {rng.randrange(num_documents)}" for _ in range(rng.randint(0, 3))))
+    anime.animeCharacters = [f"Character {i}-{k}" for k in range(rng.randint(0, 6))]
+    anime.animeVoices = [f"Voice {rng.randrange(10 * num_documents)}" for _ in anime.animeCharacters]
+    anime.animeStaff = [[f"Staff {rng.randrange(num_documents)}", rng.choice(ROLES)] for _ in range(rng.randint(0, 4))]
+
+    return anime
+
+
+def _format_date(date) -> str:
+    return f"{date:%b} {date.day}, {date.year}" if date is not None else "?"
+
+
+def render_anime_page(anime: Anime, i: int) -> bytes:
+    """
+    Render an anime's page with the same structure as MyAnimeList's, as far as `parse_pages.py` is concerned.
+    """
+    if anime.releaseDate is None:
+        aired = "Not available"
+    elif anime.endDate is None:
+        aired = f"{_format_date(anime.releaseDate)} to ?"
+    else:
+        aired = f"{_format_date(anime.releaseDate)} to {_format_date(anime.endDate)}"
+
+    related = "".join(
+        f'<a href="/anime/{k}/Related">{escape(name)}</a>, ' for k, name in enumerate(anime.animeRelated)
+    ) + '<a href="/manga/1/Manga">Manga</a>'
+    characters = "".join(
+        f'<tr><td><h3 class="h3_characters_voice_actors"><a href="/character/{k}">{escape(character)}</a></h3></td>'
+        f'<td><a href="/people/{k}/Voice">{escape(voice)}</a></td></tr>'
+        for k, (character, voice) in enumerate(zip(anime.animeCharacters, anime.animeVoices))
+    )
+    staff = "".join(
+        f'<tr><td><a href="/people/{k}"><img src="staff.jpg"/></a></td><td><a href="/people/{k}/Staff">{escape(name)}'
+        f'</a><div class="spaceit_pad"><small>{role}</small></div></td></tr>'
+        for k, (name, role) in enumerate(anime.animeStaff)
+    )
+    episodes = anime.animeNumEpisode if anime.animeNumEpisode is not None else "Unknown"
+    score = anime.animeScore if anime.animeScore is not None else "N/A"
+    users = anime.animeUsers if anime.animeUsers is not None else "-"
+
+    return f"""<html><head><title>{escape(anime.animeTtle)} - MyAnimeList.net</title></head><body>
+<div class="h1-title"><div><h1 class="title-name"><strong>{escape(anime.animeTtle)}</strong></h1></div></div>
+<div class="leftside">
+<div class="spaceit_pad"><span class="dark_text">Type:</span> {anime.animeType}</div>
+<div class="spaceit_pad"><span class="dark_text">Episodes:</span> {episodes}</div>
+<div class="spaceit_pad"><span class="dark_text">Aired:</span> {aired}</div>
+</div>
+<span class="numbers members">{anime.animeNumMembers:,}</span>
+<span class="numbers popularity">{anime.animePopularity:,}</span>
+<span itemprop="ratingValue">{score}</span>
+<span itemprop="ratingCount" class="ratingCount">{users}</span>
+<p itemprop="description">{escape(anime.animeDescription)}</p>
+<table class="anime_detail_related_anime"><tr><td>{related}</td></tr></table>
+<div class="detail-characters-list"><table>{characters}</table></div>
+<div class="detail-characters-list"><table>{staff}</table></div>
+</body></html>""".encode("utf-8")
+
+
+def anime_url(i: int, anime: Anime) -> str:
+    return f"https://myanimelist.net/anime/{i + 1}/{anime.animeTtle.replace(' ', '_')}"
+
+
+def generate_corpus(directory: str, num_documents: int, seed: int = 0, verbose: bool = True):
+    """
+    Generate a synthetic corpus of `num_documents` animes in a directory, in the layout the pipeline scripts expect:
+    the archive of the animes' pages, their URLs, and the output of `parse_pages.py` (TSV files) and of
+    `extract_search_info.py` (search info files), so that any stage can be run on its own.
+
+    The same seed always gives the same corpus.
+    """
+    from parse_pages import save_anime  # Imported here since it loads the whole parsing module
+
+    cwd = os.getcwd()
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    os.chdir(directory)  # The pipeline's paths are relative to the working directory
+
+    try:
+        Path(PARSED_ANIMES_DIRECTORY).mkdir(exist_ok=True)
+        Path(SEARCH_INFO_DIRECTORY).mkdir(exist_ok=True)
+
+        vocabulary = synthetic_vocabulary(vocabulary_size(num_documents), seed)
+        archive = PageArchive(ANIMES_ARCHIVE)
+        urls = []
+
+        for i in range(num_documents):
+            anime = synthetic_anime(i, vocabulary, num_documents, seed)
+            url = anime_url(i, anime)
+            urls.append(url)
+
+            if anime_key(i) not in archive:
+                archive.put(anime_key(i), render_anime_page(anime, i), url)
+            save_anime(i, anime)
+            write_search_info(i, anime, url)
+
+            if verbose and i % 10000 == 0:
+                print(f"{i}/{num_documents}...")
+
+        with open(TOP_ANIME_URLS_FILE, "w") as fout:
+            fout.write("\n".join(urls) + "\n")
+    finally:
+        os.chdir(cwd)
+
+
+def write_search_info(i: int, anime: Anime, url: str):
+    """Write the search info file of an anime, its synopsis' words being their own lemmas."""
+    with open(os.path.join(SEARCH_INFO_DIRECTORY, search_info_filename(i)), "w") as out_txt:
+        out_txt.write(anime.animeTtle.strip() + "\n")
+        out_txt.write(url.strip() + "\n")
+        out_txt.write("\n".join(anime.animeDescription.split()))
+
+
+def regenerate_search_info(directory: str, num_documents: int, seed: int = 0):
+    """Rewrite the search info files of a synthetic corpus, e.g. after they were overwritten by a failed stage."""
+    cwd = os.getcwd()
+    os.chdir(directory)
+
+    try:
+        Path(SEARCH_INFO_DIRECTORY).mkdir(exist_ok=True)
+        vocabulary = synthetic_vocabulary(vocabulary_size(num_documents), seed)
+        with open(TOP_ANIME_URLS_FILE, "r") as fin:
+            urls = [url.strip() for url in fin.readlines()]
+
+        for i in range(num_documents):
+            write_search_info(i, synthetic_anime(i, vocabulary, num_documents, seed), urls[i])
+    finally:
+        os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    """
+    This script generates a small synthetic corpus in the `synthetic` directory, to try the pipeline without
+    downloading anything (see `benchmark_suite.py` for larger ones).
+    """
+    generate_corpus("synthetic", 1000)
+    print(f"Synthetic corpus generated in {os.path.abspath('synthetic')}")
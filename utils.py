@@ -1,10 +1,12 @@
 import csv
 import os
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
+from typing import Iterable, Optional
 
 from constants import TOP_CHARTS_PAGE_NAME, ANIME_PAGE_NAME, PARSED_ANIME_PAGE_NAME, SEARCH_INFO_FILE_NAME, \
-    PARSED_ANIMES_DIRECTORY, TOP_ANIME_URLS_FILE
+    PARSED_ANIMES_DIRECTORY, TOP_ANIME_URLS_FILE, VOCABULARY_FILE, SEARCH_INFO_DIRECTORY
 
 
 def top_anime_filename(page):
@@ -49,12 +51,63 @@ def prepare_to_download(directory: str) -> int:
     return len(list(directory.glob("*.html")))
 
 
-def retrieve_title_synopsis_and_url(i: int) -> tuple[str, str, str]:
+def load_vocabulary(path: str = VOCABULARY_FILE) -> dict[str, int]:
+    """
+    Load the vocabulary from the file where it was saved, mapping each term to its ID.
+    """
+    with open(path, "r") as fin:
+        return {word.strip(): i for i, word in enumerate(fin.readlines())}
+
+
+def save_vocabulary(vocabulary: Iterable[str]):
+    """
+    Save the vocabulary to a file, one word per line, the ID of each word being implied by the order.
+    """
+    with open(VOCABULARY_FILE, "w") as out_txt:
+        out_txt.write("\n".join(vocabulary))
+
+
+def load_search_info_words(i: int) -> list[str]:
+    """
+    Return the lemmas of the i-th anime's synopsis, as stored in its search info file.
+    """
+    with open(os.path.join(SEARCH_INFO_DIRECTORY, search_info_filename(i)), "r") as fin:
+        return [word.strip() for word in fin.readlines()[2:]]  # Skip title and URL
+
+
+def load_urls(path: str = TOP_ANIME_URLS_FILE) -> list[str]:
+    """
+    Load the URLs of all animes, in the order of their IDs.
+    """
+    with open(path, "r") as url_file:
+        return [url.strip() for url in url_file.readlines()]
+
+
+@contextmanager
+def atomic_open(path: str, mode: str = "w"):
+    """
+    Open a file for writing through a temporary file, which replaces it only once successfully closed.
+
+    This way, an interrupted write never leaves a partially written file behind.
+    """
+    temporary_path = f"{path}.tmp"
+    try:
+        with open(temporary_path, mode) as fout:
+            yield fout
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def retrieve_title_synopsis_and_url(i: int, urls: Optional[list[str]] = None) -> tuple[str, str, str]:
     """
     Return the title, unprocessed synopsis and url of the i-th anime.
+
+    The list of URLs can be supplied if already loaded, to avoid reading it again.
     """
-    with open(TOP_ANIME_URLS_FILE, "r") as url_file:
-        urls = [url.strip() for url in url_file.readlines()]
+    if urls is None:
+        urls = load_urls()
 
     with open(os.path.join(PARSED_ANIMES_DIRECTORY, parsed_anime_filename(i)), "r") as fin:
         csv_reader = csv.reader(fin, delimiter="\t")